@@ -39,16 +39,15 @@ c.BasicPipeline.rate_limit_intervals = {'/data5': 120}
 c.BasicPipeline.use_watchdog = True
 
 c.AcquireImagesProcess.trigger_interval = 2
-c.AcquireImagesProcess.initial_camera_configuration = [("AcquisitionFrameCount", "1"),
-                                                       ('AcquisitionFrameRateAbs', "1.3"),
+c.AcquireImagesProcess.initial_camera_configuration = [('AcquisitionFrameRateAbs', "1.3"),
                                                        ('ExposureTimeAbs', "100000"),
                                                        ('EFLensFocusCurrent', "940")]
 
 ##
 c.GlobalConfiguration.pipeline_pyro_port = 50000
 
-c.Controller.hot_pixel_file_dictionary = {4:'hot_pixels_02-2636D-07229_000f3102fb57.npy',
-                                          }
+c.GlobalConfiguration.hot_pixel_file_dictionary = {4:'hot_pixels_02-2636D-07229_000f3102fb57.npy',
+                                                    }
 
 # ------------------------------------------------------------------------------
 # Communicator(GlobalConfiguration) configuration
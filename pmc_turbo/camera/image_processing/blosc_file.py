@@ -1,9 +1,14 @@
+import json
 import logging
+import struct
 
 import blosc
 import numpy as np
 
+from pmc_turbo.camera.image_processing.container_file import parse_reference, read_reference
 from pmc_turbo.camera.pycamera import dtypes
+from pmc_turbo.camera.pycamera.geometry import FrameGeometry, full_frame_geometry
+from pmc_turbo.utils.bit_packing import fits_in_bits, pack_bits, packed_num_bytes, unpack_bits
 
 logger = logging.getLogger(__name__)
 
@@ -12,22 +17,333 @@ logger = logging.getLogger(__name__)
 original_nthreads = blosc.set_nthreads(1)
 logger.debug("Set blosc to use 1 thread, originally was using %d" % original_nthreads)
 
-def load_blosc_file(filename):
-    logger.debug("Reading blosc file from %s" % filename)
+# Files written by compress_image_blosc start with a small header describing how the data was compressed:
+#   magic (8 bytes), header length (little endian uint32), JSON encoded dict of parameters
+# followed by the blosc compressed data. Files written before the header was introduced are plain blosc data.
+# If the header has packed_bits, the image was packed with bit_packing.pack_bits before compression and the compressed
+# data holds the packed image followed by the chunk data.
+# If the header has band_rows, the image was split into bands of that many rows, each packed (if packed_bits is set) and
+# compressed separately so a region can be loaded by decompressing only the bands it overlaps (see load_blosc_region).
+# band_sizes gives the compressed size of each band followed by the size of the compressed chunk data that ends the
+# file.
+# Anywhere a filename is accepted, a reference to a frame in a segment file (see container_file.py) can be used instead.
+BLOSC_FILE_MAGIC = 'PMCBLOSC'
+header_length_format = '<I'
+header_prefix_num_bytes = len(BLOSC_FILE_MAGIC) + struct.calcsize(header_length_format)
+BLOSC_FILE_HEADER_MAX_BYTES = 4096
+BLOSC_MAX_OVERHEAD = 16  # bytes, blosc never expands data by more than this
+MAX_NUM_BANDS = 256  # keeps the band table within the header
+
+shuffle_modes = dict(none=blosc.NOSHUFFLE, byte=blosc.SHUFFLE, bit=blosc.BITSHUFFLE)
+
+
+def make_file_header(parameters):
+    header_json = json.dumps(parameters, sort_keys=True)
+    header = BLOSC_FILE_MAGIC + struct.pack(header_length_format, len(header_json)) + header_json
+    if len(header) > BLOSC_FILE_HEADER_MAX_BYTES:
+        raise ValueError("Header is %d bytes, more than the maximum of %d" % (len(header), BLOSC_FILE_HEADER_MAX_BYTES))
+    return header
+
+
+def split_file_header(file_contents):
+    """
+    Separate the header from the compressed data
+
+    Parameters
+    ----------
+    file_contents : str
+        Entire contents of a blosc file
+
+    Returns
+    -------
+    header : dict
+        Compression parameters. Empty for files written without a header.
+    compressed_data : buffer
+    """
+    if not file_contents.startswith(BLOSC_FILE_MAGIC):
+        return {}, file_contents
+    header_length, = struct.unpack(header_length_format,
+                                   file_contents[len(BLOSC_FILE_MAGIC):header_prefix_num_bytes])
+    header_end = header_prefix_num_bytes + header_length
+    header = json.loads(file_contents[header_prefix_num_bytes:header_end])
+    return header, buffer(file_contents, header_end)
+
+
+def read_file_contents(filename):
+    """
+    Return the contents of a file, or of the frame data a segment reference points to
+    """
+    if parse_reference(filename) is not None:
+        return read_reference(filename)
+    with open(filename, 'rb') as fh:
+        return fh.read()
+
+
+def read_file_range(filename, start, num_bytes):
+    """
+    Return *num_bytes* bytes from *start* of a file, or of the frame data a segment reference points to
+    """
+    parts = parse_reference(filename)
+    if parts is not None:
+        if parts[3]:
+            return read_reference(filename)[start:start + num_bytes]
+        filename, offset, length, _ = parts
+        start += offset
+        num_bytes = max(min(num_bytes, length - (start - offset)), 0)
     with open(filename, 'rb') as fh:
-        data = blosc.decompress(fh.read())
-    return data
+        fh.seek(start)
+        return fh.read(num_bytes)
+
+
+def read_blosc_header(filename):
+    """
+    Returns
+    -------
+    header : dict
+        Compression parameters. Empty for files written without a header.
+    data_offset : int
+        Position of the compressed data in the file
+    """
+    prefix = read_file_range(filename, 0, header_prefix_num_bytes)
+    if not prefix.startswith(BLOSC_FILE_MAGIC):
+        return {}, 0
+    header_length, = struct.unpack(header_length_format, prefix[len(BLOSC_FILE_MAGIC):])
+    return (json.loads(read_file_range(filename, header_prefix_num_bytes, header_length)),
+            header_prefix_num_bytes + header_length)
+
+
+def load_blosc_header(filename):
+    return read_blosc_header(filename)[0]
+
+
+def _decompress_bands(header, compressed_data, first_band, stop_band):
+    """
+    Decompress bands first_band to stop_band - 1 from *compressed_data*, which starts with band first_band
+
+    Returns
+    -------
+    uint16 array of the rows of the bands
+    """
+    geometry = get_geometry(header)
+    band_rows = header['band_rows']
+    bands = []
+    offset = 0
+    for band in range(first_band, stop_band):
+        band_data = blosc.decompress(buffer(compressed_data, offset, header['band_sizes'][band]))
+        offset += header['band_sizes'][band]
+        num_pixels = (min((band + 1) * band_rows, geometry.height) - band * band_rows) * geometry.width
+        if header.get('packed_bits'):
+            bands.append(unpack_bits(band_data, header['packed_bits'], num_pixels))
+        else:
+            bands.append(np.frombuffer(band_data, dtype='uint16'))
+    if not bands:
+        return np.zeros((0, geometry.width), dtype='uint16')
+    return np.concatenate(bands).reshape((-1, geometry.width))
+
+
+def load_blosc_file_with_header(filename):
+    logger.debug("Reading blosc file from %s" % filename)
+    header, compressed_data = split_file_header(read_file_contents(filename))
+    if 'band_rows' in header:
+        # Reassemble banded files into the layout of an unbanded file, with the image unpacked
+        band_sizes = header['band_sizes']
+        image = _decompress_bands(header, compressed_data, 0, len(band_sizes) - 1)
+        data = image.tostring() + blosc.decompress(buffer(compressed_data, sum(band_sizes[:-1])))
+        header = dict(header)
+        header.pop('packed_bits', None)
+        return header, data
+    # blosc records the codec, shuffle and type size in its own chunk header, so any variant decompresses the same way.
+    data = blosc.decompress(compressed_data)
+    return header, data
+
+
+def load_blosc_file(filename):
+    """
+    Return the decompressed contents of a blosc file. For files with packed_bits in the header, the image is still
+    packed; use load_blosc_image to unpack it. Banded files are returned as the image followed by the chunk data,
+    with the image unpacked.
+    """
+    return load_blosc_file_with_header(filename)[1]
+
+
+def get_geometry(header):
+    """
+    Return the FrameGeometry recorded in a file header. Files written before the geometry was recorded are full frames.
+    """
+    if 'geometry' in header:
+        return FrameGeometry.from_dict(header['geometry'])
+    return full_frame_geometry
+
 
 def load_blosc_image(filename):
-    data = load_blosc_file(filename)
-    image = np.frombuffer(data[:-dtypes.chunk_num_bytes], dtype='uint16')
-    image.shape = dtypes.image_dimensions
+    header, data = load_blosc_file_with_header(filename)
+    geometry = get_geometry(header)
+    num_pixels = geometry.width * geometry.height
+    if header.get('packed_bits'):
+        image = unpack_bits(data[:packed_num_bytes(num_pixels, header['packed_bits'])], header['packed_bits'],
+                            num_pixels)
+    else:
+        image = np.frombuffer(data[:geometry.image_num_bytes], dtype='uint16')
+    image.shape = geometry.image_shape
     chunk_data = np.frombuffer(data[-dtypes.chunk_num_bytes:], dtype=dtypes.chunk_dtype)
     return image, chunk_data
 
 
-def write_image_blosc(filename,data):
+def load_blosc_region(filename, row_slice=slice(None), column_slice=slice(None)):
+    """
+    Load part of an image
+
+    For files written with band_rows, only the bands overlapping *row_slice* are read and decompressed. Other files
+    are loaded completely.
+
+    Parameters
+    ----------
+    filename : str
+    row_slice, column_slice : slice
+        Region of the image to return. Steps must be positive.
+
+    Returns
+    -------
+    image : uint16 array
+        image[row_slice, column_slice] of the full image
+    chunk_data : chunk_dtype array
+    """
+    header, data_offset = read_blosc_header(filename)
+    if 'band_rows' not in header:
+        image, chunk_data = load_blosc_image(filename)
+        return image[row_slice, column_slice], chunk_data
+    geometry = get_geometry(header)
+    start, stop, step = row_slice.indices(geometry.height)
+    if step < 1:
+        raise ValueError("Row step must be positive, not %d" % step)
+    band_rows = header['band_rows']
+    band_sizes = header['band_sizes']
+    band_offsets = np.concatenate(([0], np.cumsum(band_sizes))).astype(int)
+    first_band = start // band_rows
+    stop_band = max(-(-stop // band_rows), first_band)
+    compressed_data = read_file_range(filename, data_offset + band_offsets[first_band],
+                                      band_offsets[stop_band] - band_offsets[first_band])
+    rows = _decompress_bands(header, compressed_data, first_band, stop_band)
+    first_row = first_band * band_rows
+    image = rows[start - first_row:stop - first_row:step, column_slice]
+    chunk_data = blosc.decompress(read_file_range(filename, data_offset + band_offsets[-2], band_sizes[-1]))
+    chunk_data = np.frombuffer(chunk_data[-dtypes.chunk_num_bytes:], dtype=dtypes.chunk_dtype)
+    return image, chunk_data
+
+
+def get_num_bands(geometry, band_rows):
+    """
+    Number of bands compress_image_blosc splits an image of *geometry* into, 0 for unbanded images
+    """
+    if not band_rows:
+        return 0
+    return -(-geometry.height // band_rows)
+
+
+def compress_raw_blosc(data, cname='lz4', clevel=9, shuffle='bit', blocksize=0):
+    """
+    Compress data with blosc, without adding a file header
+
+    Parameters
+    ----------
+    data : str or array
+    cname : str
+        Codec name, one of blosc.cnames
+    clevel : int
+        Compression level, 0-9
+    shuffle : str
+        'none', 'byte' or 'bit'
+    blocksize : int
+        blosc block size in bytes, 0 lets blosc choose
+
+    Returns
+    -------
+    str
+    """
+    if cname not in blosc.cnames:
+        raise ValueError("Codec %r is not supported by this blosc library, options are %r" % (cname, blosc.cnames))
+    blosc.set_blocksize(blocksize)
+    try:
+        return blosc.compress(data, clevel=clevel, shuffle=shuffle_modes[shuffle], cname=cname)
+    finally:
+        blosc.set_blocksize(0)
+
+
+def compress_image_blosc(data, geometry=None, cname='lz4', clevel=9, shuffle='bit', blocksize=0, packed_bits=0,
+                         band_rows=0):
+    """
+    Compress data with blosc and prefix it with a header recording the compression parameters and frame geometry
+
+    Parameters
+    ----------
+    data : str or array
+        Image followed by chunk data
+    geometry : FrameGeometry
+        Geometry of the image. If not given, the image is assumed to be a full frame.
+    packed_bits : int
+        If nonzero, pack the image to this many bits per pixel before compressing (see bit_packing.py). Images with
+        larger values are stored unpacked so no information is lost.
+    band_rows : int
+        If nonzero, compress the image in bands of this many rows, so regions can be loaded without decompressing the
+        whole image. The image must have at most MAX_NUM_BANDS bands.
+
+    See compress_raw_blosc for the other parameters.
+    """
+    if geometry is None:
+        geometry = full_frame_geometry
+    parameters = dict(cname=cname, clevel=clevel, shuffle=shuffle, blocksize=blocksize, geometry=geometry.to_dict())
+    if band_rows:
+        return _compress_image_bands(data, geometry, parameters, packed_bits, band_rows)
+    if packed_bits:
+        data = np.frombuffer(data, dtype=np.uint8)
+        image = data[:geometry.image_num_bytes].view('uint16')
+        if fits_in_bits(image, packed_bits):
+            data = np.concatenate((pack_bits(image, packed_bits), data[geometry.image_num_bytes:]))
+            parameters['packed_bits'] = packed_bits
+        else:
+            logger.warning("Image has values above %d bits, storing it unpacked" % packed_bits)
+    header = make_file_header(parameters)
+    return header + compress_raw_blosc(data, cname=cname, clevel=clevel, shuffle=shuffle, blocksize=blocksize)
+
+
+def _compress_image_bands(data, geometry, parameters, packed_bits, band_rows):
+    if get_num_bands(geometry, band_rows) > MAX_NUM_BANDS:
+        raise ValueError("%d row bands would split a %d row image into more than %d bands"
+                         % (band_rows, geometry.height, MAX_NUM_BANDS))
+    data = np.frombuffer(data, dtype=np.uint8)
+    image = data[:geometry.image_num_bytes].view('uint16').reshape(geometry.image_shape)
+    if packed_bits:
+        if fits_in_bits(image, packed_bits):
+            parameters['packed_bits'] = packed_bits
+        else:
+            logger.warning("Image has values above %d bits, storing it unpacked" % packed_bits)
+    compression = dict(cname=parameters['cname'], clevel=parameters['clevel'], shuffle=parameters['shuffle'],
+                       blocksize=parameters['blocksize'])
+    pieces = []
+    for start in range(0, geometry.height, band_rows):
+        band = image[start:start + band_rows]
+        if 'packed_bits' in parameters:
+            band = pack_bits(band, packed_bits)
+        pieces.append(compress_raw_blosc(band, **compression))
+    pieces.append(compress_raw_blosc(data[geometry.image_num_bytes:], **compression))
+    parameters['band_rows'] = band_rows
+    parameters['band_sizes'] = [len(piece) for piece in pieces]
+    return make_file_header(parameters) + ''.join(pieces)
+
+
+def write_compressed_blosc(filename, compressed_data):
+    """
+    Write data already compressed by compress_image_blosc to disk
+
+    Parameters
+    ----------
+    filename : str
+    compressed_data : str or uint8 array
+    """
     fh = open(filename,'w')
-    compressed_data = blosc.compress(data,shuffle=blosc.BITSHUFFLE,cname='lz4')
     fh.write(compressed_data)
-    fh.close()
\ No newline at end of file
+    fh.close()
+
+
+def write_image_blosc(filename, data, **compression_parameters):
+    write_compressed_blosc(filename, compress_image_blosc(data, **compression_parameters))
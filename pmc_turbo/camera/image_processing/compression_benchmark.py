@@ -0,0 +1,125 @@
+"""
+Measure how fast and how well each blosc codec compresses our images.
+
+The best codec depends on the camera (the widefield and narrowfield frames have very different statistics), so run
+this on frames archived from the camera in question. Everything runs with a single blosc thread, so the speeds are per
+core. Multiply by the number of compression processes to estimate the throughput of the pipeline.
+
+Example:
+
+    results = benchmark_codecs(load_frames(glob.glob('/data1/2017-*/*'))[:8])
+    print results.sort_values('compress_MBps')
+"""
+import logging
+import time
+
+import blosc
+import numpy as np
+import pandas as pd
+
+from pmc_turbo.camera.image_processing.blosc_file import compress_raw_blosc, load_blosc_image
+from pmc_turbo.camera.image_processing.synthetic_star_field import StarFieldGenerator
+from pmc_turbo.camera.pycamera import dtypes
+from pmc_turbo.utils.bit_packing import fits_in_bits, pack_bits, unpack_bits
+
+logger = logging.getLogger(__name__)
+
+default_codecs = ['zstd', 'lz4', 'lz4hc', 'blosclz', 'zlib']
+default_levels = [1, 3, 5, 9]
+
+
+def load_frames(filenames):
+    return [load_blosc_image(filename)[0] for filename in filenames]
+
+
+def make_synthetic_frames(num_frames, shape=dtypes.image_dimensions, num_stars=500, exposure_us=100000, seed=0):
+    """
+    Generate star field frames with StarFieldGenerator
+    """
+    generator = StarFieldGenerator(shape=shape, num_stars=num_stars, seed=seed)
+    return [generator.make_frame(k, exposure_us) for k in range(num_frames)]
+
+
+def benchmark_codecs(frames, codecs=None, levels=None, shuffles=('bit',), blocksizes=(0,), packed_bits=(0,),
+                     num_repeats=1):
+    """
+    Compress and decompress each frame with every combination of parameters
+
+    Parameters
+    ----------
+    frames : list of uint16 arrays
+    codecs : list of str
+        Codecs to test, defaults to default_codecs. Codecs not supported by the installed blosc are skipped.
+    levels : list of int
+        Compression levels to test, defaults to default_levels
+    shuffles : list of str
+        'none', 'byte' or 'bit'
+    blocksizes : list of int
+    packed_bits : list of int
+        Bits per pixel to pack the frames to before compressing (see bit_packing.py), 0 for no packing. The packing
+        and unpacking times are included in the compression and decompression times.
+    num_repeats : int
+        Number of times to compress each frame. The fastest time is used.
+
+    Returns
+    -------
+    pandas.DataFrame with one row per parameter combination, giving the compression ratio and the single core
+    compression and decompression speeds in MB/s of uncompressed data
+    """
+    if codecs is None:
+        codecs = default_codecs
+    if levels is None:
+        levels = default_levels
+    original_nthreads = blosc.set_nthreads(1)
+    rows = []
+    try:
+        for cname in codecs:
+            if cname not in blosc.cnames:
+                logger.warning("Skipping codec %s, this blosc library only supports %r" % (cname, blosc.cnames))
+                continue
+            for clevel in levels:
+                for shuffle in shuffles:
+                    for blocksize in blocksizes:
+                        for bits in packed_bits:
+                            rows.append(_benchmark_one(frames, cname=cname, clevel=clevel, shuffle=shuffle,
+                                                       blocksize=blocksize, packed_bits=bits,
+                                                       num_repeats=num_repeats))
+    finally:
+        blosc.set_nthreads(original_nthreads)
+    return pd.DataFrame(rows, columns=['cname', 'clevel', 'shuffle', 'blocksize', 'packed_bits', 'ratio',
+                                       'compress_MBps', 'decompress_MBps'])
+
+
+def _benchmark_one(frames, num_repeats, packed_bits, **parameters):
+    total_bytes = 0
+    total_compressed_bytes = 0
+    compress_time = 0
+    decompress_time = 0
+    for frame in frames:
+        if packed_bits and not fits_in_bits(frame, packed_bits):
+            raise ValueError("Frame has values above %d bits" % packed_bits)
+        best_compress = np.inf
+        best_decompress = np.inf
+        for repeat in range(num_repeats):
+            tic = time.time()
+            if packed_bits:
+                compressed = compress_raw_blosc(pack_bits(frame, packed_bits), **parameters)
+            else:
+                compressed = compress_raw_blosc(frame, **parameters)
+            best_compress = min(best_compress, time.time() - tic)
+            tic = time.time()
+            data = blosc.decompress(compressed)
+            if packed_bits:
+                unpack_bits(data, packed_bits, frame.size)
+            best_decompress = min(best_decompress, time.time() - tic)
+        total_bytes += frame.nbytes
+        total_compressed_bytes += len(compressed)
+        compress_time += best_compress
+        decompress_time += best_decompress
+    result = dict(parameters, packed_bits=packed_bits)
+    result['ratio'] = total_bytes / float(total_compressed_bytes)
+    result['compress_MBps'] = total_bytes / compress_time / 1e6
+    result['decompress_MBps'] = total_bytes / decompress_time / 1e6
+    logger.info("%(cname)s level %(clevel)d %(shuffle)s shuffle %(packed_bits)d bit packing: ratio %(ratio).2f, "
+                "compress %(compress_MBps).0f MB/s, decompress %(decompress_MBps).0f MB/s" % result)
+    return result
@@ -0,0 +1,270 @@
+"""
+Segment files holding many compressed frames, as an alternative to writing one file per frame.
+
+A flight writes hundreds of thousands of frame files, and the filesystem metadata for all of them makes directory
+scans and copying the data off the disks after recovery slow. Instead, the writers can append frames to rolling
+segment files of about a fixed size. A segment is laid out as:
+
+    SEGMENT_MAGIC
+    entry, entry, ...
+    table, trailer
+
+Each entry is a fixed size entry header (ENTRY_MAGIC, data length, sidecar length, name length), followed by the frame
+data exactly as it would have been written to a frame file, the sidecar data (the frame's preview, may be empty) and
+the name the frame file would have had. The table, written when the segment is closed, is an array of
+segment_table_dtype with the name and position of each entry, and the trailer gives the position of the table. A
+segment left without a table by a crash can still be read by walking the entry headers.
+
+Frames are referred to by a reference string in place of a filename, segment@offset+length, where offset and length
+give the position of the frame data in the segment. The reference followed by any suffix, as made by
+preview_pyramid.get_preview_filename, refers to the sidecar of the entry instead. blosc_file.read_file_contents and so
+all the blosc file loaders accept references wherever they accept filenames.
+"""
+import logging
+import os
+import re
+import struct
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_MAGIC = 'PMCSEGMT'
+SEGMENT_FILE_SUFFIX = '.segment'
+ENTRY_MAGIC = 'PMCENTRY'
+entry_header_format = '<8sQQI'
+entry_header_num_bytes = struct.calcsize(entry_header_format)
+TRAILER_MAGIC = 'PMCTABLE'
+trailer_format = '<Q8s'
+trailer_num_bytes = struct.calcsize(trailer_format)
+MAX_ENTRY_NAME_LENGTH = 256
+
+segment_table_dtype = np.dtype([('name', 'S%d' % MAX_ENTRY_NAME_LENGTH),
+                                ('offset', np.int64),
+                                ('length', np.int64),
+                                ('sidecar_length', np.int64)])
+
+_reference_pattern = re.compile(r'^(?P<segment>.+)@(?P<offset>\d+)\+(?P<length>\d+)(?P<suffix>\..*)?$')
+
+
+def make_reference(segment_filename, offset, length):
+    return '%s@%d+%d' % (segment_filename, offset, length)
+
+
+def parse_reference(reference):
+    """
+    Split a frame reference into its parts
+
+    Returns
+    -------
+    segment_filename, offset, length, suffix
+        suffix is '' for references to the frame data. Returns None if *reference* is a plain filename.
+    """
+    match = _reference_pattern.match(reference)
+    if match is None:
+        return None
+    return (match.group('segment'), int(match.group('offset')), int(match.group('length')),
+            match.group('suffix') or '')
+
+
+def is_reference(filename):
+    return parse_reference(filename) is not None
+
+
+def _read_entry_header(fh, entry_offset):
+    fh.seek(entry_offset)
+    header = fh.read(entry_header_num_bytes)
+    if len(header) < entry_header_num_bytes:
+        return None
+    magic, length, sidecar_length, name_length = struct.unpack(entry_header_format, header)
+    if magic != ENTRY_MAGIC:
+        raise ValueError("No segment entry at offset %d of %s" % (entry_offset, getattr(fh, 'name', fh)))
+    return length, sidecar_length, name_length
+
+
+def read_reference(reference):
+    """
+    Return the data referred to by a frame reference
+
+    Raises IOError if the reference points at an empty sidecar, as reading a missing sidecar file would.
+    """
+    segment_filename, offset, length, suffix = parse_reference(reference)
+    with open(segment_filename, 'rb') as fh:
+        if suffix:
+            _, sidecar_length, _ = _read_entry_header(fh, offset - entry_header_num_bytes)
+            if not sidecar_length:
+                raise IOError("Entry at %s has no sidecar data" % reference[:-len(suffix)])
+            offset += length
+            length = sidecar_length
+        fh.seek(offset)
+        data = fh.read(length)
+    if len(data) < length:
+        raise IOError("%s is truncated, read %d of %d bytes" % (reference, len(data), length))
+    return data
+
+
+def get_num_bytes(filename):
+    """
+    Size of the data in a frame file or referred to by a frame reference
+    """
+    parts = parse_reference(filename)
+    if parts is None:
+        return os.path.getsize(filename)
+    return parts[2]
+
+
+def scan_segment(filename):
+    """
+    Rebuild the table of a segment by walking its entry headers, for segments that were not closed
+
+    A partially written last entry is ignored.
+    """
+    entries = []
+    with open(filename, 'rb') as fh:
+        file_size = os.fstat(fh.fileno()).st_size
+        entry_offset = len(SEGMENT_MAGIC)
+        while True:
+            try:
+                entry_header = _read_entry_header(fh, entry_offset)
+            except ValueError:
+                break
+            if entry_header is None:
+                break
+            length, sidecar_length, name_length = entry_header
+            data_offset = entry_offset + entry_header_num_bytes
+            entry_end = data_offset + length + sidecar_length + name_length
+            if entry_end > file_size:
+                break
+            fh.seek(data_offset + length + sidecar_length)
+            entries.append((fh.read(name_length), data_offset, length, sidecar_length))
+            entry_offset = entry_end
+    return np.array(entries, dtype=segment_table_dtype)
+
+
+def read_segment_table(filename):
+    """
+    Return the table of entries of a segment as an array of segment_table_dtype
+    """
+    with open(filename, 'rb') as fh:
+        if fh.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+            raise ValueError("%s is not a segment file" % filename)
+        fh.seek(0, os.SEEK_END)
+        file_size = fh.tell()
+        if file_size >= len(SEGMENT_MAGIC) + trailer_num_bytes:
+            fh.seek(file_size - trailer_num_bytes)
+            table_offset, magic = struct.unpack(trailer_format, fh.read(trailer_num_bytes))
+            if magic == TRAILER_MAGIC:
+                fh.seek(table_offset)
+                return np.fromstring(fh.read(file_size - trailer_num_bytes - table_offset),
+                                     dtype=segment_table_dtype)
+    logger.warning("Segment %s has no table, scanning its entries" % filename)
+    return scan_segment(filename)
+
+
+def list_references(filename):
+    """
+    Return (name, reference) for each frame in a segment
+    """
+    return [(entry['name'], make_reference(filename, entry['offset'], entry['length']))
+            for entry in read_segment_table(filename)]
+
+
+def extract_segment(filename, output_dir, sidecar_suffix='.preview'):
+    """
+    Write each frame of a segment to its own file in *output_dir*, named as it would have been without segments
+
+    Returns
+    -------
+    list of the frame filenames written
+    """
+    filenames = []
+    for entry in read_segment_table(filename):
+        reference = make_reference(filename, entry['offset'], entry['length'])
+        frame_filename = os.path.join(output_dir, entry['name'])
+        with open(frame_filename, 'wb') as fh:
+            fh.write(read_reference(reference))
+        if entry['sidecar_length']:
+            with open(frame_filename + sidecar_suffix, 'wb') as fh:
+                fh.write(read_reference(reference + sidecar_suffix))
+        filenames.append(frame_filename)
+    return filenames
+
+
+class SegmentWriter(object):
+    def __init__(self, directory, segment_size=2 ** 30):
+        """
+        Append frames to rolling segment files in *directory*
+
+        A new segment is started when adding a frame would take the current one past *segment_size* bytes, so segments
+        are about this size unless a single frame is larger.
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.segment_index = 0
+        self.fh = None
+        self.filename = None
+        self.entries = []
+
+    def start_segment(self):
+        self.filename = os.path.join(self.directory, '%s_segment=%d%s' % (time.strftime("%Y-%m-%d_%H%M%S"),
+                                                                          self.segment_index, SEGMENT_FILE_SUFFIX))
+        self.segment_index += 1
+        self.fh = open(self.filename, 'wb')
+        self.fh.write(SEGMENT_MAGIC)
+        self.fh.flush()
+        self.entries = []
+        logger.info("Started segment %s" % self.filename)
+
+    def append(self, name, data, sidecar=''):
+        """
+        Append a frame and its sidecar data
+
+        The entry is flushed to the file before returning, so it can be read as soon as it is indexed. If writing fails,
+        the partial entry is removed and the error is raised.
+
+        Returns
+        -------
+        reference : str
+            Reference to the frame data, for the filename field of the frame index
+        """
+        if len(name) >= MAX_ENTRY_NAME_LENGTH:
+            logger.warning("Entry name %s is too long for the segment table and will be truncated" % name)
+        entry_num_bytes = entry_header_num_bytes + len(data) + len(sidecar) + len(name)
+        if self.fh is not None and self.entries and self.fh.tell() + entry_num_bytes > self.segment_size:
+            self.close_segment()
+        if self.fh is None:
+            self.start_segment()
+        entry_offset = self.fh.tell()
+        try:
+            self.fh.write(struct.pack(entry_header_format, ENTRY_MAGIC, len(data), len(sidecar), len(name)))
+            self.fh.write(data)
+            self.fh.write(sidecar)
+            self.fh.write(name)
+            self.fh.flush()
+        except (IOError, OSError):
+            try:
+                self.fh.seek(entry_offset)
+                self.fh.truncate()
+            except (IOError, OSError):
+                logger.exception("Failed to remove partial entry from %s" % self.filename)
+            raise
+        data_offset = entry_offset + entry_header_num_bytes
+        self.entries.append((name, data_offset, len(data), len(sidecar)))
+        return make_reference(self.filename, data_offset, len(data))
+
+    def close_segment(self):
+        """
+        Write the table and trailer and close the current segment
+        """
+        if self.fh is None:
+            return
+        table_offset = self.fh.tell()
+        self.fh.write(np.array(self.entries, dtype=segment_table_dtype).tostring())
+        self.fh.write(struct.pack(trailer_format, table_offset, TRAILER_MAGIC))
+        self.fh.close()
+        logger.info("Closed segment %s with %d frames" % (self.filename, len(self.entries)))
+        self.fh = None
+
+    def close(self):
+        self.close_segment()
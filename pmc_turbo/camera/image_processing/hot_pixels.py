@@ -1,5 +1,59 @@
+import logging
+import os
+
 import numpy as np
 
+from pmc_turbo.utils.configuration import camera_data_dir
+
+logger = logging.getLogger(__name__)
+
+
+def load_hot_pixels(hot_pixel_file_dictionary, camera_id):
+    """
+    Load the hot pixel list for camera *camera_id*, or return an empty list if there isn't one
+
+    Parameters
+    ----------
+    hot_pixel_file_dictionary : dict
+        camera id -> name of a file in the hot_pixels directory of camera_data_dir
+    camera_id : int
+    """
+    try:
+        return np.load(os.path.join(camera_data_dir, 'hot_pixels', hot_pixel_file_dictionary[camera_id]))
+    except Exception:
+        logger.exception("Failed to load hot pixel file from %s, dictionary of known files %r, proceeding without"
+                         % (camera_data_dir, hot_pixel_file_dictionary))
+        return []
+
+
+def hot_pixels_for_geometry(hot_pixels, geometry):
+    """
+    Convert hot pixel positions from full frame sensor coordinates to the pixels of frames read out with *geometry*
+
+    The positions are shifted by the region of interest offsets (in sensor pixels) and divided by the binning. Hot
+    pixels outside the region are left out, and hot pixels sharing a binned pixel are listed once.
+
+    Parameters
+    ----------
+    hot_pixels : array of (row, column)
+    geometry : FrameGeometry
+
+    Returns
+    -------
+    int array of (row, column), shape (num_pixels, 2)
+    """
+    hot_pixels = np.asarray(hot_pixels, dtype=np.int64).reshape((-1, 2))
+    rows = hot_pixels[:, 0] - geometry.offset_y
+    columns = hot_pixels[:, 1] - geometry.offset_x
+    inside = ((rows >= 0) & (rows < geometry.height * geometry.binning_vertical)
+              & (columns >= 0) & (columns < geometry.width * geometry.binning_horizontal))
+    binned = np.column_stack((rows[inside] // geometry.binning_vertical,
+                              columns[inside] // geometry.binning_horizontal))
+    if not len(binned):
+        return binned
+    return np.unique(binned.view([('row', np.int64), ('column', np.int64)])).view(np.int64).reshape((-1, 2))
+
+
 class HotPixelMasker(object):
     def __init__(self, hot_pixels,image_shape,min_radius=1,max_range=2):
         self.min_radius = min_radius
@@ -14,11 +68,57 @@ class HotPixelMasker(object):
             self.yindexes = []
 
     def process(self,image):
-        if len(self.hot_pixels):
+        # Hot pixel positions are in full frame sensor coordinates, so they can't be applied to binned or ROI images
+        if len(self.hot_pixels) and image.shape == tuple(self.image_shape):
             return mask_hot_pixels(image,self.hot_pixels,xindexes=self.xindexes, yindexes=self.yindexes)
         else:
             return image
 
+    def process_region(self, region, row_offset, column_offset):
+        """
+        Mask the hot pixels in *region*, a part of a full frame starting at (*row_offset*, *column_offset*)
+
+        Each hot pixel is replaced by the median of the surrounding pixels that fall within the region, so a region
+        extended by max_range pixels on each side is masked as process would mask the full frame, except where the
+        surrounding pixels wrap around the frame edges.
+        """
+        if not len(self.hot_pixels):
+            return region
+        rows = self.hot_pixels[:, 0] - row_offset
+        columns = self.hot_pixels[:, 1] - column_offset
+        inside = (rows >= 0) & (rows < region.shape[0]) & (columns >= 0) & (columns < region.shape[1])
+        if not inside.any():
+            return region
+        out = region.copy()
+        xindexes = np.asarray(self.xindexes)[inside] - row_offset
+        yindexes = np.asarray(self.yindexes)[inside] - column_offset
+        surrounding_inside = ((xindexes >= 0) & (xindexes < region.shape[0]) & (yindexes >= 0)
+                              & (yindexes < region.shape[1]))
+        for row, column, x, y, valid in zip(rows[inside], columns[inside], xindexes, yindexes, surrounding_inside):
+            if valid.any():
+                out[row, column] = np.median(region[x[valid], y[valid]])
+        return out
+
+    def corrections(self, image):
+        """
+        Return the changes process would make to *image*, without copying it
+
+        Returns
+        -------
+        rows, columns : int arrays
+            Positions of the hot pixels
+        deltas : float array
+            Masked value minus original value for each hot pixel
+        """
+        if len(self.hot_pixels) and image.shape == tuple(self.image_shape):
+            replacements = np.median(image[self.xindexes, self.yindexes], axis=1)
+            rows = self.hot_pixels[:, 0]
+            columns = self.hot_pixels[:, 1]
+            return rows, columns, replacements - image[rows, columns]
+        else:
+            empty = np.zeros((0,), dtype=np.int64)
+            return empty, empty, np.zeros((0,))
+
 def compute_surrounding_indexes(hot_pixels,image_shape,min_radius=1,max_range=2):
     """
     make a list of indexes of the pixels surrounding the given list of pixels
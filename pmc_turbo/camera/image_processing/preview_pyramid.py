@@ -0,0 +1,152 @@
+"""
+Binned previews of each frame at a few resolutions, written next to the frame file.
+
+Standard images are 1/8 scale JPEGs of the whole frame. Making one from the frame file means decompressing all 31 MB
+and hot pixel masking the full frame just to throw away 63 of every 64 pixels. Instead, the compressor bins each frame
+by a few factors (by default 4, 8 and 16) while the frame is still in memory, and the writer stores the binned images
+in a small blosc compressed sidecar file (the frame filename plus PREVIEW_FILE_SUFFIX). The controller serves images
+with scale_by of 1/4 or less from the closest preview level.
+
+Each level is the mean of factor x factor blocks of pixels, rounded to uint16. Rows and columns left over at the
+bottom and right edges are dropped. Each factor must divide the next one, so each level is binned from the previous
+one. Hot pixels are masked as HotPixelMasker would do on the full frame, by correcting the sums of the blocks they fall
+in, so the full frame never needs to be copied.
+
+The sidecar file uses the blosc file header (see blosc_file.py) with the levels recorded as
+preview_levels = [[factor, rows, columns], ...], followed by the levels concatenated and compressed together.
+"""
+import numpy as np
+
+from pmc_turbo.camera.image_processing.blosc_file import (compress_raw_blosc, get_geometry, load_blosc_file_with_header,
+                                                          make_file_header, BLOSC_FILE_HEADER_MAX_BYTES,
+                                                          BLOSC_MAX_OVERHEAD)
+
+PREVIEW_FILE_SUFFIX = '.preview'
+default_preview_factors = [4, 8, 16]
+
+
+def get_preview_filename(filename):
+    return filename + PREVIEW_FILE_SUFFIX
+
+
+def check_preview_factors(factors):
+    for factor, next_factor in zip(factors[:-1], factors[1:]):
+        if next_factor % factor:
+            raise ValueError("Each preview factor must divide the next, got %r" % (factors,))
+
+
+def _sum_blocks(image, factor):
+    # Adding strided slices is several times faster than summing a reshaped view over the block axes
+    rows = image.shape[0] // factor * factor
+    columns = image.shape[1] // factor * factor
+    row_sums = image[0:rows:factor, :columns].astype(np.uint32)
+    for k in range(1, factor):
+        row_sums += image[k:rows:factor, :columns]
+    sums = row_sums[:, 0::factor].copy()
+    for k in range(1, factor):
+        sums += row_sums[:, k::factor]
+    return sums
+
+
+def make_preview_pyramid(image, factors=default_preview_factors, hot_pixel_masker=None):
+    """
+    Bin *image* by each of *factors*
+
+    Parameters
+    ----------
+    image : 2D uint16 array
+    factors : list of int
+        Increasing binning factors, each dividing the next
+    hot_pixel_masker : HotPixelMasker, optional
+
+    Returns
+    -------
+    list of uint16 arrays, one per factor
+    """
+    check_preview_factors(factors)
+    levels = []
+    sums = image
+    previous_factor = 1
+    for factor in factors:
+        # uint32 holds the sum of up to 2**16 pixels
+        sums = _sum_blocks(sums, factor // previous_factor)
+        if previous_factor == 1 and hot_pixel_masker is not None:
+            rows, columns, deltas = hot_pixel_masker.corrections(image)
+            in_blocks = (rows < sums.shape[0] * factor) & (columns < sums.shape[1] * factor)
+            corrected = sums.astype(np.int64)
+            np.add.at(corrected, (rows[in_blocks] // factor, columns[in_blocks] // factor),
+                      np.round(deltas[in_blocks]).astype(np.int64))
+            sums = corrected.astype(np.uint32)
+        levels.append(((sums + factor ** 2 // 2) // factor ** 2).astype(np.uint16))
+        previous_factor = factor
+    return levels
+
+
+def preview_max_num_bytes(geometry, factors=default_preview_factors):
+    """
+    Largest possible size of a preview file for frames of *geometry*
+    """
+    num_pixels = sum([(geometry.height // factor) * (geometry.width // factor) for factor in factors])
+    return num_pixels * 2 + BLOSC_MAX_OVERHEAD + BLOSC_FILE_HEADER_MAX_BYTES
+
+
+def compress_preview_pyramid(levels, factors, geometry, cname='lz4', clevel=5, shuffle='bit'):
+    """
+    Compress the output of make_preview_pyramid into the contents of a preview file
+
+    Parameters
+    ----------
+    levels : list of uint16 arrays
+    factors : list of int
+    geometry : FrameGeometry
+        Geometry of the full frame
+    cname, clevel, shuffle : see compress_raw_blosc
+
+    Returns
+    -------
+    str
+    """
+    header = make_file_header(dict(cname=cname, clevel=clevel, shuffle=shuffle, geometry=geometry.to_dict(),
+                                   preview_levels=[[factor, level.shape[0], level.shape[1]]
+                                                   for factor, level in zip(factors, levels)]))
+    data = np.concatenate([level.ravel() for level in levels])
+    return header + compress_raw_blosc(data, cname=cname, clevel=clevel, shuffle=shuffle)
+
+
+def load_preview_pyramid(filename):
+    """
+    Load the previews of the frame in *filename*
+
+    Parameters
+    ----------
+    filename : str
+        Name of the frame file (not the preview file)
+
+    Returns
+    -------
+    levels : dict
+        factor -> uint16 array
+    geometry : FrameGeometry
+        Geometry of the full frame
+
+    Raises IOError if the frame has no preview.
+    """
+    header, data = load_blosc_file_with_header(get_preview_filename(filename))
+    pixels = np.frombuffer(data, dtype=np.uint16)
+    levels = {}
+    offset = 0
+    for factor, rows, columns in header['preview_levels']:
+        levels[factor] = pixels[offset:offset + rows * columns].reshape((rows, columns))
+        offset += rows * columns
+    return levels, get_geometry(header)
+
+
+def choose_preview_factor(factors, scale_by):
+    """
+    Return the coarsest factor that still has at least the resolution needed for *scale_by*, or None if all are
+    too coarse
+    """
+    candidates = [factor for factor in factors if factor * scale_by <= 1 + 1e-9]
+    if not candidates:
+        return None
+    return max(candidates)
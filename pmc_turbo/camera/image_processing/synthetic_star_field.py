@@ -0,0 +1,136 @@
+"""
+Synthetic star field frames for the simulated camera, tests and benchmarks.
+
+A frame is a noisy sky background plus stars from a seeded catalog, rendered with a gaussian point spread function,
+plus a fixed set of hot pixels. The stars drift across the sensor from frame to frame, as they would with the gondola
+rotating slowly. Sky, star and hot pixel signals scale with the exposure time; the bias and read noise do not. Values
+are clipped to 14 bits like the camera.
+
+Generating Poisson noise for every pixel is far too slow to sustain the camera frame rate, so a few noisy background
+frames are computed once per exposure time and reused in turn. Each frame then only needs the stars (with their own
+shot noise) and hot pixels added, which touches a small fraction of the pixels.
+
+Example:
+
+    generator = StarFieldGenerator(shape=(3232, 4864))
+    image = generator.make_frame(frame_number=0, exposure_us=100000)
+"""
+import numpy as np
+
+from pmc_turbo.camera.image_processing.image_statistics import MAX_PIXEL_VALUE
+from pmc_turbo.camera.pycamera.dtypes import image_dimensions
+
+
+class StarFieldGenerator(object):
+    def __init__(self, shape=image_dimensions, num_stars=500, bias=100, sky_rate=9000., read_noise=20.,
+                 psf_sigma=1.5, brightest_star_rate=2e6, faintest_star_rate=2e3, drift_per_frame=(0.3, 0.1),
+                 num_hot_pixels=100, num_background_frames=2, seed=0, max_value=MAX_PIXEL_VALUE):
+        """
+        Parameters
+        ----------
+        shape : tuple
+            (rows, columns) of the image
+        num_stars : int
+        bias : float
+            Counts in every pixel independent of exposure
+        sky_rate : float
+            Sky background in counts per second per pixel
+        read_noise : float
+            Standard deviation of the read noise in counts
+        psf_sigma : float
+            Width of the gaussian point spread function in pixels
+        brightest_star_rate, faintest_star_rate : float
+            Range of the total star signals in counts per second. Star signals follow a power law, so most stars
+            are faint.
+        drift_per_frame : tuple of float
+            (rows, columns) that the stars move each frame. Stars leaving one edge of the image reappear at the
+            opposite edge.
+        num_hot_pixels : int
+        num_background_frames : int
+            Number of distinct noisy backgrounds computed for each exposure time
+        seed : int
+            Seed for the catalog, hot pixels and noise
+        max_value : int
+            Saturation value
+        """
+        self.shape = tuple(shape)
+        self.bias = bias
+        self.sky_rate = sky_rate
+        self.read_noise = read_noise
+        self.psf_sigma = psf_sigma
+        self.drift_per_frame = np.asarray(drift_per_frame, dtype=np.float64)
+        self.num_background_frames = num_background_frames
+        self.max_value = max_value
+        self.random_state = np.random.RandomState(seed)
+
+        self.star_positions = self.random_state.uniform(0, 1, size=(num_stars, 2)) * self.shape
+        # Power law with index -1 (uniform in log signal)
+        self.star_rates = np.exp(self.random_state.uniform(np.log(faintest_star_rate), np.log(brightest_star_rate),
+                                                           size=num_stars))
+        num_pixels = self.shape[0] * self.shape[1]
+        self.hot_pixel_indexes = self.random_state.choice(num_pixels, size=min(num_hot_pixels, num_pixels),
+                                                          replace=False)
+        self.hot_pixel_rates = self.random_state.uniform(1e3, 3e5, size=self.hot_pixel_indexes.shape[0])
+
+        radius = int(np.ceil(4 * psf_sigma))
+        self._stamp_offsets = np.mgrid[-radius:radius + 1, -radius:radius + 1].reshape((2, 1, -1))
+        self._backgrounds = []
+        self._background_exposure_us = None
+
+    def get_star_positions(self, frame_number):
+        """
+        (row, column) positions of the catalog stars in frame *frame_number*
+        """
+        return (self.star_positions + frame_number * self.drift_per_frame) % self.shape
+
+    def _get_background(self, frame_number, exposure_us):
+        if exposure_us != self._background_exposure_us:
+            mean = self.sky_rate * exposure_us / 1e6
+            self._backgrounds = []
+            for k in range(self.num_background_frames):
+                background = (self.bias + self.random_state.poisson(mean, size=self.shape)
+                              + self.random_state.normal(0, self.read_noise, size=self.shape))
+                self._backgrounds.append(np.clip(background, 0, self.max_value).astype(np.uint16))
+            self._background_exposure_us = exposure_us
+        return self._backgrounds[frame_number % self.num_background_frames]
+
+    def make_frame(self, frame_number, exposure_us, out=None):
+        """
+        Generate one frame
+
+        Parameters
+        ----------
+        frame_number : int
+            Selects the star positions and background
+        exposure_us : float
+            Exposure time in microseconds
+        out : uint16 array of the frame shape, optional
+            Array to write the frame into, e.g. a camera buffer
+
+        Returns
+        -------
+        uint16 array
+        """
+        if out is None:
+            out = np.empty(self.shape, dtype=np.uint16)
+        out[:] = self._get_background(frame_number, exposure_us)
+        exposure_s = exposure_us / 1e6
+        flat = out.reshape(-1)
+
+        # Render every star onto a small stamp of pixels around its position in one vectorized step
+        positions = self.get_star_positions(frame_number)
+        centers = np.floor(positions).astype(np.int64)
+        pixels = centers.T[:, :, None] + self._stamp_offsets
+        distance_squared = ((pixels + 0.5 - positions.T[:, :, None]) ** 2).sum(0)
+        signal = (self.star_rates[:, None] * exposure_s / (2 * np.pi * self.psf_sigma ** 2)
+                  * np.exp(-distance_squared / (2 * self.psf_sigma ** 2)))
+        in_bounds = ((pixels[0] >= 0) & (pixels[0] < self.shape[0]) & (pixels[1] >= 0) & (pixels[1] < self.shape[1]))
+        indexes = pixels[0][in_bounds] * self.shape[1] + pixels[1][in_bounds]
+        signal = self.random_state.poisson(signal[in_bounds])
+        # Stamps of nearby stars can overlap, so sum the signal for each distinct pixel
+        indexes, inverse = np.unique(indexes, return_inverse=True)
+        signal = np.bincount(inverse, weights=signal)
+        flat[indexes] = np.minimum(flat[indexes] + signal, self.max_value)
+
+        flat[self.hot_pixel_indexes] = np.minimum(self.bias + self.hot_pixel_rates * exposure_s, self.max_value)
+        return out
@@ -2,7 +2,7 @@ import multiprocessing as mp
 import os
 import shutil
 import tempfile
-from nose.tools import timed
+from nose.tools import assert_raises, timed
 
 #__test__ = False
 
@@ -12,6 +12,7 @@ import numpy as np
 print blosc.set_nthreads(1)
 from pmc_turbo.camera.image_processing import blosc_file
 from pmc_turbo.camera.pycamera import dtypes
+from pmc_turbo.camera.pycamera.geometry import FrameGeometry, full_frame_geometry
 print blosc.set_nthreads(1)
 
 
@@ -46,6 +47,92 @@ class TestBloscFiles(object):
         blosc_file.write_image_blosc(filename, image)
         image2,chunk2 = blosc_file.load_blosc_image(filename)
 
+    def test_compression_parameters_in_header(self):
+        image = np.random.random_integers(0,2**14-1,size=(2**16,)).astype('uint16')
+        for cname in ['zstd', 'blosclz', 'zlib']:
+            for shuffle in ['none', 'byte', 'bit']:
+                filename = os.path.join(self.temp_dir, '%s_%s.blosc' % (cname, shuffle))
+                blosc_file.write_image_blosc(filename, image, cname=cname, clevel=3, shuffle=shuffle, blocksize=2**14)
+                header = blosc_file.load_blosc_header(filename)
+                assert header.pop('geometry') == full_frame_geometry.to_dict()
+                assert header == dict(cname=cname, clevel=3, shuffle=shuffle, blocksize=2**14)
+                assert np.all(np.frombuffer(blosc_file.load_blosc_file(filename), dtype='uint16') == image)
+
+    def test_roi_image_round_trip(self):
+        filename = os.path.join(self.temp_dir,'roi.blosc')
+        geometry = FrameGeometry(width=2432, height=808, offset_x=16, offset_y=8, binning_horizontal=2,
+                                 binning_vertical=2)
+        image = np.random.random_integers(0,2**14-1,size=geometry.image_shape).astype('uint16')
+        chunk = np.ones((1,), dtype=dtypes.chunk_dtype)
+        blosc_file.write_image_blosc(filename, image.tostring() + chunk.tostring(), geometry=geometry)
+        image2,chunk2 = blosc_file.load_blosc_image(filename)
+        assert image2.shape == (808, 2432)
+        assert np.all(image2 == image)
+        assert np.all(chunk2 == chunk)
+        assert blosc_file.get_geometry(blosc_file.load_blosc_header(filename)) == geometry
+
+    def test_packed_image_round_trip(self):
+        geometry = FrameGeometry(width=1000, height=10)
+        image = np.random.random_integers(0,2**14-1,size=geometry.image_shape).astype('uint16')
+        chunk = np.ones((1,), dtype=dtypes.chunk_dtype)
+        filename = os.path.join(self.temp_dir,'packed.blosc')
+        blosc_file.write_image_blosc(filename, image.tostring() + chunk.tostring(), geometry=geometry, packed_bits=14)
+        assert blosc_file.load_blosc_header(filename)['packed_bits'] == 14
+        image2,chunk2 = blosc_file.load_blosc_image(filename)
+        assert np.all(image2 == image)
+        assert np.all(chunk2 == chunk)
+
+        # Images with values that do not fit are stored unpacked
+        image[0, 0] = 2**14
+        filename = os.path.join(self.temp_dir,'unpacked.blosc')
+        blosc_file.write_image_blosc(filename, image.tostring() + chunk.tostring(), geometry=geometry, packed_bits=14)
+        assert 'packed_bits' not in blosc_file.load_blosc_header(filename)
+        image2,chunk2 = blosc_file.load_blosc_image(filename)
+        assert np.all(image2 == image)
+        assert np.all(chunk2 == chunk)
+
+    def test_banded_image_regions(self):
+        geometry = FrameGeometry(width=100, height=50)
+        image = np.random.random_integers(0,2**12-1,size=geometry.image_shape).astype('uint16')
+        chunk = np.ones((1,), dtype=dtypes.chunk_dtype)
+        for packed_bits in [0, 12]:
+            filename = os.path.join(self.temp_dir,'banded_%d.blosc' % packed_bits)
+            blosc_file.write_image_blosc(filename, image.tostring() + chunk.tostring(), geometry=geometry,
+                                         packed_bits=packed_bits, band_rows=16)
+            header = blosc_file.load_blosc_header(filename)
+            assert header['band_rows'] == 16
+            assert len(header['band_sizes']) == blosc_file.get_num_bands(geometry, 16) + 1 == 5
+            image2,chunk2 = blosc_file.load_blosc_image(filename)
+            assert np.all(image2 == image)
+            assert np.all(chunk2 == chunk)
+            for row_slice, column_slice in [(slice(20, 30), slice(5, 50)), (slice(0, 16), slice(None)),
+                                            (slice(45, None), slice(90, 200)), (slice(3, 40, 7), slice(None, None, 3)),
+                                            (slice(30, 30), slice(None))]:
+                region,chunk2 = blosc_file.load_blosc_region(filename, row_slice, column_slice)
+                assert region.shape == image[row_slice, column_slice].shape
+                assert np.all(region == image[row_slice, column_slice])
+                assert np.all(chunk2 == chunk)
+        with assert_raises(ValueError):
+            tall_geometry = FrameGeometry(width=4, height=1000)
+            blosc_file.compress_image_blosc(np.zeros((tall_geometry.payload_size,), dtype='uint8'),
+                                            geometry=tall_geometry, band_rows=1)
+
+    def test_region_of_unbanded_image(self):
+        filename = os.path.join(self.temp_dir,'unbanded.blosc')
+        geometry = FrameGeometry(width=64, height=32)
+        image = np.random.random_integers(0,2**14-1,size=geometry.image_shape).astype('uint16')
+        blosc_file.write_image_blosc(filename, image.tostring() + np.ones((1,), dtype=dtypes.chunk_dtype).tostring(),
+                                     geometry=geometry)
+        region,chunk = blosc_file.load_blosc_region(filename, slice(4, 8), slice(10, 20))
+        assert np.all(region == image[4:8, 10:20])
+
+    def test_load_file_without_header(self):
+        filename = os.path.join(self.temp_dir,'old.blosc')
+        data = np.arange(2**16, dtype='uint16').tostring()
+        blosc_file.write_compressed_blosc(filename, blosc.compress(data, shuffle=blosc.BITSHUFFLE, cname='lz4'))
+        assert blosc_file.load_blosc_header(filename) == {}
+        assert blosc_file.load_blosc_file(filename) == data
+
     @timed(10)
     def test_blosc_multiprocessing(self):
         filename = os.path.join(self.temp_dir,'blah3.blosc')
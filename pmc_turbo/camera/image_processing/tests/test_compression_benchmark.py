@@ -0,0 +1,17 @@
+from pmc_turbo.camera.image_processing import compression_benchmark
+
+
+def test_benchmark_codecs():
+    frames = compression_benchmark.make_synthetic_frames(2, shape=(64, 128), num_stars=5)
+    results = compression_benchmark.benchmark_codecs(frames, codecs=['lz4', 'zlib', 'not_a_codec'], levels=[1, 5])
+    assert len(results) == 4
+    assert set(results.cname) == {'lz4', 'zlib'}
+    assert (results.ratio > 1).all()
+    assert (results.compress_MBps > 0).all()
+
+
+def test_benchmark_packed_bits():
+    frames = compression_benchmark.make_synthetic_frames(1, shape=(64, 128), num_stars=5)
+    results = compression_benchmark.benchmark_codecs(frames, codecs=['lz4'], levels=[5], packed_bits=[0, 14])
+    assert list(results.packed_bits) == [0, 14]
+    assert (results.ratio > 1).all()
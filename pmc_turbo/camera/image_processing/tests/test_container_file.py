@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from nose.tools import assert_raises
+
+from pmc_turbo.camera.image_processing import blosc_file, container_file, preview_pyramid
+from pmc_turbo.camera.pycamera import dtypes
+from pmc_turbo.camera.pycamera.geometry import FrameGeometry
+
+
+def test_parse_reference():
+    reference = container_file.make_reference('/data1/2017-01-01_000000/seg_segment=0.segment', 8, 1234)
+    assert container_file.parse_reference(reference) == ('/data1/2017-01-01_000000/seg_segment=0.segment', 8,
+                                                         1234, '')
+    assert container_file.parse_reference(reference + '.preview')[3] == '.preview'
+    assert not container_file.is_reference('/data1/2017-01-01_000000/2017-01-01_000000_frame_id=1_timestamp=2')
+
+
+class TestSegmentFile(object):
+    def setup(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.geometry = FrameGeometry(width=64, height=48)
+        random = np.random.RandomState(0)
+        self.images = [random.randint(0, 2 ** 14, size=self.geometry.image_shape).astype('uint16') for k in range(5)]
+        self.chunk = np.zeros((1,), dtype=dtypes.chunk_dtype)
+
+    def teardown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_frames(self, segment_size):
+        writer = container_file.SegmentWriter(self.temp_dir, segment_size=segment_size)
+        references = []
+        for k, image in enumerate(self.images):
+            data = blosc_file.compress_image_blosc(image.tostring() + self.chunk.tostring(), geometry=self.geometry)
+            preview = ''
+            if k % 2:
+                preview = preview_pyramid.compress_preview_pyramid(
+                    preview_pyramid.make_preview_pyramid(image, [4, 8]), [4, 8], self.geometry)
+            references.append(writer.append('frame_%d' % k, data, preview))
+        return writer, references
+
+    def test_round_trip(self):
+        writer, references = self.write_frames(segment_size=2 ** 30)
+        # Frames can be read before the segment is closed
+        image, chunk = blosc_file.load_blosc_image(references[1])
+        assert np.all(image == self.images[1])
+        writer.close()
+        assert len(os.listdir(self.temp_dir)) == 1
+        for k, reference in enumerate(references):
+            image, chunk = blosc_file.load_blosc_image(reference)
+            assert np.all(image == self.images[k])
+            assert np.all(chunk == self.chunk)
+            assert blosc_file.load_blosc_header(reference)['geometry'] == self.geometry.to_dict()
+            if k % 2:
+                levels, geometry = preview_pyramid.load_preview_pyramid(reference)
+                assert sorted(levels.keys()) == [4, 8]
+            else:
+                with assert_raises(IOError):
+                    preview_pyramid.load_preview_pyramid(reference)
+
+    def test_segments_roll_over(self):
+        writer, references = self.write_frames(segment_size=10000)
+        writer.close()
+        segments = sorted(set([container_file.parse_reference(reference)[0] for reference in references]))
+        assert len(segments) > 1
+        names = []
+        for segment in segments:
+            names.extend([name for name, _ in container_file.list_references(segment)])
+        assert names == ['frame_%d' % k for k in range(len(self.images))]
+
+    def test_unclosed_segment_is_scanned(self):
+        writer, references = self.write_frames(segment_size=2 ** 30)
+        writer.fh.write(container_file.ENTRY_MAGIC)  # a partially written entry
+        writer.fh.close()
+        table = container_file.read_segment_table(writer.filename)
+        assert list(table['name']) == ['frame_%d' % k for k in range(len(self.images))]
+        assert [container_file.make_reference(writer.filename, entry['offset'], entry['length'])
+                for entry in table] == references
+
+    def test_extract_segment(self):
+        writer, references = self.write_frames(segment_size=2 ** 30)
+        writer.close()
+        output_dir = os.path.join(self.temp_dir, 'extracted')
+        os.mkdir(output_dir)
+        filenames = container_file.extract_segment(writer.filename, output_dir)
+        assert [os.path.basename(filename) for filename in filenames] == ['frame_%d' % k
+                                                                          for k in range(len(self.images))]
+        image, chunk = blosc_file.load_blosc_image(filenames[3])
+        assert np.all(image == self.images[3])
+        levels, geometry = preview_pyramid.load_preview_pyramid(filenames[3])
+        assert geometry == self.geometry
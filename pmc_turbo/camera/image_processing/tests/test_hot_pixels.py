@@ -1,7 +1,8 @@
 import glob
 import numpy as np
 import os
-from pmc_turbo.camera.image_processing.hot_pixels import HotPixelMasker
+from pmc_turbo.camera.image_processing.hot_pixels import HotPixelMasker, hot_pixels_for_geometry
+from pmc_turbo.camera.pycamera.geometry import FrameGeometry
 from pmc_turbo.utils.configuration import camera_data_dir
 
 def check_hot_pixel_case(filename):
@@ -13,4 +14,33 @@ def check_hot_pixel_case(filename):
 def test_hot_pixel_masker():
     hp_files = glob.glob(os.path.join(camera_data_dir,'hot_pixels/*'))
     for filename in hp_files:
-        yield check_hot_pixel_case, filename
\ No newline at end of file
+        yield check_hot_pixel_case, filename
+
+def test_process_region():
+    shape = (64, 80)
+    image = np.random.RandomState(0).randint(90, 110, size=shape).astype('uint16')
+    hot_pixels = np.array([[10, 12], [30, 41], [31, 42], [62, 5]])
+    image[hot_pixels[:, 0], hot_pixels[:, 1]] = 16000
+    hpm = HotPixelMasker(hot_pixels, shape)
+    masked = hpm.process(image)
+    # regions extended by max_range are masked as the full frame is
+    for row_offset, column_offset, num_rows, num_columns in [(8, 10, 8, 8), (28, 38, 6, 6), (0, 0, 64, 80)]:
+        first_row = max(row_offset - hpm.max_range, 0)
+        first_column = max(column_offset - hpm.max_range, 0)
+        region = image[first_row:row_offset + num_rows + hpm.max_range,
+                       first_column:column_offset + num_columns + hpm.max_range]
+        region = hpm.process_region(region, first_row, first_column)
+        region = region[row_offset - first_row:row_offset - first_row + num_rows,
+                        column_offset - first_column:column_offset - first_column + num_columns]
+        assert np.all(region == masked[row_offset:row_offset + num_rows, column_offset:column_offset + num_columns])
+
+
+def test_hot_pixels_for_geometry():
+    hot_pixels = np.array([[10, 12], [11, 13], [100, 40], [101, 41], [5, 300]])
+    full_frame = FrameGeometry()
+    assert hot_pixels_for_geometry(hot_pixels, full_frame).tolist() == sorted(hot_pixels.tolist())
+    roi = FrameGeometry(width=64, height=48, offset_x=10, offset_y=8)
+    assert hot_pixels_for_geometry(hot_pixels, roi).tolist() == [[2, 2], [3, 3]]
+    binned = FrameGeometry(width=2432, height=1616, binning_horizontal=2, binning_vertical=2)
+    assert hot_pixels_for_geometry(hot_pixels, binned).tolist() == [[2, 150], [5, 6], [50, 20]]
+    assert hot_pixels_for_geometry([], roi).shape == (0, 2)
@@ -0,0 +1,38 @@
+import numpy as np
+
+from pmc_turbo.camera.image_processing import image_statistics
+
+percentiles = [0, 1, 10, 25, 50, 75, 90, 99, 99.9, 100]
+
+
+def test_percentiles_match_numpy():
+    random_state = np.random.RandomState(0)
+    for size in [1, 2, 7, 1000, 2 ** 19 + 3]:
+        image = random_state.randint(0, 2 ** 14, size=size).astype('uint16')
+        histogram = image_statistics.compute_histogram(image)
+        assert histogram.sum() == size
+        result = image_statistics.percentiles_from_histogram(histogram, percentiles)
+        assert np.allclose(result, np.percentile(image, percentiles))
+
+
+def test_frame_statistics():
+    image = np.zeros((64, 64), dtype='uint16')
+    image[0, :10] = image_statistics.MAX_PIXEL_VALUE
+    image[1, :5] = 2 ** 16 - 1  # values above 14 bits are treated as saturated
+    image[2, :] = 100
+    statistics = image_statistics.compute_frame_statistics(image, percentiles)
+    assert statistics['saturated_pixels'] == 15
+    assert statistics['coarse_histogram'].shape == (image_statistics.NUM_COARSE_HISTOGRAM_BINS,)
+    assert statistics['coarse_histogram'].sum() == image.size
+    assert statistics['coarse_histogram'][-1] == 15
+    assert np.allclose(statistics['mean'], (15 * image_statistics.MAX_PIXEL_VALUE + 64 * 100) / float(image.size))
+    assert statistics['percentiles'][-1] == image_statistics.MAX_PIXEL_VALUE
+
+
+def test_row_step():
+    image = np.random.RandomState(1).randint(0, 2 ** 14, size=(1501, 97)).astype('uint16')
+    for row_step in [1, 3, 4]:
+        statistics = image_statistics.compute_frame_statistics(image, percentiles, row_step=row_step)
+        assert statistics['coarse_histogram'].sum() == image[::row_step].size
+        assert np.allclose(statistics['percentiles'], np.percentile(image[::row_step], percentiles))
+        assert np.allclose(statistics['mean'], image[::row_step].mean())
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from nose.tools import assert_raises
+
+from pmc_turbo.camera.image_processing import preview_pyramid
+from pmc_turbo.camera.image_processing.hot_pixels import HotPixelMasker
+from pmc_turbo.camera.pycamera.geometry import FrameGeometry
+
+
+def binned_mean(image, factor):
+    rows = image.shape[0] // factor
+    columns = image.shape[1] // factor
+    blocks = image[:rows * factor, :columns * factor].reshape((rows, factor, columns, factor))
+    return np.round(blocks.mean(axis=(1, 3)))
+
+
+def test_pyramid_levels():
+    image = np.random.RandomState(0).randint(0, 2 ** 14, size=(100, 164)).astype('uint16')
+    levels = preview_pyramid.make_preview_pyramid(image, factors=[4, 8, 16])
+    assert [level.shape for level in levels] == [(25, 41), (12, 20), (6, 10)]
+    for factor, level in zip([4, 8, 16], levels):
+        assert level.dtype == np.uint16
+        assert np.abs(level - binned_mean(image, factor)).max() <= 1
+
+
+def test_bad_factors():
+    with assert_raises(ValueError):
+        preview_pyramid.make_preview_pyramid(np.zeros((32, 32), dtype='uint16'), factors=[4, 6])
+
+
+def test_hot_pixels_masked():
+    shape = (64, 64)
+    image = np.random.RandomState(1).randint(90, 110, size=shape).astype('uint16')
+    hot_pixels = np.array([[5, 7], [40, 63], [63, 0]])
+    image[hot_pixels[:, 0], hot_pixels[:, 1]] = 16000
+    masker = HotPixelMasker(hot_pixels, image_shape=shape)
+    levels = preview_pyramid.make_preview_pyramid(image, factors=[4, 8], hot_pixel_masker=masker)
+    masked = masker.process(image)
+    for factor, level in zip([4, 8], levels):
+        assert np.abs(level - binned_mean(masked, factor)).max() <= 1
+
+
+def test_choose_preview_factor():
+    assert preview_pyramid.choose_preview_factor([4, 8, 16], 1 / 8.) == 8
+    assert preview_pyramid.choose_preview_factor([4, 8, 16], 1 / 6.) == 4
+    assert preview_pyramid.choose_preview_factor([4, 8, 16], 1 / 32.) == 16
+    assert preview_pyramid.choose_preview_factor([4, 8, 16], 1 / 2.) is None
+
+
+class TestPreviewFile(object):
+    def setup(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_round_trip(self):
+        geometry = FrameGeometry(width=128, height=96)
+        image = np.random.RandomState(2).randint(0, 2 ** 14, size=geometry.image_shape).astype('uint16')
+        factors = [4, 8, 16]
+        levels = preview_pyramid.make_preview_pyramid(image, factors)
+        data = preview_pyramid.compress_preview_pyramid(levels, factors, geometry)
+        assert len(data) <= preview_pyramid.preview_max_num_bytes(geometry, factors)
+        filename = os.path.join(self.temp_dir, 'frame')
+        with open(preview_pyramid.get_preview_filename(filename), 'wb') as fh:
+            fh.write(data)
+        loaded, loaded_geometry = preview_pyramid.load_preview_pyramid(filename)
+        assert loaded_geometry == geometry
+        assert sorted(loaded.keys()) == factors
+        for factor, level in zip(factors, levels):
+            assert np.all(loaded[factor] == level)
+        with assert_raises(IOError):
+            preview_pyramid.load_preview_pyramid(os.path.join(self.temp_dir, 'no_such_frame'))
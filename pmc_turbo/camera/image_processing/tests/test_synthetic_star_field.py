@@ -0,0 +1,32 @@
+import numpy as np
+
+from pmc_turbo.camera.image_processing.image_statistics import MAX_PIXEL_VALUE
+from pmc_turbo.camera.image_processing.synthetic_star_field import StarFieldGenerator
+
+
+def test_star_field():
+    generator = StarFieldGenerator(shape=(200, 300), num_stars=20, num_hot_pixels=5)
+    image = generator.make_frame(0, exposure_us=100000)
+    assert image.shape == (200, 300)
+    assert image.dtype == np.uint16
+    assert image.max() <= MAX_PIXEL_VALUE
+    background = np.median(image)
+    assert abs(background - (generator.bias + generator.sky_rate * 0.1)) < 5
+    # the brightest star is well above the background
+    row, column = np.floor(generator.get_star_positions(0)[np.argmax(generator.star_rates)]).astype('int')
+    assert image[row, column] > background + 100
+
+
+def test_exposure_scaling_and_drift():
+    generator = StarFieldGenerator(shape=(200, 300), num_stars=20, drift_per_frame=(1, 2))
+    short_exposure = generator.make_frame(0, exposure_us=10000)
+    long_exposure = generator.make_frame(0, exposure_us=100000)
+    assert np.median(long_exposure) > np.median(short_exposure)
+    assert np.all(generator.get_star_positions(3) == (generator.star_positions + (3, 6)) % (200, 300))
+    assert np.all(short_exposure.ravel()[generator.hot_pixel_indexes] <= long_exposure.ravel()[generator.hot_pixel_indexes])
+
+
+def test_reproducible():
+    frame1 = StarFieldGenerator(shape=(50, 60), seed=3).make_frame(2, exposure_us=50000)
+    frame2 = StarFieldGenerator(shape=(50, 60), seed=3).make_frame(2, exposure_us=50000)
+    assert np.all(frame1 == frame2)
@@ -5,25 +5,23 @@ import tempfile
 import time
 
 import errno
-import numpy as np
 from Queue import Empty as EmptyException
+import numpy as np
 from traitlets.config import Configurable
-from traitlets import (Bool, Int, List, Unicode,Tuple, Bytes)
+from traitlets import (Bool, Int, Float, List, Unicode,Tuple, Bytes, Enum)
 
+from pmc_turbo.camera.pycamera.geometry import FrameGeometry, query_geometry, camera_parameter_names
+from pmc_turbo.camera.pipeline.parameter_poller import ParameterPoller
+from pmc_turbo.camera.pipeline.frame_ring import SLOT_FREE, SLOT_FILLING, SLOT_FILLED
+from pmc_turbo.camera.pipeline.status_table import make_record_dtype, STATUS_NUM_CHARACTERS
 from pmc_turbo.utils.error_counter import CounterCollection
 from pmc_turbo.utils.configuration import GlobalConfiguration
-from pmc_turbo.camera.pycamera.dtypes import frame_info_dtype
+from pmc_turbo.utils.uptime import get_monotonic_time
 
 logger = logging.getLogger(__name__)
-import Pyro4
-
-Pyro4.config.SERVERTYPE = 'multiplex'
-Pyro4.config.SERIALIZERS_ACCEPTED = {'pickle', 'json'}
-Pyro4.config.SERIALIZER = 'pickle'
-
 
 camera_status_columns = ["total_frames", "camera_timestamp_offset", "main_temperature", "sensor_temperature",
-                         "trigger_interval",
+                         "trigger_interval", "burst_frame_count", "last_burst_frames",
                          "AcquisitionFrameCount", "AcquisitionFrameRateAbs", "AcquisitionFrameRateLimit",
                          "AcquisitionMode", "ChunkModeActive",
                          "DeviceTemperature", "DeviceTemperatureSelector", "EFLensFStopCurrent",
@@ -43,35 +41,162 @@ camera_status_columns = ["total_frames", "camera_timestamp_offset", "main_temper
                          "StreamAnnouncedBufferCount", "StreamBytesPerSecond",
                          "StreamHoldEnable", "StreamID", "StreamType", "TriggerMode", "TriggerSource"]
 
+# Record written to the 'acquire' section of the status table
+acquire_status_fields = [('camera_status_update_at', np.float64),
+                         ('camera_timestamp_offset', np.float64),
+                         ('total_frames', np.int64),
+                         ('trigger_interval', np.int64),
+                         ('burst_frame_count', np.int64),
+                         ('last_burst_frames', np.int64),
+                         ('main_temperature', 'S%d' % STATUS_NUM_CHARACTERS),
+                         ('sensor_temperature', 'S%d' % STATUS_NUM_CHARACTERS),
+                         ('buffers_free', np.int64),
+                         ('buffers_on_camera', np.int64),
+                         ('buffers_filled', np.int64)]
+camera_status_parameter_names = [name for name in camera_status_columns
+                                 if name not in dict(acquire_status_fields)]
+acquire_status_dtype = make_record_dtype(acquire_status_fields + [(name, 'S%d' % STATUS_NUM_CHARACTERS)
+                                                                  for name in camera_status_parameter_names])
+
+# Parameters that change the size of the frames
+geometry_parameter_names = set([parameter_name for _, parameter_name in camera_parameter_names] +
+                               ['DecimationHorizontal', 'DecimationVertical', 'PixelFormat'])
+
+def coalesce_commands(commands, coalesced_names, superseded):
+    """
+    Drop commands that are superseded by a later command setting the same parameter
+
+    Parameters
+    ----------
+    commands : list of (name, value, tag)
+        Commands waiting to be applied, in the order they were sent
+    coalesced_names : list of str
+        Parameters for which only the latest pending value matters
+    superseded : dict
+        Maps the tag of each pending command to the tags of the commands it replaces. Updated in place.
+
+    Returns
+    -------
+    list of the commands still to be applied, in order
+    """
+    latest = {}
+    for name, value, tag in commands:
+        if name in coalesced_names and value is not None:
+            latest[name] = tag
+    remaining = []
+    for name, value, tag in commands:
+        if name in latest and latest[name] != tag:
+            superseded.setdefault(latest[name], []).extend([tag] + superseded.pop(tag, []))
+            logger.info("Command %s:%r superseded by a later command" % (name, value))
+        else:
+            remaining.append((name, value, tag))
+    return remaining
+
+
+def next_command_batch(commands, max_commands):
+    """
+    Split off the commands that can be applied together at the next gate time
+
+    Commands are taken in order, up to the first one that sets a parameter already in the batch, so each value gets
+    its own gate time (as a focus sweep needs) and the order of the commands is kept.
+
+    Returns
+    -------
+    batch, remaining : lists of (name, value, tag)
+    """
+    names = set()
+    for k, (name, value, tag) in enumerate(commands):
+        if k == max_commands or name in names:
+            return commands[:k], commands[k:]
+        names.add(name)
+    return commands, []
+
+
 class AcquireImagesProcess(GlobalConfiguration):
     use_simulated_camera = Bool(False).tag(config=True)
     camera_housekeeping_subdir = Unicode('camera').tag(config=True)
     acquire_counters_name = Unicode('acquire_images').tag(config=True)
     camera_ip_address = Bytes("10.0.0.2").tag(config=True)
     trigger_interval = Int(default_value=2,min=1).tag(config=True)
+    camera_parameter_update_interval = Float(default_value=1.0, min=0,
+                                             help="Seconds between updates of the camera parameters status, and "
+                                                  "between reads of the fast changing parameters").tag(config=True)
+    slow_parameter_interval = Float(default_value=10.0, min=0,
+                                    help="Seconds between reads of the camera temperatures").tag(config=True)
+    settings_parameter_interval = Float(default_value=60.0, min=0,
+                                        help="Seconds between reads of camera settings that have not been "
+                                             "changed by a command").tag(config=True)
+    buffer_check_interval = Float(default_value=0.05, min=0,
+                                  help="Maximum time to wait for a frame before checking for buffers released "
+                                       "by the writers").tag(config=True)
     required_camera_configuration = List(trait=Tuple(Bytes(), Bytes()),
                                         default_value=[("PtpMode", "Slave"),
                                                        ("ChunkModeActive", "1"),
-                                                       ("AcquisitionFrameCount", "1"),
                                                        ('AcquisitionMode', "MultiFrame"),
                                                        ("StreamFrameRateConstrain", "0"),
                                                        ('TriggerSource', 'FixedRate'),]).tag(config=True)
     initial_camera_configuration = List(trait=Tuple(Bytes(), Bytes()),
-                                        default_value=[("AcquisitionFrameCount", "1"),
-                                                       ('AcquisitionFrameRateAbs', "1.3"),
+                                        default_value=[('AcquisitionFrameRateAbs', "1.3"),
                                                        ('ExposureTimeAbs', "100000"),
                                                        ('EFLensFocusCurrent', "2050")]).tag(config=True)
+    capture_geometry_configuration = List(trait=Tuple(Bytes(), Bytes()), default_value=[],
+                                          help="Camera parameters selecting binning and the region of interest, "
+                                               "applied in order after the initial configuration, e.g. "
+                                               "[('BinningHorizontal', '2'), ('BinningVertical', '2'), "
+                                               "('Width', '2432'), ('Height', '1616')]. Empty for full frames. These "
+                                               "cannot be changed while the pipeline is running.").tag(config=True)
+    max_commands_per_gate = Int(default_value=10, min=1,
+                                help="Most camera commands to apply before arming the camera for a gate "
+                                     "time").tag(config=True)
+    command_time_budget = Float(default_value=0.3, min=0,
+                                help="Seconds after which no more commands are started before arming the camera, so "
+                                     "the gate time is not missed. The rest wait for the next gate time.").tag(config=True)
+    coalesced_command_names = List(trait=Bytes(), default_value=['ExposureTimeAbs'],
+                                   help="Parameters for which a pending command is dropped when a later command sets "
+                                        "the same parameter. The dropped command's result reports the value that "
+                                        "was applied instead.").tag(config=True)
+    burst_frame_count = Int(default_value=1, min=1,
+                            help="Frames taken at each gate time, at AcquisitionFrameRateAbs. Sets "
+                                 "AcquisitionFrameCount, which can be changed while running by sending an "
+                                 "AcquisitionFrameCount command. BasicPipeline sizes the frame buffers to hold a "
+                                 "burst.").tag(config=True)
+    burst_frame_rate = Float(default_value=0, min=0,
+                             help="AcquisitionFrameRateAbs to use for bursts, 0 to leave it as set by "
+                                  "initial_camera_configuration").tag(config=True)
+    simulated_frame_rate = Float(default_value=2.5, min=0.1,
+                                 help="Frames per second produced by the simulated camera").tag(config=True)
+    simulated_frame_content = Enum(['empty', 'noise', 'stars'], default_value='empty',
+                                   help="Image written into each frame by the simulated camera").tag(config=True)
+    geometry_probe_timeout = Float(default_value=60, min=0,
+                                   help="Seconds to wait for the camera to report its frame geometry").tag(config=True)
+
+    def __init__(self, command_queue, command_result_queue, status, status_table, frame_ring=None, **kwargs):
+        """
+        The frame ring is sized from the geometry reported by probe_geometry, so it may be supplied after
+        construction by setting the frame_ring attribute, as long as this is done before the child process is started.
+
+        The camera status is written to the 'acquire' section of *status_table*, which must have a single record of
+        acquire_status_dtype.
+
+        Consumers 0 to num_compressors - 1 of the frame ring are the compressors; each frame goes to one of them. Any
+        further consumers are stages (see stages.py), listed in the stages attribute, which get every decimation-th
+        frame, at most one every min_interval seconds. If num_compressors is left as None, every consumer is treated
+        as a compressor.
+
+        If max_burst_frame_count is set (BasicPipeline sets it from the size of the frame ring), commands to take
+        longer bursts are refused.
 
-    def __init__(self, raw_image_buffers, acquire_image_output_queue, acquire_image_input_queue,
-                 command_queue, command_result_queue, info_buffer, status, uri, **kwargs):
+        If the tuning attribute is set to a ProcessTuning, it is applied when the process starts.
+        """
         super(AcquireImagesProcess,self).__init__(**kwargs)
-        self.data_buffers = raw_image_buffers
-        self.input_queue = acquire_image_input_queue
-        self.output_queue = acquire_image_output_queue
+        self.frame_ring = frame_ring
+        self.num_compressors = None
+        self.stages = []
+        self.max_burst_frame_count = None
+        self.tuning = None
         self.command_queue = command_queue
         self.command_result_queue = command_result_queue
-        self.info_buffer = info_buffer
-        self.uri = uri
+        self.status_table = status_table
         self.camera_housekeeping_dir = os.path.join(self.housekeeping_dir,self.camera_housekeeping_subdir)
         self.status = status
         self.status.value = "starting"
@@ -101,12 +226,104 @@ class AcquireImagesProcess(GlobalConfiguration):
                                     self.pc.get_parameter("GevDeviceMACAddress")))
         self.status_log_file.write(','.join(['epoch'] + columns) + '\n')
 
-    def get_temperatures(self):
-        self.pc.set_parameter("DeviceTemperatureSelector", "Main")
-        main = self.pc.get_parameter("DeviceTemperature")
-        self.pc.set_parameter("DeviceTemperatureSelector", "Sensor")
-        sensor = self.pc.get_parameter("DeviceTemperature")
-        return dict(main_temperature=main, sensor_temperature=sensor)
+    def configure_camera(self, pc):
+        for name,value in self.required_camera_configuration + self.initial_camera_configuration:
+            if name == 'AcquisitionFrameCount':
+                logger.warning("Ignoring AcquisitionFrameCount %s in the camera configuration, use "
+                               "AcquireImagesProcess.burst_frame_count instead" % value)
+                continue
+            pc.set_parameter(name,value)
+        pc.set_parameter('AcquisitionFrameCount', str(self.burst_frame_count))
+        if self.burst_frame_rate:
+            pc.set_parameter('AcquisitionFrameRateAbs', str(self.burst_frame_rate))
+        for name,value in self.capture_geometry_configuration:
+            pc.set_parameter(name,value)
+
+    def check_burst(self, frame_count):
+        """
+        Return the reason a burst of *frame_count* frames can't be taken, or None if it can
+
+        The burst must fit in the frame buffers, and must finish before the camera is armed for the next gate time,
+        half a second before it.
+        """
+        if frame_count < 1:
+            return "burst must have at least one frame"
+        if self.max_burst_frame_count is not None and frame_count > self.max_burst_frame_count:
+            return "only %d frames fit in the frame buffers" % self.max_burst_frame_count
+        frame_rate = float(self.pc.get_parameter('AcquisitionFrameRateAbs'))
+        if frame_rate > 0 and (frame_count - 1) / frame_rate > self.trigger_interval - 0.5:
+            return ("burst takes %.2f s at %.2f frames/s, longer than the trigger interval allows"
+                    % ((frame_count - 1) / frame_rate, frame_rate))
+        return None
+
+    def set_burst_frame_count(self, value):
+        """
+        Handle an AcquisitionFrameCount command, returning the command result
+        """
+        try:
+            frame_count = int(value)
+        except ValueError:
+            logger.error("Invalid AcquisitionFrameCount %r" % value)
+            return -1
+        problem = self.check_burst(frame_count)
+        if problem:
+            logger.error("Refusing to take bursts of %d frames: %s" % (frame_count, problem))
+            return -1
+        result = self.pc.set_parameter('AcquisitionFrameCount', str(frame_count))
+        if not result:
+            self.burst_frame_count = frame_count
+        return result
+
+    def probe_geometry(self):
+        """
+        Open the camera in a short lived child process, configure it, and return the frame geometry it reports
+
+        This is done in a child process because the camera can only be opened by one process at a time, and the
+        acquisition process can't be started until the frame buffers have been allocated.
+
+        Returns
+        -------
+        FrameGeometry
+        """
+        self.status.value = "probing geometry"
+        result_queue = mp.Queue()
+        probe = mp.Process(target=self._probe_geometry, args=(result_queue,))
+        probe.start()
+        try:
+            result = result_queue.get(timeout=self.geometry_probe_timeout)
+        except EmptyException:
+            probe.terminate()
+            raise RuntimeError("Timed out waiting for the camera to report its frame geometry")
+        probe.join()
+        if isinstance(result, Exception):
+            raise result
+        geometry = FrameGeometry.from_dict(result)
+        logger.info("Camera frame geometry: %r" % geometry)
+        return geometry
+
+    def _probe_geometry(self, result_queue):
+        try:
+            from pmc_turbo import camera
+            pc = camera.PyCamera(self.camera_ip_address, use_simulated_camera=self.use_simulated_camera)
+            self.configure_camera(pc)
+            result_queue.put(query_geometry(pc).to_dict())
+            if self.use_simulated_camera:
+                pc._pc.quit()
+        except Exception as e:
+            logger.exception("Failed to read frame geometry from camera")
+            result_queue.put(RuntimeError("Failed to read frame geometry from camera: %r" % e))
+
+    def publish_status(self, status_update):
+        """
+        Write the latest camera status to the shared status table
+        """
+        values = status_update.copy()
+        values.update([(name, value) for name, value in values.pop('all_camera_parameters').items()
+                       if name in camera_status_parameter_names])
+        values['buffers_free'] = self.frame_ring.count_slots(SLOT_FREE)
+        values['buffers_on_camera'] = self.frame_ring.count_slots(SLOT_FILLING)
+        values['buffers_filled'] = self.frame_ring.count_slots(SLOT_FILLED)
+        self.status_table.update('acquire', 0, **values)
 
     def log_status(self, status_update):
         if time.time() - self.status_log_last_update < self.status_log_update_interval:
@@ -123,143 +340,267 @@ class AcquireImagesProcess(GlobalConfiguration):
         self.status_log_file.write(','.join(['%s' % value for value in values]) + '\n')
         self.status_log_file.flush()
 
+    def stamp_filled(self, slot, camera_timestamp_offset):
+        """
+        Stamp a newly filled slot with the current time and the exposure time, translated from the camera clock to the
+        monotonic clock. The exposure is left unstamped if the camera clock is not synchronized well enough to place
+        it in the past.
+        """
+        now = get_monotonic_time()
+        self.frame_ring.stamps[slot] = 0
+        self.frame_ring.stamp(slot, 'filled', now)
+        camera_timestamp = self.frame_ring.get_slot_info(slot)[0]['timestamp']
+        if camera_timestamp:
+            age = time.time() - (camera_timestamp / 1e9 + camera_timestamp_offset)
+            if age >= 0:
+                self.frame_ring.stamp(slot, 'exposure', now - age)
+
+    def apply_command(self, name, value):
+        """
+        Apply one command from the command queue, returning its result (nonzero for failure)
+        """
+        if name == 'trigger_interval':
+            try:
+                self.trigger_interval = int(value)
+                result = 0
+            except Exception:
+                logger.exception("Failed to set trigger_interval to %r" % value)
+                result = -1
+        elif name == 'AcquisitionFrameCount':
+            result = self.set_burst_frame_count(value)
+            self.parameter_poller.invalidate(name)
+        elif name in geometry_parameter_names:
+            logger.error("Refusing to set %s while running, the frame buffers are sized for the "
+                         "current geometry. Use capture_geometry_configuration instead." % name)
+            result = -1
+        else:
+            if value is None:
+                result = self.pc.run_feature_command(name)
+                self.counters.command_sent.increment()
+            else:
+                result = self.pc.set_parameter(name, value)
+                self.counters.parameter_set.increment()
+            self.parameter_poller.invalidate(name)
+        if result:
+            logger.error("Errorcode %r while executing command %s:%r" % (result, name, value))
+            self.counters.command_non_zero_result.increment()
+        return result
+
+    def apply_commands(self, pending_commands, superseded):
+        """
+        Apply the next batch of pending commands and report their results
+
+        Parameters
+        ----------
+        pending_commands : list of (name, value, tag)
+            Commands received but not yet applied, in order
+        superseded : dict
+            See coalesce_commands
+
+        Returns
+        -------
+        gate_time : int
+            The gate time at which all of the applied commands are in effect
+        pending_commands : list
+            Commands left for the next gate time
+        """
+        while True:
+            try:
+                pending_commands.append(self.command_queue.get_nowait())
+            except EmptyException:
+                break
+        num_received = len(pending_commands)
+        pending_commands = coalesce_commands(pending_commands, self.coalesced_command_names, superseded)
+        for k in range(num_received - len(pending_commands)):
+            self.counters.command_superseded.increment()
+        batch, pending_commands = next_command_batch(pending_commands, self.max_commands_per_gate)
+        results = []
+        start = time.time()
+        for k, (name, value, tag) in enumerate(batch):
+            if k and time.time() - start > self.command_time_budget:
+                logger.info("Deferring %d commands to the next gate time" % (len(batch) - k))
+                pending_commands = batch[k:] + pending_commands
+                break
+            self.status.value = "sending command %s" % name
+            results.append((tag, name, value, self.apply_command(name, value)))
+        # Every command applied above is in effect from this gate time. Computing it after applying the commands
+        # accounts for the time they took.
+        gate_time = int(time.time() + 1)
+        for tag, name, value, result in results:
+            for result_tag in [tag] + superseded.pop(tag, []):
+                self.command_result_queue.put((result_tag, name, value, result, gate_time))
+        return gate_time, pending_commands
+
     def run(self):
-        self.pipeline = Pyro4.Proxy(uri=self.uri)
-        self.pipeline._pyroTimeout = 0
+        if self.tuning is not None:
+            self.tuning.apply()
         self.counters = CounterCollection(self.acquire_counters_name, self.counters_dir)
         self.counters.camera_armed.reset()
         self.counters.buffer_queued.reset()
         self.counters.error_queuing_buffer.reset()
         self.counters.command_sent.reset()
         self.counters.parameter_set.reset()
+        self.counters.command_superseded.reset()
         self.counters.command_non_zero_result.reset()
         self.counters.waiting_for_buffer.reset()
         self.counters.waiting_for_buffer.lazy = True # This gets incremented several times per second, so no need to record every event
         self.counters.buffer_filled.reset()
         self.counters.getting_parameters.reset()
         self.counters.waiting.reset()
-        self.counters.waiting.lazy = True  # waiting gets incremented hundreds of times per second, no need to record every increment
+        self.counters.waiting.lazy = True  # waiting gets incremented many times per second, no need to record every increment
+        self.counters.burst_short_of_buffers.reset()
+        self.counters.incomplete_burst.reset()
 
         # Setup
         frame_number = 0
         from pmc_turbo import camera
         self.status.value = "initializing camera"
         self.pc = camera.PyCamera(self.camera_ip_address, use_simulated_camera=self.use_simulated_camera)
-        for name,value in self.required_camera_configuration:
-            self.pc.set_parameter(name,value)
-        for name,value in self.initial_camera_configuration:
-            self.pc.set_parameter(name,value)
+        self.configure_camera(self.pc)
+        if self.use_simulated_camera:
+            self.pc._pc.set_frame_rate(self.simulated_frame_rate)
+            self.pc._pc.set_frame_content(self.simulated_frame_content)
+
+        self.parameter_poller = ParameterPoller(self.pc, fast_interval=self.camera_parameter_update_interval,
+                                                slow_interval=self.slow_parameter_interval,
+                                                settings_interval=self.settings_parameter_interval)
 
         self.payload_size = int(self.pc.get_parameter('PayloadSize'))
         logger.info("payload size: %d" % self.payload_size)
+        if self.payload_size > self.frame_ring.slot_size:
+            logger.error("Camera payload size %d is larger than the frame buffers (%d bytes), the geometry changed "
+                         "after it was probed" % (self.payload_size, self.frame_ring.slot_size))
+            self.status.value = "geometry mismatch"
+            if self.use_simulated_camera:
+                self.pc._pc.quit()
+            return None
 
+        self.pc.enable_frame_notification()
         self.pc._pc.start_capture()
 
         camera_parameters_last_updated = 0
 
+        problem = self.check_burst(self.burst_frame_count)
+        if problem:
+            logger.warning("Bursts of %d frames may not be taken completely: %s" % (self.burst_frame_count, problem))
+
         last_trigger = int(time.time() + 1)
+        # Frames filled since the camera was last armed, all of which belong to the burst at last_trigger
+        burst_frames = None
+        last_burst_frames = 0
         buffers_on_camera = set()
+        pending_commands = []
+        superseded_commands = {}
         self.acquisition_start_time = time.time()
         # Run loop
-        exit_request = False
         self.status.value = "idle"
 
-        while True:
-            while True:
-                try:
-                    ready_to_queue = self.input_queue.get_nowait()
-                except EmptyException:
-                    break
-                if ready_to_queue is None:
-                    exit_request = True
-                    break
+        # Seconds to add to camera timestamps to get the system time, refreshed with the camera parameters
+        camera_timestamp_offset = self.pc.compare_timestamps()
+
+        if self.num_compressors is None:
+            compressor_indexes = range(self.frame_ring.num_consumers)
+        else:
+            compressor_indexes = range(self.num_compressors)
+        stage_published_at = [0.0] * len(self.stages)
+        while not self.frame_ring.exit_requested:
+            for ready_to_queue in self.frame_ring.get_free_slots():
                 self.status.value = "queueing buffer %d" % ready_to_queue
-                image_buffer = np.frombuffer(self.data_buffers[ready_to_queue].get_obj(), dtype='uint8')
-                # cast the buffer array using the compound data type that has a spot for each info field
-                npy_info_buffer = np.frombuffer(self.info_buffer[ready_to_queue].get_obj(), dtype=frame_info_dtype)
+                image_buffer = self.frame_ring.get_slot_buffer(ready_to_queue)
+                # the info record uses the compound data type that has a spot for each info field
+                npy_info_buffer = self.frame_ring.get_slot_info(ready_to_queue)
+                self.frame_ring.mark_filling(ready_to_queue)
                 result = self.pc._pc.queue_buffer(image_buffer, npy_info_buffer)
                 if result != 0:
                     logger.error("Errorcode while queueing buffer: %r" % result)
                     self.counters.error_queuing_buffer.increment()
+                    self.frame_ring.mark_free(ready_to_queue)
                 else:
                     buffers_on_camera.add(ready_to_queue)
                     self.counters.buffer_queued.increment()
-            if exit_request:
-                break
             if time.time() > last_trigger + (self.trigger_interval-0.5):
                 gate_time = int(time.time() + 1) # the amount of time since last trigger is already almost the trigger interval, so always advance to next second here.
-                if not self.command_queue.empty():
-                    name, value, tag = self.command_queue.get()
-                    self.status.value = "sending command"
-                    if name == 'trigger_interval':
-                        try:
-                            self.trigger_interval = int(value)
-                            result = 0
-                        except Exception:
-                            logger.exception("Failed to set trigger_interval to %r" % value)
-                            result = -1
-                    else:
-                        if value is None:
-                            result = self.pc.run_feature_command(name)
-                            self.counters.command_sent.increment()
-                        else:
-                            result = self.pc.set_parameter(name, value)
-                            self.counters.parameter_set.increment()
-                    if result:
-                        logger.error("Errorcode %r while executing command %s:%r" % (result, name, value))
-                        self.counters.command_non_zero_result.increment()
-                    gate_time = int(time.time() + 1)  # update gate time in case some time has elapsed while executing
-                    # command
-                    self.command_result_queue.put((tag, name, value, result, gate_time))
+                if pending_commands or not self.command_queue.empty():
+                    gate_time, pending_commands = self.apply_commands(pending_commands, superseded_commands)
                 self.status.value = "arming camera"
+                if burst_frames is not None:
+                    last_burst_frames = burst_frames
+                    if burst_frames < self.burst_frame_count:
+                        logger.warning("Only %d of %d frames were received for the burst at gate time %d"
+                                       % (burst_frames, self.burst_frame_count, last_trigger))
+                        self.counters.incomplete_burst.increment()
+                if len(buffers_on_camera) < self.burst_frame_count:
+                    logger.warning("Only %d buffers are queued on the camera for a burst of %d frames"
+                                   % (len(buffers_on_camera), self.burst_frame_count))
+                    self.counters.burst_short_of_buffers.increment()
                 self.pc.set_parameter('PtpAcquisitionGateTime', str(int(gate_time * 1e9)))
                 time.sleep(0.1)
                 self.pc.run_feature_command("AcquisitionStart")
                 last_trigger = gate_time
+                burst_frames = 0
                 self.counters.camera_armed.increment()
 
-            if not buffers_on_camera:
-                self.status.value = "waiting for buffer on camera"
-                time.sleep(0.001)
-                self.counters.waiting_for_buffer.increment()
-            else:
-                self.status.value = "checking buffers"
+            self.status.value = "checking buffers"
             num_buffers_filled = 0
             for buffer_id in list(buffers_on_camera):
-                npy_info_buffer = np.frombuffer(self.info_buffer[buffer_id].get_obj(), dtype=frame_info_dtype)
+                npy_info_buffer = self.frame_ring.get_slot_info(buffer_id)
                 if npy_info_buffer[0]['is_filled']:
                     self.status.value = 'buffer %d was filled by camera' % buffer_id
                     logger.debug(self.status.value)
-                    self.output_queue.put(buffer_id)
+                    self.stamp_filled(buffer_id, camera_timestamp_offset)
+                    compressor = self.frame_ring.least_loaded_consumer(candidates=compressor_indexes)
+                    consumers = [] if compressor is None else [compressor]
+                    published_at = time.time()
+                    for k, stage in enumerate(self.stages):
+                        if (frame_number % stage.decimation == 0
+                                and published_at - stage_published_at[k] >= stage.min_interval
+                                and self.frame_ring.num_pending(stage.consumer_index) < stage.max_pending):
+                            consumers.append(stage.consumer_index)
+                            stage_published_at[k] = published_at
+                    self.frame_ring.publish(buffer_id, consumers=consumers)
                     buffers_on_camera.remove(buffer_id)
                     frame_number += 1
+                    if burst_frames is not None:
+                        burst_frames += 1
                     num_buffers_filled += 1
                     self.counters.buffer_filled.increment()
             if num_buffers_filled == 0:
                 self.status.value = "waiting for buffer to be filled"
                 update_at = time.time()
-                if update_at - camera_parameters_last_updated > 1.0:
+                if update_at - camera_parameters_last_updated > self.camera_parameter_update_interval:
                     self.status.value = "getting camera parameters"
-                    status = self.pc.get_all_parameters()
-                    temperatures = self.get_temperatures()
+                    changed_parameters = self.parameter_poller.poll(update_at)
                     camera_parameters_last_updated = update_at
 
                     self.status.value = "updating status"
-                    timestamp_comparison = self.pc.compare_timestamps() * 1e6
-                    status_update = dict(all_camera_parameters=status,
+                    camera_timestamp_offset = self.pc.compare_timestamps()
+                    timestamp_comparison = camera_timestamp_offset * 1e6
+                    status_update = dict(all_camera_parameters=changed_parameters,
                                          camera_status_update_at=update_at,
                                          camera_timestamp_offset=timestamp_comparison,
                                          total_frames=frame_number,
                                          trigger_interval=self.trigger_interval,
+                                         burst_frame_count=self.burst_frame_count,
+                                         last_burst_frames=last_burst_frames,
                                          )
-                    status_update.update(temperatures)
-                    self.log_status(status_update)
-                    self.pipeline.update_status(status_update)
+                    status_update.update(self.parameter_poller.temperatures)
+                    self.log_status(dict(status_update, all_camera_parameters=self.parameter_poller.values))
+                    self.publish_status(status_update)
                     self.counters.getting_parameters.increment()
                 else:
-                    time.sleep(0.001)
-                    self.status.value = "waiting"
-                    self.counters.waiting.increment()
+                    # Sleep until the camera signals a frame, or until the next trigger or parameter update is due.
+                    # Buffers released by the writers are not signalled, so wake up at least every
+                    # buffer_check_interval to queue them on the camera.
+                    next_deadline = min(last_trigger + (self.trigger_interval - 0.5),
+                                        camera_parameters_last_updated + self.camera_parameter_update_interval,
+                                        update_at + self.buffer_check_interval)
+                    if buffers_on_camera:
+                        self.status.value = "waiting"
+                        self.counters.waiting.increment()
+                    else:
+                        self.status.value = "waiting for buffer on camera"
+                        self.counters.waiting_for_buffer.increment()
+                    self.pc.wait_for_frame(timeout=next_deadline - time.time())
         # if we get here, we were kindly asked to exit
         self.status.value = "exiting"
         if self.use_simulated_camera:
@@ -1,7 +1,9 @@
 """
 Basic pipeline to capture images perform processing, and save to disk.
 
-Currently starts one thread (process) to capture images and 4 threads to write the images to disk.
+Currently starts one thread (process) to capture images, a configurable number of processes to compress them and one
+process per data directory to write the compressed images to disk. Stages added with add_stage, and the latest frame
+tap, run alongside the compressors and see the uncompressed frames (see stages.py).
 
 Eventually want to add threads to do autofocus, autoexposure. Need to keep track of biger status and more camera
 status too.
@@ -23,20 +25,35 @@ import logging
 import multiprocessing as mp
 import os
 import sys
+import threading
 import time
 from Queue import Empty as EmptyException
 
 
-from traitlets import (Bool, Int, Dict)
+import blosc
+from traitlets import (Bool, Int, Dict, Enum, Float, List, Unicode)
 
 import Pyro4
 import Pyro4.socketutil
 
-from pmc_turbo.camera.pipeline.acquire_images import AcquireImagesProcess
+from pmc_turbo.camera.image_processing.blosc_file import get_num_bands, MAX_NUM_BANDS
+from pmc_turbo.camera.image_processing.hot_pixels import load_hot_pixels
+from pmc_turbo.camera.image_processing.preview_pyramid import (check_preview_factors, default_preview_factors,
+                                                               preview_max_num_bytes)
+from pmc_turbo.camera.pipeline.acquire_images import (AcquireImagesProcess, acquire_status_dtype, acquire_status_fields,
+                                                      camera_status_parameter_names)
+from pmc_turbo.camera.pipeline.disk_statistics import DiskStatistics
+from pmc_turbo.camera.pipeline.compress_images import (CompressImageProcess, compressed_frame_info_dtype,
+                                                       compressed_slot_size)
 from pmc_turbo.camera.pipeline.write_images import WriteImageProcess
-from pmc_turbo.camera.pycamera.dtypes import frame_info_dtype
+from pmc_turbo.camera.pipeline.frame_ring import FrameRing, SLOT_FREE, SLOT_FILLING, SLOT_FILLED
+from pmc_turbo.camera.pipeline.latency import LatencyAggregator, LatencyLog
+from pmc_turbo.camera.pipeline.stages import LatestFrameTap
+from pmc_turbo.camera.pipeline.status_table import StatusTable, process_status_dtype
+from pmc_turbo.utils.camera_id import get_camera_id
 from pmc_turbo.utils.error_counter import CounterCollection
 from pmc_turbo.utils.configuration import GlobalConfiguration
+from pmc_turbo.utils.process_tuning import ProcessTuning
 
 Pyro4.config.SERVERTYPE = 'multiplex'
 Pyro4.config.SERIALIZERS_ACCEPTED = {'pickle','json'}
@@ -45,100 +62,297 @@ Pyro4.config.SERIALIZER = 'pickle'
 logger = logging.getLogger(__name__)
 
 
+def read_status_table(status_table):
+    """
+    Build the process and camera part of the pipeline status from the shared status table
+
+    Parameters
+    ----------
+    status_table : StatusTable
+        The table created by BasicPipeline, or opened read only with StatusTable.open
+
+    Returns
+    -------
+    dict in the format of BasicPipeline.get_status, without the disk and frame buffer details. Camera values are
+    only included once the acquire process has reported them.
+    """
+    status = {}
+    for record in status_table.read_section('processes'):
+        status[str(record['name'])] = str(record['status'])
+        if record['cpus']:
+            status['%s cpus' % record['name']] = str(record['cpus'])
+            status['%s niceness' % record['name']] = int(record['niceness'])
+            status['%s tuning applied' % record['name']] = bool(record['tuning_applied'])
+    record = status_table.read('acquire', 0)
+    if record['camera_status_update_at']:
+        for name, _ in acquire_status_fields:
+            status[name.replace('buffers_', 'buffers ').replace('on_camera', 'on camera')] = record[name].item()
+        status['all_camera_parameters'] = dict([(name, str(record[name])) for name in camera_status_parameter_names])
+    return status
+
+
+def burst_num_data_buffers(burst_frame_count, num_compressors, stage_max_pending=0):
+    """
+    Number of frame buffers needed to queue a whole burst on the camera while each compressor is still working on a
+    frame of the previous burst and the stages hold their pending frames
+    """
+    return burst_frame_count + num_compressors + stage_max_pending
+
+
 @Pyro4.expose
 class BasicPipeline(GlobalConfiguration):
-    num_data_buffers = Int(16).tag(config=True)
+    num_data_buffers = Int(16, help="Number of frame buffers. More are allocated if needed to absorb bursts, see "
+                                    "max_burst_frame_count").tag(config=True)
+    max_burst_frame_count = Int(0, min=0, help="Allocate enough frame buffers for bursts of this many frames, so "
+                                               "AcquisitionFrameCount can be raised while running. 0 to size them for "
+                                               "AcquireImagesProcess.burst_frame_count").tag(config=True)
     default_write_enable = Int(1, help="Initial value for disk write enable flag. If nonzero, start writing to disk immediately").tag(config=True)
     rate_limit_intervals = Dict(default_value={}).tag(config=True)
     use_watchdog = Bool(default_value=False).tag(config=True)
+    num_compressors = Int(4, min=1, help="Number of compression processes").tag(config=True)
+    compression_threads = Int(1, min=1, help="Number of blosc threads used by each compression process").tag(config=True)
+    num_compressed_buffers = Int(2, min=1, help="Number of compressed frame buffers per compression process").tag(config=True)
+    compression_codec = Enum(blosc.cnames, default_value='lz4', help="blosc codec used for image files").tag(config=True)
+    compression_level = Int(9, min=0, max=9, help="blosc compression level").tag(config=True)
+    compression_shuffle = Enum(['none', 'byte', 'bit'], default_value='bit', help="blosc shuffle filter").tag(config=True)
+    compression_blocksize = Int(0, min=0, help="blosc block size in bytes, 0 lets blosc choose").tag(config=True)
+    compression_packed_bits = Enum([0, 12, 14], default_value=0,
+                                   help="Pack images to this many bits per pixel before compressing, 0 to store "
+                                        "uint16").tag(config=True)
+    compression_band_rows = Int(0, min=0, help="Compress images in bands of this many rows, so regions can be loaded "
+                                               "without decompressing whole frames. 0 compresses each image as "
+                                               "one block").tag(config=True)
+    statistics_row_step = Int(1, min=1, help="Compute the frame statistics in the index from every n-th row. 1 gives "
+                                             "exact statistics of the full frame, larger steps save compressor time "
+                                             "when it limits the frame rate").tag(config=True)
+    disk_max_write_time = Float(2.0, min=0, help="Disks whose average write time per frame exceeds this many seconds "
+                                                 "are backed off").tag(config=True)
+    index_flush_interval = Float(1.0, min=0, help="Seconds between flushes of the binary frame index").tag(config=True)
+    index_flush_records = Int(1, min=1, help="Flush the binary frame index after this many records").tag(config=True)
+    disk_max_backoff = Float(60.0, min=0, help="Longest time in seconds to avoid a degraded disk").tag(config=True)
+    container_segment_size = Int(0, min=0, help="If nonzero, append frames to segment files of about this many bytes "
+                                                "instead of writing one file per frame").tag(config=True)
+    preview_factors = List(trait=Int, default_value=default_preview_factors,
+                           help="Binning factors of the preview written with each frame, empty for no "
+                                "previews").tag(config=True)
+    latest_frame_decimation = Int(1, min=0, help="Copy every n-th frame to the latest frame file for the controller, "
+                                                 "0 to disable").tag(config=True)
+    latest_frame_interval = Float(0.5, min=0, help="Copy at most one frame every this many seconds to the latest "
+                                                   "frame file").tag(config=True)
+    acquire_cpus = List(trait=Int, default_value=[], help="Cores to pin the acquire process to, empty to let it run "
+                                                         "on any core").tag(config=True)
+    acquire_niceness = Int(None, allow_none=True, min=-20, max=19,
+                           help="Niceness of the acquire process, None to leave it unchanged. Negative values need "
+                                "CAP_SYS_NICE.").tag(config=True)
+    compressor_cpus = List(trait=Int, default_value=[], help="Cores to pin the compression processes "
+                                                            "to").tag(config=True)
+    compressor_niceness = Int(None, allow_none=True, min=-20, max=19).tag(config=True)
+    writer_cpus = List(trait=Int, default_value=[], help="Cores to pin the disk writer processes to").tag(config=True)
+    writer_niceness = Int(None, allow_none=True, min=-20, max=19).tag(config=True)
+    main_process_cpus = List(trait=Int, default_value=[],
+                             help="Cores to pin the main pipeline process, which runs the Pyro daemon, to. Applied "
+                                  "after the other processes start so they do not inherit it.").tag(config=True)
+    main_process_niceness = Int(None, allow_none=True, min=-20, max=19).tag(config=True)
+    lock_frame_buffers = Bool(False, help="Lock the frame buffers into RAM so the camera never waits on a page fault. "
+                                          "Needs CAP_IPC_LOCK or a large enough RLIMIT_MEMLOCK.").tag(config=True)
+    huge_page_frame_buffers = Bool(False, help="Allocate the frame buffers from huge pages, which must be reserved in "
+                                               "/proc/sys/vm/nr_hugepages").tag(config=True)
+    latency_log_interval = Float(60.0, min=0, help="Seconds between entries in the frame latency housekeeping log, 0 "
+                                                   "to disable the log").tag(config=True)
+    latency_housekeeping_subdir = Unicode('latency').tag(config=True)
+
+    def add_stage(self, stage):
+        """
+        Add a FrameStage that will be given the raw frames. Must be called before initialize.
+        """
+        if not hasattr(self, 'stages'):
+            self.stages = []
+        self.stages.append(stage)
 
     def initialize(self):
         logger.info("Initializing with config %r", self.config)
 
-        image_size_bytes = 31440952 # dimensions[0]*dimensions[1]*2  # Need to figure out how to not hard code this
-
         self.counters = CounterCollection('pipeline',self.counters_dir)
         self.counters.commands_queued.reset()
         self.counters.commands_completed.reset()
 
-#        self.num_data_buffers = num_data_buffers
-        self.raw_image_buffers = [mp.Array(ctypes.c_uint8, image_size_bytes) for b in range(self.num_data_buffers)]
-        # We save the buffer info in a custom datatype array, which is a bit ugly, but it works and isn't too bad.
-        self.info_buffer = [mp.Array(ctypes.c_uint8, frame_info_dtype.itemsize)
-                            for b in range(self.num_data_buffers)]
-
-        # The input queue holds indexes for the buffers that have already been emptied (processed) and are ready to
-        # recieve new images. The acquire thread grabs an index from the input queue, fills the corresponding buffer,
-        # wirtes the info to the info_buffer and then puts that index into the output queue to indicate that that
-        # buffer is ready for processing.
-        #
-        # Right now there is only one next step: writing to disk. So the disk thread uses the
-        # acquire_image_output_queue as it's input (where it looks for the next buffer that needs processing). And
-        # when it's done, it puts the index of the now empty buffer back in acquire_image_input queue so it can be
-        # filled again.
-        #
-        self.acquire_image_input_queue = mp.Queue()
-        self.acquire_image_output_queue = mp.Queue()
+        num_writers = len(self.data_directories)
+        if not hasattr(self, 'stages'):
+            self.stages = []
+        hot_pixels = load_hot_pixels(self.hot_pixel_file_dictionary, get_camera_id())
+        self.latest_frame_tap = None
+        if self.latest_frame_decimation:
+            self.latest_frame_tap = LatestFrameTap(self.latest_frame_filename, decimation=self.latest_frame_decimation,
+                                                   min_interval=self.latest_frame_interval,
+                                                   preview_factors=self.preview_factors, hot_pixels=hot_pixels)
+            self.stages.append(self.latest_frame_tap)
+
         self.acquire_image_command_queue = mp.Queue()
         self.acquire_image_command_results_queue = mp.Queue()
         self.acquire_image_command_results_dict = {}
 
-        # The following are shared status variables used to indicate what state each process is in.
-        # We can also use such things for other state (i.e. camera or birger state, or other housekeeping) if
-        # desired, but that might unecessarily complicate things
-        self.acquire_status = mp.Array(ctypes.c_char,32)
-        self.disk_statuses = [mp.Array(ctypes.c_char,32) for disk in self.data_directories]
-        num_writers = len(self.data_directories)
-
+        # Each process reports what it is doing, and the acquire process reports the camera status, in a shared
+        # memory table. Other processes on this host can read it without going through Pyro, see status_table.py.
+        process_names = (['acquire'] + ['compressor %d' % k for k in range(self.num_compressors)]
+                         + ['disk %d' % k for k in range(num_writers)]
+                         + ['stage %s' % stage.name for stage in self.stages] + ['pipeline'])
+        self.status_table = StatusTable(self.status_table_filename,
+                                        [('processes', process_status_dtype, len(process_names)),
+                                         ('acquire', acquire_status_dtype, 1)])
+        for row, name in enumerate(process_names):
+            self.status_table.update('processes', row, name=name)
+        self.acquire_status = self.status_table.get_status_value(0)
+        self.compressor_statuses = [self.status_table.get_status_value(1 + k) for k in range(self.num_compressors)]
+        self.disk_statuses = [self.status_table.get_status_value(1 + self.num_compressors + k)
+                              for k in range(num_writers)]
+        self.stage_statuses = [self.status_table.get_status_value(1 + self.num_compressors + num_writers + k)
+                               for k in range(len(self.stages))]
+        self.main_process_status = self.status_table.get_status_value(len(process_names) - 1)
+        self.main_process_status.value = "initializing"
+
+        self.disk_statistics = DiskStatistics(num_disks=num_writers, max_write_time=self.disk_max_write_time,
+                                              max_backoff=self.disk_max_backoff)
         self.disk_write_enables = [mp.Value(ctypes.c_int32) for disk in self.data_directories]
         for enable in self.disk_write_enables:
             enable.value=int(self.default_write_enable)
 
-        # we prime the input queue to indicate that all buffers are ready to be filled
-        for i in range(self.num_data_buffers):
-            self.acquire_image_input_queue.put(i)
-
         self.status_dict = {}
 
         self.daemon = Pyro4.Daemon(host='0.0.0.0',port=self.pipeline_pyro_port)
         uri = self.daemon.register(self,"pipeline")
         print uri
 
+        self.acquire_images = AcquireImagesProcess(command_queue=self.acquire_image_command_queue,
+                                                   command_result_queue=self.acquire_image_command_results_queue,
+                                                   status=self.acquire_status,
+                                                   status_table=self.status_table,
+                                                   config=self.config)
+
+        # Ask the camera for the frame geometry (which depends on the configured binning and region of interest) so
+        # the buffers can be sized to match.
+        self.geometry = self.acquire_images.probe_geometry()
+        self.status_dict['frame geometry'] = self.geometry.to_dict()
+
+        # All frame buffers live in a single shared memory ring. The acquire process queues free slots on the camera
+        # and publishes each filled slot to one of the compression processes, which hands it back when done. Slot
+        # ownership is tracked in a small shared state header, so no locks or queues are needed to pass frames around.
+        # See frame_ring.py for details. Stages are the consumers after the compressors.
+        # The buffers are allocated once, so they are sized for the longest burst that may be requested. The writers
+        # drain a burst from them at their own pace.
+        stage_max_pending = sum([stage.max_pending for stage in self.stages])
+        burst_frame_count = max(self.acquire_images.burst_frame_count, self.max_burst_frame_count)
+        num_data_buffers = max(self.num_data_buffers,
+                               burst_num_data_buffers(burst_frame_count, self.num_compressors, stage_max_pending))
+        if num_data_buffers > self.num_data_buffers:
+            logger.info("Allocating %d frame buffers (%.1f GB) instead of %d to hold bursts of %d frames"
+                        % (num_data_buffers, num_data_buffers * self.geometry.payload_size / 1e9,
+                           self.num_data_buffers, burst_frame_count))
+        self.frame_ring = FrameRing(num_slots=num_data_buffers, slot_size=self.geometry.payload_size,
+                                    num_consumers=self.num_compressors + len(self.stages),
+                                    huge_pages=self.huge_page_frame_buffers)
+        self.status_dict['frame buffers huge pages'] = self.frame_ring.huge_pages
+        # Locked pages stay resident for the child processes too, as long as this process holds the lock
+        self.status_dict['frame buffers locked'] = self.lock_frame_buffers and self.frame_ring.lock_memory()
+        self.acquire_images.max_burst_frame_count = num_data_buffers - self.num_compressors - stage_max_pending
+        self.acquire_images.frame_ring = self.frame_ring
+        self.acquire_images.num_compressors = self.num_compressors
+        self.acquire_images.stages = self.stages
+        for k, stage in enumerate(self.stages):
+            stage.attach(self.frame_ring, consumer_index=self.num_compressors + k, status=self.stage_statuses[k],
+                         geometry=self.geometry)
+        # Each compression process owns a ring of compressed frame buffers which it hands to the disk writers, so
+        # compression and disk I/O can be scaled independently.
+        check_preview_factors(self.preview_factors)
+        num_bands = get_num_bands(self.geometry, self.compression_band_rows)
+        if num_bands > MAX_NUM_BANDS:
+            raise ValueError("compression_band_rows of %d splits %d row frames into more than %d bands"
+                             % (self.compression_band_rows, self.geometry.height, MAX_NUM_BANDS))
+        preview_num_bytes = preview_max_num_bytes(self.geometry, self.preview_factors) if self.preview_factors else 0
+        self.compressed_rings = [FrameRing(num_slots=self.num_compressed_buffers,
+                                           slot_size=compressed_slot_size(self.geometry.payload_size,
+                                                                          preview_num_bytes, num_bands),
+                                           num_consumers=num_writers, info_dtype=compressed_frame_info_dtype)
+                                 for k in range(self.num_compressors)]
+
+        # Each writer logs the timestamps of the frames it has indexed, and the latency aggregator collects them into
+        # histograms of how long frames spend in each stage. See latency.py.
+        self.latency_logs = [LatencyLog() for k in range(num_writers)]
+        if self.latency_log_interval:
+            latency_housekeeping_dir = os.path.join(self.housekeeping_dir, self.latency_housekeeping_subdir)
+        else:
+            latency_housekeeping_dir = None
+        self.latency_aggregator = LatencyAggregator(self.latency_logs, housekeeping_dir=latency_housekeeping_dir,
+                                                    log_interval=self.latency_log_interval)
+
         # instantiate (and start) the threads
         # in general, make sure to start the Acquire process last; that way no data starts flowing through the
         # system until all threads have started running.
         output_dir = time.strftime("%Y-%m-%d_%H%M%S")
         self.writers = [
-            WriteImageProcess(input_buffers=self.raw_image_buffers, input_queue=self.acquire_image_output_queue,
-                              output_queue=self.acquire_image_input_queue, info_buffer=self.info_buffer,
+            WriteImageProcess(input_rings=self.compressed_rings, consumer_index=k,
+                              disk_statistics=self.disk_statistics,
                               status=self.disk_statuses[k], output_dir=output_dir,
                               available_disks=[self.data_directories[k]], write_enable=self.disk_write_enables[k],
                               rate_limit_interval=dict(self.rate_limit_intervals).get(self.data_directories[k],0),
-                              use_watchdog=self.use_watchdog)
+                              use_watchdog=self.use_watchdog, geometry=self.geometry,
+                              index_flush_interval=self.index_flush_interval,
+                              index_flush_records=self.index_flush_records,
+                              latency_log=self.latency_logs[k], segment_size=self.container_segment_size)
             for k in range(num_writers)]
 
-        self.acquire_images = AcquireImagesProcess(raw_image_buffers=self.raw_image_buffers,
-                                                   acquire_image_output_queue=self.acquire_image_output_queue,
-                                                   acquire_image_input_queue=self.acquire_image_input_queue,
-                                                   command_queue=self.acquire_image_command_queue,
-                                                   command_result_queue=self.acquire_image_command_results_queue,
-                                                   info_buffer=self.info_buffer,
-                                                   status=self.acquire_status,
-                                                   uri=uri,
-                                                   config=self.config)
+        compression_parameters = dict(cname=self.compression_codec, clevel=self.compression_level,
+                                      shuffle=self.compression_shuffle, blocksize=self.compression_blocksize,
+                                      packed_bits=self.compression_packed_bits, band_rows=self.compression_band_rows)
+        # The compressors post the frame statistics for the latest frame tap
+        latest_frame_table = self.latest_frame_tap.table if self.latest_frame_tap is not None else None
+        self.compressors = [
+            CompressImageProcess(input_ring=self.frame_ring, consumer_index=k, output_ring=self.compressed_rings[k],
+                                 writer_rings=self.compressed_rings, write_enables=self.disk_write_enables,
+                                 disk_statistics=self.disk_statistics,
+                                 status=self.compressor_statuses[k], geometry=self.geometry,
+                                 num_threads=self.compression_threads,
+                                 compression_parameters=compression_parameters,
+                                 preview_factors=self.preview_factors, hot_pixels=hot_pixels,
+                                 statistics_row_step=self.statistics_row_step,
+                                 latest_frame_table=latest_frame_table)
+            for k in range(self.num_compressors)]
 
         self._setup_camera_command_log(output_dir)
 
+        # Each process applies its own scheduling settings when it starts, and reports the settings in effect
+        self.acquire_images.tuning = ProcessTuning(self.acquire_cpus, self.acquire_niceness, self.acquire_status)
+        for k, compressor in enumerate(self.compressors):
+            compressor.tuning = ProcessTuning(self.compressor_cpus, self.compressor_niceness,
+                                              self.compressor_statuses[k])
+        for k, writer in enumerate(self.writers):
+            writer.tuning = ProcessTuning(self.writer_cpus, self.writer_niceness, self.disk_statuses[k])
+        for k, stage in enumerate(self.stages):
+            stage.tuning = ProcessTuning(status=self.stage_statuses[k])
+
         for writer in self.writers:
             writer.child.start()
+        for compressor in self.compressors:
+            compressor.child.start()
+        for stage in self.stages:
+            stage.child.start()
         self.acquire_images.child.start()
+        ProcessTuning(self.main_process_cpus, self.main_process_niceness, self.main_process_status).apply()
+        self.main_process_status.value = "running"
+        self.latency_thread = threading.Thread(target=self._log_latency)
+        self.latency_thread.daemon = True
+        self.latency_thread.start()
         #signal.signal(signal.SIGTERM,self.exit)
 
+    def _log_latency(self):
+        while not self.frame_ring.exit_requested:
+            try:
+                self.latency_aggregator.log_if_due()
+            except Exception:
+                logger.exception("Failed to log frame latency")
+            time.sleep(1)
+
     def run_pyro_loop(self):
         self.daemon.requestLoop()
-    @Pyro4.oneway
-    def update_status(self,d):
-        self.status_dict.update(d)
     def _keep_running(self):
         print "check running",self.keep_running
         return self.keep_running
@@ -149,13 +363,24 @@ class BasicPipeline(GlobalConfiguration):
         -------
 
         """
-        process_status = dict(acquire=self.acquire_status.value)
-        for k,status in enumerate(self.disk_statuses):
-            process_status['disk %d' % k] = status.value
-            process_status['disk write enable %d' %k] = self.disk_write_enables[k].value
+        status = read_status_table(self.status_table)
+        status.update(self.get_extra_status())
+        return status
 
-        self.status_dict.update(process_status)
-        return self.status_dict
+    def get_extra_status(self):
+        """
+        Return the part of the status that is not in the shared status table: disk write enables and statistics,
+        frame buffers and latency. Processes on this computer read the rest from the table, see read_status_table.
+        """
+        status = dict(self.status_dict)
+        for k,enable in enumerate(self.disk_write_enables):
+            status['disk write enable %d' %k] = enable.value
+        status.update(self.disk_statistics.get_status())
+        status['buffers free'] = self.frame_ring.count_slots(SLOT_FREE)
+        status['buffers on camera'] = self.frame_ring.count_slots(SLOT_FILLING)
+        status['buffers filled'] = self.frame_ring.count_slots(SLOT_FILLED)
+        status['latency'] = self.latency_aggregator.get_status()
+        return status
 
     def _setup_camera_command_log(self,output_dir):
         self.camera_commands_filename = os.path.join(self.camera_commands_dir,output_dir+'.csv')
@@ -206,22 +431,30 @@ class BasicPipeline(GlobalConfiguration):
         """
         Request all processing threads to stop.
 
-        Right now this is accomplished by putting None into the queues which acts as a kill request. probably better
-        to use a shared variable to request threads to die.
+        This is accomplished by setting the exit request flag in the shared frame ring, which every process checks.
         Returns
         -------
 
         """
-        self.acquire_image_input_queue.put(None)
-        for k in range(8):
-            self.acquire_image_output_queue.put(None)
+        self.frame_ring.request_exit()
+        for ring in self.compressed_rings:
+            ring.request_exit()
         self.acquire_images.child.join(timeout=1)
         logger.debug("acquire process status at exit: %s" % self.acquire_status.value)
+        for k,compressor in enumerate(self.compressors):
+            compressor.child.join(timeout=1)
+            logger.debug("compressor process status at exit: %s" % self.compressor_statuses[k].value)
+            compressor.child.terminate()
+        for k,stage in enumerate(self.stages):
+            stage.child.join(timeout=1)
+            logger.debug("stage %s status at exit: %s" % (stage.name, self.stage_statuses[k].value))
+            stage.child.terminate()
         for k,writer in enumerate(self.writers):
             writer.child.join(timeout=1)
             logger.debug("writer process status at exit: %s" % self.disk_statuses[k].value)
             writer.child.terminate()
         self.acquire_images.child.terminate()
+        self.latency_thread.join(timeout=2)
         self.daemon.shutdown()
     def exit(self,signum,frame):  # pragma: no cover
         print "exiting with signum",signum,frame
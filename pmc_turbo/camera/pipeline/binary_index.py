@@ -0,0 +1,266 @@
+"""
+Binary frame index written by the disk writers.
+
+Each written frame adds one fixed width record (index_record_dtype) to the index file in its directory. The file starts
+with a short header:
+
+    magic (8 bytes), header length (little endian uint32), JSON encoded numpy dtype description, padding
+
+so a reader can always decode the records, even if fields are added later. Records are appended through a buffered
+file handle that is flushed according to a configurable policy, avoiding an open/close and string formatting for
+every frame.
+
+Readers memory map the records, so reading the index does not require parsing text and timestamp lookups are a binary
+search on the frame_timestamp_ns column. export_csv converts a binary index to the original index.csv format.
+"""
+import json
+import logging
+import os
+import struct
+import time
+
+import numpy as np
+import pandas as pd
+
+from pmc_turbo.camera.image_processing.image_statistics import NUM_COARSE_HISTOGRAM_BINS
+from pmc_turbo.camera.pycamera.geometry import geometry_keys
+
+logger = logging.getLogger(__name__)
+
+INDEX_MAGIC = 'PMCINDEX'
+header_length_format = '<I'
+header_prefix_num_bytes = len(INDEX_MAGIC) + struct.calcsize(header_length_format)
+HEADER_ALIGNMENT = 512
+MAX_FILENAME_LENGTH = 256
+
+percentiles_to_compute = [0,1,10,20,30,40,50,60,70,80,90,99,100]
+percentile_keys = ['percentile_%d' % k for k in percentiles_to_compute]
+histogram_keys = ['histogram_%d' % k for k in range(NUM_COARSE_HISTOGRAM_BINS)]
+statistics_keys = ['mean', 'saturated_pixels'] + histogram_keys
+
+index_record_dtype = np.dtype([('file_index', np.int64),
+                               ('write_timestamp', np.float64),
+                               ('frame_timestamp_ns', np.int64),
+                               ('frame_status', np.int64),
+                               ('frame_id', np.int64),
+                               ('acquisition_count', np.int64),
+                               ('lens_status', np.int64),
+                               ('focus_step', np.int64),
+                               ('aperture_stop', np.int64),
+                               ('exposure_us', np.int64),
+                               ('gain_db', np.int64),
+                               ('focal_length_mm', np.int64),
+                               ('filename', 'S%d' % MAX_FILENAME_LENGTH)]
+                              + [(key, np.float64) for key in percentile_keys]
+                              + [('mean', np.float64),
+                                 ('saturated_pixels', np.int64)]
+                              + [(key, np.int64) for key in histogram_keys]
+                              + [(key, np.int64) for key in geometry_keys])
+index_keys = list(index_record_dtype.names)
+
+
+def fill_frame_record(record, frame_info, chunk_data, statistics, geometry):
+    """
+    Fill the fields of an index record that describe the frame itself
+
+    The file_index, write_timestamp and filename fields are left for the caller.
+
+    Parameters
+    ----------
+    record : array of one index_record_dtype record
+    frame_info : record with frame_id, timestamp and frame_status fields
+    chunk_data : chunk_dtype record
+    statistics : mapping with percentiles, mean, saturated_pixels and coarse_histogram, as from
+        compute_frame_statistics, or None to leave the statistics fields for the caller
+    geometry : FrameGeometry
+    """
+    record['frame_timestamp_ns'] = frame_info['timestamp']
+    record['frame_status'] = frame_info['frame_status']
+    record['frame_id'] = frame_info['frame_id']
+    record['acquisition_count'] = chunk_data['acquisition_count']
+    record['lens_status'] = chunk_data['lens_status_focus'] >> 10
+    record['focus_step'] = chunk_data['lens_status_focus'] & 0x3FF
+    record['aperture_stop'] = chunk_data['lens_aperture']
+    record['exposure_us'] = chunk_data['exposure_us']
+    record['gain_db'] = chunk_data['gain_db']
+    record['focal_length_mm'] = chunk_data['lens_focal_length']
+    if statistics is not None:
+        fill_statistics(record, statistics)
+    for key, value in geometry.to_dict().items():
+        record[key] = value
+
+
+def fill_statistics(record, statistics):
+    """
+    Fill the statistics fields of an index record from a mapping with percentiles, mean, saturated_pixels and
+    coarse_histogram
+    """
+    for key, value in zip(percentile_keys, statistics['percentiles']):
+        record[key] = value
+    record['mean'] = statistics['mean']
+    record['saturated_pixels'] = statistics['saturated_pixels']
+    for key, value in zip(histogram_keys, statistics['coarse_histogram']):
+        record[key] = value
+
+
+def _dtype_to_json(dtype):
+    return json.dumps([list(field) for field in dtype.descr])
+
+
+def _dtype_from_json(text):
+    return np.dtype([tuple(str(item) if isinstance(item, basestring) else item for item in field)
+                     for field in json.loads(text)])
+
+
+def make_index_header(dtype=index_record_dtype):
+    description = _dtype_to_json(dtype)
+    header = INDEX_MAGIC + struct.pack(header_length_format, len(description)) + description
+    padding = -len(header) % HEADER_ALIGNMENT
+    return header + '\x00' * padding
+
+
+def read_index_header(fh):
+    """
+    Read the header from an open index file
+
+    Returns
+    -------
+    dtype : numpy dtype of the records
+    data_offset : int
+        Position of the first record in the file
+    """
+    prefix = fh.read(header_prefix_num_bytes)
+    if len(prefix) < header_prefix_num_bytes or not prefix.startswith(INDEX_MAGIC):
+        raise ValueError("%s is not a binary index file" % getattr(fh, 'name', fh))
+    description_length, = struct.unpack(header_length_format, prefix[len(INDEX_MAGIC):])
+    dtype = _dtype_from_json(fh.read(description_length))
+    header_length = header_prefix_num_bytes + description_length
+    return dtype, header_length + (-header_length % HEADER_ALIGNMENT)
+
+
+class BinaryIndexWriter(object):
+    def __init__(self, filename, flush_interval=1.0, flush_records=1, dtype=index_record_dtype):
+        """
+        Create a new index file and keep it open for appending records.
+
+        Parameters
+        ----------
+        filename : str
+        flush_interval : float
+            Flush buffered records to the file when the oldest unflushed record is older than this many seconds
+        flush_records : int
+            Flush when this many records are buffered. Use 1 to flush every record.
+        dtype : numpy dtype
+        """
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.flush_records = flush_records
+        self.dtype = dtype
+        self.fh = open(filename, 'wb')
+        self.fh.write(make_index_header(dtype))
+        self.fh.flush()
+        self.num_unflushed = 0
+        self.first_unflushed_at = None
+
+    def new_record(self):
+        return np.zeros((1,), dtype=self.dtype)
+
+    def append(self, record):
+        if len(record['filename'][0]) >= MAX_FILENAME_LENGTH:
+            logger.warning("Filename %s is too long for the index and will be truncated" % record['filename'][0])
+        self.fh.write(record.tostring())
+        if self.num_unflushed == 0:
+            self.first_unflushed_at = time.time()
+        self.num_unflushed += 1
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """
+        Apply the flush policy. Call this periodically even when no records are being added.
+        """
+        if self.num_unflushed and (self.num_unflushed >= self.flush_records or
+                                   time.time() - self.first_unflushed_at >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        self.fh.flush()
+        self.num_unflushed = 0
+
+    def close(self):
+        self.flush()
+        self.fh.close()
+
+
+class BinaryIndexReader(object):
+    def __init__(self, filename):
+        """
+        Memory map the records of a binary index file.
+
+        Records added after the reader is created become visible after calling update().
+        """
+        self.filename = filename
+        self.dtype = None
+        self.data_offset = None
+        self.records = np.zeros((0,), dtype=index_record_dtype)
+        self.update()
+
+    def update(self):
+        """
+        Remap the file if complete records have been added since the last update
+
+        Returns
+        -------
+        number of records
+        """
+        if self.dtype is None:
+            with open(self.filename, 'rb') as fh:
+                self.dtype, self.data_offset = read_index_header(fh)
+            self.records = np.zeros((0,), dtype=self.dtype)
+        num_records = max(os.path.getsize(self.filename) - self.data_offset, 0) // self.dtype.itemsize
+        if num_records != self.records.shape[0]:
+            self.records = np.memmap(self.filename, dtype=self.dtype, mode='r', offset=self.data_offset,
+                                     shape=(num_records,))
+        return num_records
+
+    def __len__(self):
+        return self.records.shape[0]
+
+    def search_timestamp(self, timestamp_ns, side='right'):
+        """
+        Binary search for *timestamp_ns* in the frame_timestamp_ns column, which is in increasing order
+        """
+        return int(np.searchsorted(self.records['frame_timestamp_ns'], timestamp_ns, side=side))
+
+    def to_dataframe(self, start=0, stop=None):
+        return pd.DataFrame.from_records(np.array(self.records[start:stop]))
+
+
+class BinaryIndexWatcher(object):
+    def __init__(self, filename):
+        """
+        Provide new records of a binary index as DataFrame fragments, like IndexWatcher does for CSV indexes.
+        """
+        self.filename = filename
+        self.reader = None
+        self.num_rows_read = 0
+
+    def get_fragment(self):
+        fragment = None
+        try:
+            if self.reader is None:
+                self.reader = BinaryIndexReader(self.filename)
+            num_records = self.reader.update()
+            if num_records > self.num_rows_read:
+                fragment = self.reader.to_dataframe(start=self.num_rows_read, stop=num_records)
+                self.num_rows_read = num_records
+        except Exception:
+            logger.exception("Failed to get fragment, something wrong with index file?")
+        return fragment
+
+
+def export_csv(binary_filename, csv_filename):
+    """
+    Write the records of a binary index to a CSV file in the index.csv format
+    """
+    reader = BinaryIndexReader(binary_filename)
+    reader.to_dataframe().to_csv(csv_filename, index=False, columns=list(reader.dtype.names))
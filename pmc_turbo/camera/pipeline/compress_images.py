@@ -0,0 +1,230 @@
+import logging
+import multiprocessing as mp
+import time
+
+import blosc
+import numpy as np
+
+from pmc_turbo.camera.image_processing.blosc_file import (compress_image_blosc, BLOSC_FILE_HEADER_MAX_BYTES,
+                                                          BLOSC_MAX_OVERHEAD)
+from pmc_turbo.camera.image_processing.hot_pixels import HotPixelMasker, hot_pixels_for_geometry
+from pmc_turbo.camera.image_processing.image_statistics import compute_frame_statistics, NUM_COARSE_HISTOGRAM_BINS
+from pmc_turbo.camera.image_processing.preview_pyramid import compress_preview_pyramid, make_preview_pyramid
+from pmc_turbo.camera.pipeline.stages import post_statistics
+from pmc_turbo.camera.pipeline.write_images import percentiles_to_compute
+from pmc_turbo.camera.pycamera.dtypes import chunk_num_bytes, chunk_dtype
+from pmc_turbo.camera.pycamera.geometry import full_frame_geometry
+
+logger = logging.getLogger(__name__)
+
+# Info record attached to each slot of a compressed frame ring. It carries everything the writers need to name the file
+# and add it to the index, since they never see the uncompressed frame. The compressed preview file (see
+# preview_pyramid.py), if any, follows the compressed frame in the slot.
+compressed_frame_info_dtype = np.dtype([('frame_id', np.uint64),
+                                        ('timestamp', np.uint64),
+                                        ('frame_status', np.uint32),
+                                        ('compressed_size', np.uint64),
+                                        ('preview_size', np.uint64),
+                                        ('chunk', chunk_dtype),
+                                        ('percentiles', np.float64, (len(percentiles_to_compute),)),
+                                        ('mean', np.float64),
+                                        ('saturated_pixels', np.uint64),
+                                        ('coarse_histogram', np.uint64, (NUM_COARSE_HISTOGRAM_BINS,))])
+
+
+def compressed_slot_size(payload_size, preview_num_bytes=0, num_bands=0):
+    # Banded images are compressed as one block per band plus one for the chunk data
+    return payload_size + (num_bands + 1) * BLOSC_MAX_OVERHEAD + BLOSC_FILE_HEADER_MAX_BYTES + preview_num_bytes
+
+
+class CompressImageProcess(object):
+    def __init__(self, input_ring, consumer_index, output_ring, writer_rings, write_enables, disk_statistics, status,
+                 geometry=full_frame_geometry, num_threads=1, compression_parameters=None, preview_factors=None,
+                 hot_pixels=None, statistics_row_step=1, latest_frame_table=None, poll_interval=0.01):
+        """
+        Compress filled camera buffers into a ring of compressed frame buffers for the writers.
+
+        Parameters
+        ----------
+        input_ring : FrameRing
+            Ring of raw camera frames, this process is consumer *consumer_index* of it
+        consumer_index : int
+        output_ring : FrameRing
+            Ring of compressed frames. This process is the only producer of this ring, and each writer is a consumer
+        writer_rings : list of FrameRing
+            All compressed frame rings (one per compressor), used to balance load across the writers
+        write_enables : list of mp.Value
+            Write enable flag for each writer. Frames are only sent to enabled writers.
+        disk_statistics : DiskStatistics
+            Write performance measured by each writer, used to schedule frames
+        status : mp.Array of c_char
+        geometry : FrameGeometry
+            Geometry of the frames in the input ring
+        num_threads : int
+            Number of threads blosc should use in this process
+        compression_parameters : dict
+            Keyword arguments for compress_image_blosc (cname, clevel, shuffle, blocksize, packed_bits, band_rows).
+            The defaults of compress_image_blosc are used for anything not given.
+        preview_factors : list of int
+            Binning factors of the preview written with each frame (see preview_pyramid.py). None or empty for no
+            previews. The output ring slots must have room for the previews, see compressed_slot_size.
+        hot_pixels : array of (row, column)
+            Hot pixels to mask in the previews
+        statistics_row_step : int
+            Compute the frame statistics from every statistics_row_step-th row, see image_statistics.py
+        latest_frame_table : StatusTable
+            Table of a LatestFrameTap to post the statistics of each frame to, so the tap need not compute them
+            again. None if there is no tap.
+        poll_interval : float
+            Seconds to sleep when there is nothing to do
+        """
+        self.input_ring = input_ring
+        self.consumer_index = consumer_index
+        self.output_ring = output_ring
+        self.writer_rings = writer_rings
+        self.write_enables = write_enables
+        self.disk_statistics = disk_statistics
+        self.geometry = geometry
+        self.num_threads = num_threads
+        if compression_parameters is None:
+            compression_parameters = {}
+        self.compression_parameters = compression_parameters
+        self.preview_factors = preview_factors
+        if hot_pixels is None:
+            hot_pixels = []
+        self.hot_pixels = hot_pixels
+        self.statistics_row_step = statistics_row_step
+        self.latest_frame_table = latest_frame_table
+        self.poll_interval = poll_interval
+        self.last_writer = consumer_index - 1  # stagger the compressors so they start on different writers
+        self.status = status
+        self.status.value = "starting"
+        self.tuning = None  # ProcessTuning applied when the process starts
+        self.child = mp.Process(target=self.run)
+
+    def choose_writer(self, exclude=None):
+        """
+        Pick the writer expected to finish writing a new frame soonest
+
+        The expected time is the number of frames the writer has outstanding (across all compressors) times its
+        measured write time. Disks that are degraded or low on space are only used if no other writer is available.
+        Ties are broken round robin so the frames are spread across the disks.
+
+        Parameters
+        ----------
+        exclude : int
+            Writer that should not be considered, for example because it just failed to write this frame
+
+        Returns
+        -------
+        writer index or None if no writer can take frames
+        """
+        num_writers = len(self.write_enables)
+        now = time.time()
+        best_writer = None
+        best_score = None
+        for k in range(num_writers):
+            writer = (self.last_writer + 1 + k) % num_writers
+            if (writer == exclude or not self.write_enables[writer].value
+                    or not self.output_ring.is_consumer_active(writer)):
+                continue
+            pending = sum([ring.num_pending(writer) for ring in self.writer_rings])
+            score = ((self.disk_statistics.is_degraded(writer, now), self.disk_statistics.is_low_on_space(writer)),
+                     (pending + 1) * self.disk_statistics.expected_write_time(writer))
+            if best_score is None or score < best_score:
+                best_writer = writer
+                best_score = score
+        if best_writer is not None:
+            self.last_writer = best_writer
+        return best_writer
+
+    def redispatch_failed_frames(self):
+        for slot, writer in self.output_ring.get_failed():
+            new_writer = self.choose_writer(exclude=writer)
+            if new_writer is None:
+                logger.error("Writer %d failed to write frame %d and no other writer is available, dropping it"
+                             % (writer, self.output_ring.info[slot]['frame_id']))
+            else:
+                logger.warning("Writer %d failed to write frame %d, sending it to writer %d"
+                               % (writer, self.output_ring.info[slot]['frame_id'], new_writer))
+            self.output_ring.redispatch(slot, writer, new_writer)
+
+    def get_output_slot(self):
+        while not self.input_ring.exit_requested:
+            self.redispatch_failed_frames()
+            free_slots = self.output_ring.get_free_slots()
+            if free_slots:
+                return free_slots[0]
+            self.status.value = "waiting for output"
+            time.sleep(self.poll_interval)
+        return None
+
+    def run(self):
+        if self.tuning is not None:
+            self.tuning.apply()
+        original_nthreads = blosc.set_nthreads(self.num_threads)
+        logger.debug("Set blosc to use %d threads, originally was using %d" % (self.num_threads, original_nthreads))
+        hot_pixels = hot_pixels_for_geometry(self.hot_pixels, self.geometry)
+        if not self.geometry.is_full_frame:
+            logger.info("%d of %d hot pixels fall within frames with geometry %r"
+                        % (len(hot_pixels), len(self.hot_pixels), self.geometry))
+        hot_pixel_masker = HotPixelMasker(hot_pixels, image_shape=self.geometry.image_shape)
+        while not self.input_ring.exit_requested:
+            self.redispatch_failed_frames()
+            process_me = self.input_ring.get_next_filled(self.consumer_index)
+            if process_me is None:
+                self.status.value = "waiting"
+                time.sleep(self.poll_interval)
+                continue
+            writer = self.choose_writer()
+            if writer is None:
+                # Nothing is being written to disk, so there is no need to compress this frame.
+                self.status.value = "no writers"
+                self.input_ring.release(process_me, self.consumer_index)
+                continue
+            output_slot = self.get_output_slot()
+            if output_slot is None:
+                break
+            self.input_ring.stamp(process_me, 'compress_start')
+            self.status.value = "processing %d" % process_me
+            payload = self.input_ring.get_slot_buffer(process_me)[:self.geometry.payload_size]
+            frame_info = self.input_ring.get_slot_info(process_me)[0]
+            chunk_data = payload[-chunk_num_bytes:].view(chunk_dtype)[0]
+            image = payload[:self.geometry.image_num_bytes].view('uint16')
+
+            info = self.output_ring.get_slot_info(output_slot)
+            for key in ['frame_id', 'timestamp', 'frame_status']:
+                info[0][key] = frame_info[key]
+            info[0]['chunk'] = chunk_data
+
+            self.status.value = "computing statistics"
+            statistics = compute_frame_statistics(image.reshape(self.geometry.image_shape), percentiles_to_compute,
+                                                  row_step=self.statistics_row_step)
+            for key in ['percentiles', 'mean', 'saturated_pixels', 'coarse_histogram']:
+                info[0][key] = statistics[key]
+            if self.latest_frame_table is not None:
+                post_statistics(self.latest_frame_table, self.consumer_index, frame_info['frame_id'], statistics)
+
+            preview = ''
+            if self.preview_factors:
+                self.status.value = "making preview"
+                levels = make_preview_pyramid(image.reshape(self.geometry.image_shape), self.preview_factors,
+                                              hot_pixel_masker=hot_pixel_masker)
+                preview = compress_preview_pyramid(levels, self.preview_factors, self.geometry)
+
+            self.status.value = "compressing %d" % process_me
+            compressed = compress_image_blosc(payload, geometry=self.geometry, **self.compression_parameters)
+            self.output_ring.stamps[output_slot] = self.input_ring.stamps[process_me]
+            self.input_ring.release(process_me, self.consumer_index)
+
+            self.output_ring.mark_filling(output_slot)
+            output_buffer = self.output_ring.get_slot_buffer(output_slot)
+            output_buffer[:len(compressed)] = np.frombuffer(compressed, dtype=np.uint8)
+            output_buffer[len(compressed):len(compressed) + len(preview)] = np.frombuffer(preview, dtype=np.uint8)
+            info[0]['compressed_size'] = len(compressed)
+            info[0]['preview_size'] = len(preview)
+            self.output_ring.stamp(output_slot, 'compressed')
+            self.output_ring.publish(output_slot, consumers=[writer])
+        self.status.value = "exiting"
+        logger.info("Exiting normally")
+        return None
@@ -1,29 +1,40 @@
 import logging
 import os
 import select
+import shutil
 import signal
 import subprocess
 import tempfile
+import threading
 import time
 from functools import wraps
 
-import numpy as np
 import Pyro4
 import Pyro4.errors
-from traitlets import (Float, Bool, Dict)
+from traitlets import (Float, Bool, Int, Unicode)
 
 from pmc_turbo.camera.star_finding.blobs import BlobFinder
-from pmc_turbo.camera.image_processing.blosc_file import load_blosc_image
+from pmc_turbo.camera.image_processing.blosc_file import (get_geometry, load_blosc_header, load_blosc_image,
+                                                          load_blosc_region)
 from pmc_turbo.camera.image_processing.jpeg import simple_jpeg
-from pmc_turbo.camera.image_processing.hot_pixels import HotPixelMasker
+from pmc_turbo.camera.image_processing.preview_pyramid import choose_preview_factor, load_preview_pyramid
+from pmc_turbo.camera.image_processing.hot_pixels import HotPixelMasker, load_hot_pixels
+from pmc_turbo.camera.pipeline.downlink_queue import (DownlinkQueue, PRIORITY_URGENT, PRIORITY_REQUESTED,
+                                                      PRIORITY_STANDARD)
+from pmc_turbo.camera.pipeline.frame_cache import FrameCache
 from pmc_turbo.camera.pipeline.indexer import MergedIndex
-from pmc_turbo.camera.pipeline.write_images import index_keys
+from pmc_turbo.camera.pipeline.render_pool import RenderPool
+from pmc_turbo.camera.pipeline.write_images import index_keys, statistics_keys
 from pmc_turbo.camera.pipeline import exposure_manager
+from pmc_turbo.camera.pipeline.basic_pipeline import read_status_table
+from pmc_turbo.camera.pipeline.stages import LatestFrameReader
+from pmc_turbo.camera.pipeline.status_table import StatusTableReader
 from pmc_turbo.camera.pycamera.dtypes import image_dimensions
+from pmc_turbo.camera.pycamera.geometry import geometry_keys
 from pmc_turbo.communication import file_format_classes
 from pmc_turbo.communication.file_format_classes import DEFAULT_REQUEST_ID
 from pmc_turbo.utils.camera_id import get_camera_id
-from pmc_turbo.utils.configuration import GlobalConfiguration, camera_data_dir
+from pmc_turbo.utils.configuration import GlobalConfiguration
 from pmc_turbo.utils.error_counter import CounterCollection
 from pmc_turbo.utils.housekeeping_logger import HousekeepingLogger
 
@@ -55,8 +66,33 @@ class Controller(GlobalConfiguration):
     gate_time_error_threshold = Float(2e-3, min=0).tag(config=True)
     main_loop_interval = Float(3.0, min=0).tag(config=True)
     auto_exposure_enabled = Bool(default_value=True).tag(config=True)
-    hot_pixel_file_dictionary = Dict().tag(config=True)
     minimum_update_interval = Float(10.0, min=0).tag(config=True)
+    frame_cache_max_bytes = Int(128 * 2 ** 20, min=0, help="Memory budget in bytes for recently decoded frames, "
+                                                           "0 disables the cache").tag(config=True)
+    frame_cache_hot_pixels_masked = Bool(True, help="Cache frames with hot pixels already masked, so repeated "
+                                                    "requests skip masking too").tag(config=True)
+    render_workers = Int(2, min=0, help="Threads rendering requested images in the background. With 0, images are "
+                                        "rendered within the request call").tag(config=True)
+    max_queued_render_jobs = Int(32, min=1, help="Image requests beyond this many waiting to be rendered are "
+                                                 "rejected").tag(config=True)
+    region_load_max_fraction = Float(0.5, min=0, max=1, help="Requests for at most this fraction of the rows of a "
+                                                             "frame written in row bands decompress only the bands "
+                                                             "they overlap, unless the frame is "
+                                                             "cached").tag(config=True)
+    standard_image_poll_interval = Float(0.5, min=0, help="Seconds between checks for a new frame to render the "
+                                                          "standard image from in the background. With 0, the "
+                                                          "standard image is rendered when the downlink asks for "
+                                                          "it").tag(config=True)
+    resend_standard_images = Bool(False, help="When the downlink queue is empty and the standard image of the latest "
+                                              "frame has already been sent, send it again instead of "
+                                              "nothing").tag(config=True)
+    downlink_queue_max_bytes = Int(64 * 2 ** 20, min=0, help="Memory budget in bytes for files waiting to be "
+                                                             "downlinked. Requested and standard images beyond it "
+                                                             "are spilled to disk").tag(config=True)
+    downlink_spill_dir = Unicode(u'', help="Directory for downlink files spilled to disk, a new temporary "
+                                           "directory if empty").tag(config=True)
+    downlink_spill_max_bytes = Int(2 ** 30, min=0, help="Budget in bytes for downlink files spilled to disk. Files "
+                                                        "beyond both budgets are dropped").tag(config=True)
 
     def __init__(self, **kwargs):
         super(Controller, self).__init__(**kwargs)
@@ -67,10 +103,17 @@ class Controller(GlobalConfiguration):
             self.pipeline = Pyro4.Proxy("PYRO:pipeline@0.0.0.0:%d" % int(self.pipeline_pyro_port))
         self.latest_image_subdir = ''
         self.merged_index = None
-        self.downlink_queue = []
+        self.latest_frame_reader = LatestFrameReader(self.latest_frame_filename)
+        self.status_table_reader = StatusTableReader(self.status_table_filename)
+        spill_dir = self.downlink_spill_dir or tempfile.mkdtemp(prefix='downlink_spill_')
+        self.downlink_queue = DownlinkQueue(max_memory_bytes=self.downlink_queue_max_bytes, spill_dir=spill_dir,
+                                            max_spill_bytes=self.downlink_spill_max_bytes)
         self.outstanding_command_tags = {}
         self.completed_command_tags = {}
         self.last_update_time = 0
+        self.frame_cache = FrameCache(self.frame_cache_max_bytes)
+        self.render_pool = RenderPool(self.add_file_to_downlink_queue, num_workers=self.render_workers,
+                                      max_queued_jobs=self.max_queued_render_jobs)
 
         self.exposure_manager = exposure_manager.ExposureManager(parent=self)
         self.exposure_manager_logger = HousekeepingLogger(columns=self.exposure_manager.columns,
@@ -100,7 +143,28 @@ class Controller(GlobalConfiguration):
         self.camera_id = get_camera_id()
         self.setup_hot_pixel_masker()
         self.update_current_image_dirs()
+        # (frame key, buffer) of the latest standard image, see update_standard_image
+        self.standard_image = None
+        self.standard_image_sent = False
+        self.standard_image_parameters_version = 0
+        self.standard_image_lock = threading.Lock()
+        self.standard_image_render_lock = threading.Lock()
         self.set_standard_image_parameters()
+        self.exit_event = threading.Event()
+        self.standard_image_thread = None
+        if self.standard_image_poll_interval:
+            self.standard_image_thread = threading.Thread(target=self.run_standard_image_renderer)
+            self.standard_image_thread.daemon = True
+            self.standard_image_thread.start()
+
+    def close(self):
+        self.exit_event.set()
+        if self.standard_image_thread is not None:
+            self.standard_image_thread.join()
+        self.render_pool.close()
+        self.downlink_queue.clear()
+        if not self.downlink_spill_dir:
+            shutil.rmtree(self.downlink_queue.spill_dir, ignore_errors=True)
 
     def setup_pyro_daemon(self):
         self.daemon = Pyro4.Daemon(host='0.0.0.0', port=self.controller_pyro_port)
@@ -108,13 +172,7 @@ class Controller(GlobalConfiguration):
         print uri
 
     def setup_hot_pixel_masker(self):
-        try:
-            self.hot_pixel_filename = os.path.join(camera_data_dir, 'hot_pixels',
-                                                   self.hot_pixel_file_dictionary[self.camera_id])
-            hot_pixels = np.load(self.hot_pixel_filename)
-        except Exception:
-            logger.exception("Failed to load hot pixel file from %s, dictionary of known files %r, proceeding without" % (camera_data_dir, self.hot_pixel_file_dictionary))
-            hot_pixels = []
+        hot_pixels = load_hot_pixels(self.hot_pixel_file_dictionary, self.camera_id)
         self.hot_pixel_masker = HotPixelMasker(hot_pixels=hot_pixels, image_shape=image_dimensions)
 
     def main_loop(self):
@@ -172,9 +230,43 @@ class Controller(GlobalConfiguration):
             self.outstanding_command_tags[tag] = request_params
         self.counters.run_focus_sweep.increment()
 
+    def get_status(self):
+        return {'frame cache': self.frame_cache.get_status(),
+                'render pool': self.render_pool.get_status(),
+                'downlink queue': self.downlink_queue.get_status()}
+
+    def get_render_job_status(self, job_id):
+        """
+        Return a dict with the state ('queued', 'running', 'done' or 'failed') and number of files rendered of the job
+        returned by one of the request methods
+        """
+        return self.render_pool.get_job_status(job_id)
+
+    def get_pipeline_process_status(self):
+        """
+        Get the process and camera status of the pipeline straight from its shared status table, without Pyro
+
+        Returns
+        -------
+        dict as from read_status_table, or None if the table can't be read
+        """
+        try:
+            return read_status_table(self.status_table_reader.get_table())
+        except (IOError, OSError, ValueError, RuntimeError):
+            logger.debug("Pipeline status not available from %s" % self.status_table_filename)
+            return None
+
+    @require_pipeline
+    def get_pipeline_extra_status(self):
+        return self.pipeline.get_extra_status()
+
     @require_pipeline
     def get_pipeline_status(self):
-        return self.pipeline.get_status()
+        status = self.get_pipeline_process_status()
+        if status is None:
+            return self.pipeline.get_status()
+        status.update(self.pipeline.get_extra_status())
+        return status
 
     @require_pipeline
     def check_for_completed_commands(self):
@@ -207,12 +299,19 @@ class Controller(GlobalConfiguration):
                     logger.warning("Command tag %f - %s:%s complete, but image timestamp %f does not match "
                                    "gate_timestamp %f to within specified threshold %f. Is something wrong with PTP?"
                                    % (tag, name, value, gate_time, timestamp, self.gate_time_error_threshold))
-                request_params = self.outstanding_command_tags.pop(tag)
-                _ = self.completed_command_tags.pop(tag)
+                request_params = self.outstanding_command_tags[tag]
+                try:
+                    self.request_image_by_index(index, **request_params)
+                except RuntimeError as e:
+                    # The tag stays outstanding so the image is requested again on the next pass
+                    logger.warning("Command tag %f - %s:%s complete, but its image could not be requested yet: %s"
+                                   % (tag, name, value, e))
+                    continue
+                del self.outstanding_command_tags[tag]
+                del self.completed_command_tags[tag]
                 logger.info("Command tag %f - %s:%s retired" % (tag, name, value))
                 logger.debug("Command %s:%s with request_params %r retired by image %r" % (name, value,
                                                                                            request_params, dict(row)))
-                self.request_image_by_index(index, **request_params)
         else:
             logger.debug("Forcing update of index because no commands have been executed recently")
             self.update_current_image_dirs()
@@ -226,7 +325,11 @@ class Controller(GlobalConfiguration):
 
     def auto_exposure(self):
         try:
-            new_exposure = self.exposure_manager.check_exposure(self.get_pipeline_status(), self.get_latest_fileinfo())
+            # Only the camera parameters are needed, which the status table has without going through Pyro
+            pipeline_status = self.get_pipeline_process_status()
+            if pipeline_status is None:
+                return
+            new_exposure = self.exposure_manager.check_exposure(pipeline_status, self.get_latest_fileinfo())
             if new_exposure is not None:
                 self.set_exposure(int(new_exposure))
         except Exception:
@@ -274,6 +377,37 @@ class Controller(GlobalConfiguration):
         else:
             raise RuntimeError("No candidates for latest file!")
 
+    def get_latest_frame(self):
+        """
+        Get the most recent frame straight from the pipeline's latest frame tap, without reading it from disk
+
+        Returns
+        -------
+        image, index record, or None if the tap is not running or has not seen a frame yet
+        """
+        try:
+            return self.latest_frame_reader.read()
+        except (IOError, OSError, ValueError, RuntimeError):
+            logger.debug("Latest frame not available from %s" % self.latest_frame_filename)
+            return None
+
+    def get_latest_preview(self, scale_by):
+        """
+        Get the preview level of the most recent frame best suited to *scale_by* from the latest frame tap
+
+        Returns
+        -------
+        factor, hot pixel masked image binned by factor, index record, or None if the tap is not running, has not
+        seen a frame yet or keeps no suitable preview
+        """
+        if scale_by >= 1:
+            return None
+        try:
+            return self.latest_frame_reader.read_preview(scale_by)
+        except (IOError, OSError, ValueError, RuntimeError):
+            logger.debug("Latest preview not available from %s" % self.latest_frame_filename)
+            return None
+
     def get_latest_standard_image(self):
         params = self.standard_image_parameters.copy()
         file_obj = self.get_latest_jpeg(**params)
@@ -281,6 +415,20 @@ class Controller(GlobalConfiguration):
 
     def get_latest_jpeg(self, request_id, row_offset=0, column_offset=0, num_rows=3232, num_columns=4864,
                         scale_by=1 / 8., **kwargs):
+        # Downsampled images are made from the binned copy kept by the tap, which avoids copying and hot pixel masking
+        # the full frame
+        latest_preview = self.get_latest_preview(scale_by)
+        if latest_preview is not None:
+            factor, image, record = latest_preview
+            return self.get_image_from_preview(factor, image, record, request_id=request_id, row_offset=row_offset,
+                                               column_offset=column_offset, num_rows=num_rows,
+                                               num_columns=num_columns, scale_by=scale_by, **kwargs)
+        latest_frame = self.get_latest_frame()
+        if latest_frame is not None:
+            image, record = latest_frame
+            return self.get_image_from_array(image, record, request_id=request_id, row_offset=row_offset,
+                                             column_offset=column_offset, num_rows=num_rows, num_columns=num_columns,
+                                             scale_by=scale_by, **kwargs)
         info = self.get_latest_fileinfo()
         return self.get_image_by_info(info, request_id=request_id, row_offset=row_offset, column_offset=column_offset,
                                       num_rows=num_rows, num_columns=num_columns, scale_by=scale_by,
@@ -293,6 +441,61 @@ class Controller(GlobalConfiguration):
                                               scale_by=scale_by,
                                               quality=quality,
                                               format=format, request_id=DEFAULT_REQUEST_ID)
+        self.standard_image_parameters_version += 1
+
+    def get_latest_frame_key(self):
+        """
+        Return a value identifying the frame and parameters the latest standard image would be made from, which
+        changes whenever either does
+        """
+        try:
+            sequence = self.latest_frame_reader.get_sequence()
+        except (IOError, OSError, ValueError):
+            sequence = 0
+        if sequence:
+            return self.standard_image_parameters_version, self.latest_frame_reader.inode, sequence
+        return self.standard_image_parameters_version, self.get_latest_fileinfo()['frame_timestamp_ns']
+
+    def update_standard_image(self):
+        """
+        Render the latest standard image, unless it has already been rendered for the latest frame
+
+        Returns
+        -------
+        bool : True if a new standard image was rendered
+        """
+        with self.standard_image_render_lock:
+            # Taking the key first means a frame arriving during rendering causes another render on the next update
+            key = self.get_latest_frame_key()
+            if self.standard_image is not None and self.standard_image[0] == key:
+                return False
+            buffer = self.get_latest_standard_image().to_buffer()
+            with self.standard_image_lock:
+                self.standard_image = (key, buffer)
+                self.standard_image_sent = False
+            return True
+
+    def run_standard_image_renderer(self):
+        while not self.exit_event.wait(self.standard_image_poll_interval):
+            try:
+                self.update_standard_image()
+            except RuntimeError as e:
+                logger.debug("Could not render standard image: %s" % e)
+            except Exception:
+                logger.exception("Failed to render standard image")
+
+    def get_standard_image_for_downlink(self):
+        """
+        Return the latest standard image, or None if it has already been sent and resend_standard_images is not set
+        """
+        if self.standard_image is None or not self.standard_image_poll_interval:
+            self.update_standard_image()
+        with self.standard_image_lock:
+            if self.standard_image_sent and not self.resend_standard_images:
+                logger.debug("Standard image of the latest frame has already been sent")
+                return None
+            self.standard_image_sent = True
+            return self.standard_image[1]
 
     def request_image_by_index(self, index, **kwargs):
         """
@@ -305,20 +508,40 @@ class Controller(GlobalConfiguration):
         ---------------
         request_id
 
+        Returns
+        -------
+        job_id of the render job, see get_render_job_status
         """
         self.merged_index.update()
         index_row_data = dict(self.merged_index.df.iloc[index])
-        self.downlink_queue.append(self.get_image_by_info(index_row_data, **kwargs).to_buffer())
+
+        def render():
+            yield self.get_image_by_info(index_row_data, **kwargs).to_buffer()
+
+        request_id = kwargs.get('request_id')
+        return self.render_pool.submit('image at index %d for request %r' % (index, request_id), render,
+                                       request_id=request_id,
+                                       output_kwargs=dict(priority=PRIORITY_REQUESTED, request_id=request_id))
 
     def request_specific_images(self, timestamp, request_id, num_images=1, row_offset=0, column_offset=0,
-                                num_rows=3232, num_columns=4864, scale_by=1 / 8., quality=75, format='jpeg', step=-1):
+                                num_rows=3232, num_columns=4864, scale_by=1 / 8., quality=75, format='jpeg', step=-1,
+                                priority=PRIORITY_REQUESTED):
+        """
+        Queue rendering of *num_images* images near *timestamp*, returning the job_id of the render job
+
+        The images are downlinked in the *priority* class of the downlink queue.
+        """
         selection = self.timestamp_selection(num_images, step, timestamp)
-        for _, index_row in selection.iterrows():
-            self.downlink_queue.append(self.get_image_by_info(index_row, row_offset=row_offset,
-                                                              column_offset=column_offset,
-                                                              num_rows=num_rows, num_columns=num_columns,
-                                                              scale_by=scale_by, quality=quality, format=format,
-                                                              request_id=request_id).to_buffer())
+
+        def render():
+            for _, index_row in selection.iterrows():
+                yield self.get_image_by_info(index_row, row_offset=row_offset, column_offset=column_offset,
+                                             num_rows=num_rows, num_columns=num_columns, scale_by=scale_by,
+                                             quality=quality, format=format, request_id=request_id).to_buffer()
+
+        return self.render_pool.submit('%d images at %f for request %r' % (selection.shape[0], timestamp, request_id),
+                                       render, request_id=request_id,
+                                       output_kwargs=dict(priority=priority, request_id=request_id))
 
     def timestamp_selection(self, num_images, step, timestamp):
         last_index = self.merged_index.get_index_of_timestamp(timestamp)
@@ -337,20 +560,26 @@ class Controller(GlobalConfiguration):
                                    blob_threshold, kernel_sigma, kernel_size, cell_size, max_num_blobs,
                                    quality=75, format='jpeg'):
         selection = self.timestamp_selection(num_images, step, timestamp)
-        for _, index_row in selection.iterrows():
-            blob_images = self.get_blobs_by_info(index_row=index_row, request_id=request_id, stamp_size=stamp_size,
-                                                 blob_threshold=blob_threshold, kernel_sigma=kernel_sigma,
-                                                 kernel_size=kernel_size, cell_size=cell_size,
-                                                 max_num_blobs=max_num_blobs, quality=quality, format=format)
-            for blob_image in blob_images:
-                self.downlink_queue.append(blob_image.to_buffer())
+
+        def render():
+            for _, index_row in selection.iterrows():
+                blob_images = self.get_blobs_by_info(index_row=index_row, request_id=request_id, stamp_size=stamp_size,
+                                                     blob_threshold=blob_threshold, kernel_sigma=kernel_sigma,
+                                                     kernel_size=kernel_size, cell_size=cell_size,
+                                                     max_num_blobs=max_num_blobs, quality=quality, format=format)
+                for blob_image in blob_images:
+                    yield blob_image.to_buffer()
+
+        return self.render_pool.submit('blobs in %d images at %f for request %r' % (selection.shape[0], timestamp,
+                                                                                      request_id), render,
+                                       request_id=request_id,
+                                       output_kwargs=dict(priority=PRIORITY_REQUESTED, request_id=request_id))
 
     def get_blobs_by_info(self, index_row, request_id, stamp_size,
                           blob_threshold, kernel_sigma, kernel_size, cell_size, max_num_blobs,
                           quality=75, format='jpeg'):
-        image, chunk = load_blosc_image(index_row['filename'])
+        image, chunk = self.load_frame(index_row['filename'])
         tic = time.time()
-        image = self.hot_pixel_masker.process(image)
         blob_finder = BlobFinder(image, blob_threshold=blob_threshold, kernel_size=kernel_size,
                                  kernel_sigma=kernel_sigma,
                                  cell_size=cell_size, fit_blobs=False)
@@ -373,12 +602,123 @@ class Controller(GlobalConfiguration):
 
     def request_standard_image_at(self, timestamp):
         # use step=1 to ensure that we get the image closest to timestamp. Otherwise we'd get the image immediately before
-        self.request_specific_images(timestamp, step=1, **self.standard_image_parameters)
+        return self.request_specific_images(timestamp, step=1, priority=PRIORITY_STANDARD,
+                                            **self.standard_image_parameters)
 
     def get_image_by_info(self, index_row_data, request_id, row_offset=0, column_offset=0, num_rows=3232,
                           num_columns=4864, scale_by=1 / 8., quality=75, format='jpeg'):
-        image, chunk = load_blosc_image(index_row_data['filename'])
-        image = self.hot_pixel_masker.process(image)
+        # Downsampled images are made from the preview written with the frame when possible, which avoids
+        # decompressing the full frame
+        preview = self.load_preview(index_row_data['filename'], scale_by)
+        if preview is not None:
+            factor, image = preview
+            return self.get_image_from_preview(factor, image, index_row_data=index_row_data, request_id=request_id,
+                                               row_offset=row_offset, column_offset=column_offset, num_rows=num_rows,
+                                               num_columns=num_columns, scale_by=scale_by, quality=quality,
+                                               format=format)
+        if (index_row_data['filename'] not in self.frame_cache
+                and num_rows + 1 <= self.region_load_max_fraction * index_row_data.get('height', image_dimensions[0])):
+            image = self.load_frame_region(index_row_data['filename'], row_offset=row_offset,
+                                           column_offset=column_offset, num_rows=num_rows, num_columns=num_columns)
+            if image is not None:
+                return self.make_image_file(image, index_row_data=index_row_data, request_id=request_id,
+                                            row_offset=row_offset, column_offset=column_offset, num_rows=num_rows,
+                                            num_columns=num_columns, scale_by=scale_by, quality=quality,
+                                            format=format)
+        image, chunk = self.load_frame(index_row_data['filename'], hot_pixels_masked=False)
+        return self.get_image_from_array(image, index_row_data=index_row_data, request_id=request_id,
+                                         row_offset=row_offset, column_offset=column_offset, num_rows=num_rows,
+                                         num_columns=num_columns, scale_by=scale_by, quality=quality, format=format,
+                                         hot_pixels_masked=self.frame_cache_hot_pixels_masked)
+
+    def load_frame_region(self, filename, row_offset, column_offset, num_rows, num_columns):
+        """
+        Load and hot pixel mask the region of a frame get_image_from_array would use, decompressing only the row bands
+        it overlaps
+
+        Returns
+        -------
+        uint16 array, or None if the frame was not written in row bands
+        """
+        header = load_blosc_header(filename)
+        if 'band_rows' not in header:
+            return None
+        # Load enough surrounding pixels to mask hot pixels at the edges of the region
+        margin = self.hot_pixel_masker.max_range
+        first_row = max(row_offset - margin, 0)
+        first_column = max(column_offset - margin, 0)
+        # get_image_from_array includes an extra row and column
+        region, chunk = load_blosc_region(filename, slice(first_row, row_offset + num_rows + 1 + margin),
+                                          slice(first_column, column_offset + num_columns + 1 + margin))
+        if get_geometry(header).image_shape == tuple(self.hot_pixel_masker.image_shape):
+            region = self.hot_pixel_masker.process_region(region, first_row, first_column)
+        return region[row_offset - first_row:row_offset - first_row + num_rows + 1,
+                      column_offset - first_column:column_offset - first_column + num_columns + 1]
+
+    def load_frame(self, filename, hot_pixels_masked=True):
+        """
+        Load the frame in *filename*, from the frame cache if it was used recently
+
+        Parameters
+        ----------
+        filename : str
+            Frame filename or segment reference
+        hot_pixels_masked : bool
+            If True, the image returned always has its hot pixels masked. If False, it is masked only if
+            frame_cache_hot_pixels_masked is set.
+
+        Returns
+        -------
+        image, chunk
+        """
+        frame = self.frame_cache.get(filename)
+        if frame is None:
+            image, chunk = load_blosc_image(filename)
+            if self.frame_cache_hot_pixels_masked:
+                image = self.hot_pixel_masker.process(image)
+            self.frame_cache.put(filename, image, chunk)
+        else:
+            image, chunk = frame
+        if hot_pixels_masked and not self.frame_cache_hot_pixels_masked:
+            image = self.hot_pixel_masker.process(image)
+        return image, chunk
+
+    def load_preview(self, filename, scale_by):
+        """
+        Load the preview of the frame in *filename* best suited to making an image scaled by *scale_by*
+
+        Returns
+        -------
+        factor, uint16 array binned by factor, or None if the frame has no suitable preview
+        """
+        if scale_by >= 1:
+            return None
+        try:
+            levels, _ = load_preview_pyramid(filename)
+        except (IOError, ValueError, KeyError):
+            logger.debug("No preview available for %s" % filename)
+            return None
+        factor = choose_preview_factor(sorted(levels.keys()), scale_by)
+        if factor is None:
+            return None
+        return factor, levels[factor]
+
+    def get_image_from_preview(self, factor, image, index_row_data, request_id, row_offset=0, column_offset=0,
+                               num_rows=3232, num_columns=4864, scale_by=1 / 8., quality=75, format='jpeg'):
+        """
+        Make an image from *image*, the whole frame binned by *factor*
+        """
+        image = image[row_offset // factor:(row_offset + num_rows + factor - 1) // factor,
+                      column_offset // factor:(column_offset + num_columns + factor - 1) // factor]
+        return self.make_image_file(image, index_row_data=index_row_data, request_id=request_id,
+                                    row_offset=row_offset, column_offset=column_offset, num_rows=num_rows,
+                                    num_columns=num_columns, scale_by=scale_by, quality=quality, format=format,
+                                    image_binning=factor)
+
+    def get_image_from_array(self, image, index_row_data, request_id, row_offset=0, column_offset=0, num_rows=3232,
+                             num_columns=4864, scale_by=1 / 8., quality=75, format='jpeg', hot_pixels_masked=False):
+        if not hot_pixels_masked:
+            image = self.hot_pixel_masker.process(image)
         image = image[row_offset:row_offset + num_rows + 1, column_offset:column_offset + num_columns + 1]
         return self.make_image_file(image, index_row_data=index_row_data, request_id=request_id, row_offset=row_offset,
                                     column_offset=column_offset, num_rows=num_rows, num_columns=num_columns,
@@ -386,10 +726,14 @@ class Controller(GlobalConfiguration):
                                     quality=quality, format=format)
 
     def make_image_file(self, image, index_row_data, request_id, row_offset, column_offset, num_rows, num_columns,
-                        scale_by, quality, format):
+                        scale_by, quality, format, image_binning=1):
+        """
+        *image* is the requested region of the frame, binned by *image_binning* if it comes from a preview.
+        *scale_by* is relative to the full resolution frame.
+        """
         params = dict()
         for key in index_keys:
-            if key == 'filename':
+            if key == 'filename' or key in statistics_keys or key in geometry_keys:
                 continue
             params[key] = index_row_data[key]
         params['camera_id'] = self.camera_id
@@ -401,7 +745,7 @@ class Controller(GlobalConfiguration):
         params['scale_by'] = scale_by
         params['quality'] = quality
         if format == 'jpeg':
-            payload, offset, scale = simple_jpeg(image, scale_by=scale_by, quality=quality)
+            payload, offset, scale = simple_jpeg(image, scale_by=scale_by * image_binning, quality=quality)
             params['pixel_scale'] = scale
             params['pixel_offset'] = offset
             file_obj = file_format_classes.JPEGFile(payload=payload, **params)
@@ -424,7 +768,7 @@ class Controller(GlobalConfiguration):
                                                       request_id=request_id,
                                                       filename=filename,
                                                       camera_id=self.camera_id)
-        self.downlink_queue.append(file_object.to_buffer())
+        self.add_file_to_downlink_queue(file_object.to_buffer(), priority=PRIORITY_REQUESTED, request_id=request_id)
 
     def run_shell_command(self, command_line, max_num_bytes_returned, request_id, timeout):
         timestamp = time.time()
@@ -457,7 +801,7 @@ class Controller(GlobalConfiguration):
                                                                    timed_out=0,
                                                                    request_id=request_id,
                                                                    camera_id=self.camera_id)
-                self.downlink_queue.append(file_object.to_buffer())
+                self.add_file_to_downlink_queue(file_object.to_buffer(), request_id=request_id)
                 return
             time.sleep(0.1)
 
@@ -485,27 +829,70 @@ class Controller(GlobalConfiguration):
                                                            timed_out=1,
                                                            request_id=request_id,
                                                            camera_id=self.camera_id)
-        self.downlink_queue.append(file_object.to_buffer())
+        self.add_file_to_downlink_queue(file_object.to_buffer(), request_id=request_id)
 
     def get_next_data_for_downlink(self):
-        if self.downlink_queue:
-            result = self.downlink_queue[0]
-            self.downlink_queue = self.downlink_queue[1:]
+        result = self.downlink_queue.pop()
+        if result is not None:
             logger.debug("Sending item with length %d from queue. %d items remain in the queue" % (
                 len(result), len(self.downlink_queue)))
         else:
             logger.debug("Sending latest standard image")
-            result = self.get_latest_standard_image().to_buffer()
+            result = self.get_standard_image_for_downlink()
         return result
 
-    def add_file_to_downlink_queue(self, file_buffer):
+    def add_file_to_downlink_queue(self, file_buffer, priority=PRIORITY_URGENT, request_id=DEFAULT_REQUEST_ID):
+        """
+        Queue a file for downlink
+
+        Parameters
+        ----------
+        file_buffer : str
+        priority : int
+            Class of the downlink queue, see downlink_queue. Status reports and other replies to commands are urgent.
+        request_id : int
+            Request the file answers, used to share the class fairly between requests and by cancel_request
+        """
         logger.debug('File_buffer added to downlink queue: first 20 bytes are %r' % file_buffer[:20])
-        self.downlink_queue.append(file_buffer)
+        self.downlink_queue.put(file_buffer, priority=priority, request_id=request_id)
 
     def flush_downlink_queue(self):
-        num_items = len(self.downlink_queue)
-        self.downlink_queue = []
+        num_items = self.downlink_queue.clear()
         logger.info("Flushed %d files from downlink queue" % num_items)
 
+    def cancel_request(self, request_id):
+        """
+        Stop rendering and drop the queued files of request *request_id*
+
+        Returns
+        -------
+        int : number of queued files dropped
+        """
+        # Cancel the jobs first so they don't queue more files once the queue is cleared of the request
+        num_jobs = self.render_pool.cancel(request_id)
+        num_items = self.downlink_queue.cancel(request_id)
+        logger.info("Cancelled request %r: %d render jobs, %d queued files" % (request_id, num_jobs, num_items))
+        return num_items
+
+    def prioritize_request(self, request_id, priority=PRIORITY_URGENT):
+        """
+        Move the queued files of request *request_id*, and files of the request still to be rendered, to class
+        *priority* of the downlink queue
+
+        Returns
+        -------
+        int : number of queued files moved
+        """
+        num_items = self.downlink_queue.set_request_priority(request_id, priority)
+        logger.info("Moved request %r to downlink priority %d with %d queued files" % (request_id, priority,
+                                                                                       num_items))
+        return num_items
+
     def get_downlink_queue_depth(self):
         return len(self.downlink_queue)
+
+    def get_downlink_queue_depths(self):
+        """
+        Return a dict with the number of files queued in each priority class, keyed by class name
+        """
+        return dict(self.downlink_queue.get_depths())
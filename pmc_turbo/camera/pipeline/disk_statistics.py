@@ -0,0 +1,123 @@
+"""
+Shared table of per disk write performance, used to schedule frames across the writer processes.
+
+Each writer measures how long its writes take and records an exponentially weighted moving average (EWMA) of the write
+time and bandwidth, along with the free space on its disk. Each row of the table is only written by its own writer, so
+no locking is needed. The compression processes read the table to decide which writer should get each frame.
+
+A disk is marked degraded when a write fails or its average write time exceeds max_write_time. A degraded disk gets
+no new frames until its back off period ends; the back off doubles with each consecutive bad write up to max_backoff.
+The first write after a back off resets the averages so a recovered disk is not penalized by its old measurements.
+"""
+import ctypes
+import logging
+import multiprocessing as mp
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+disk_statistics_dtype = np.dtype([('write_time', np.float64),  # EWMA of seconds per frame
+                                  ('write_bandwidth', np.float64),  # EWMA of bytes per second
+                                  ('bytes_free', np.int64),
+                                  ('num_writes', np.uint64),
+                                  ('num_failures', np.uint64),
+                                  ('consecutive_bad_writes', np.uint32),
+                                  ('degraded_until', np.float64)])
+
+# Disks with less free space than this are only used when no other disk is available
+LOW_DISK_SPACE_BYTES = 2 * 1024 ** 3
+
+# Write time assumed for disks that have not been measured yet, so that outstanding frames still count when scheduling
+MIN_WRITE_TIME = 1e-3
+
+
+class DiskStatistics(object):
+    def __init__(self, num_disks, smoothing=0.2, max_write_time=2.0, initial_backoff=1.0, max_backoff=60.0):
+        """
+        Allocate the shared table. This must be created before the processes that use it are started.
+
+        Parameters
+        ----------
+        num_disks : int
+        smoothing : float
+            Weight of each new measurement in the moving averages
+        max_write_time : float
+            Seconds. A disk whose average write time is longer than this is considered degraded.
+        initial_backoff : float
+            Seconds to avoid a disk after its first bad write
+        max_backoff : float
+            Longest back off in seconds
+        """
+        self.num_disks = num_disks
+        self.smoothing = smoothing
+        self.max_write_time = max_write_time
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self._raw_table = mp.RawArray(ctypes.c_uint8, max(num_disks, 1) * disk_statistics_dtype.itemsize)
+        self.table = np.frombuffer(self._raw_table, dtype=disk_statistics_dtype)
+        self.table['bytes_free'] = -1  # unknown
+
+    # Methods used by the writer that owns each disk
+
+    def record_write(self, disk, duration, num_bytes, bytes_free, now=None):
+        if now is None:
+            now = time.time()
+        row = self.table[disk:disk + 1]
+        bandwidth = num_bytes / max(duration, 1e-9)
+        if row['num_writes'][0] == 0 or row['consecutive_bad_writes'][0]:
+            row['write_time'] = duration
+            row['write_bandwidth'] = bandwidth
+        else:
+            row['write_time'] += self.smoothing * (duration - row['write_time'][0])
+            row['write_bandwidth'] += self.smoothing * (bandwidth - row['write_bandwidth'][0])
+        row['num_writes'] += 1
+        row['bytes_free'] = bytes_free
+        if row['write_time'][0] > self.max_write_time:
+            logger.warning("Disk %d is slow, average write time %.2f s" % (disk, row['write_time'][0]))
+            self._back_off(disk, now)
+        else:
+            row['consecutive_bad_writes'] = 0
+            row['degraded_until'] = 0
+
+    def record_failure(self, disk, now=None):
+        if now is None:
+            now = time.time()
+        self.table['num_failures'][disk] += 1
+        self._back_off(disk, now)
+
+    def _back_off(self, disk, now):
+        row = self.table[disk:disk + 1]
+        row['consecutive_bad_writes'] += 1
+        backoff = min(self.initial_backoff * 2 ** (row['consecutive_bad_writes'][0] - 1), self.max_backoff)
+        row['degraded_until'] = now + backoff
+        logger.warning("Backing off disk %d for %.1f s" % (disk, backoff))
+
+    # Methods used by the scheduler
+
+    def is_degraded(self, disk, now=None):
+        if now is None:
+            now = time.time()
+        return bool(self.table['degraded_until'][disk] > now)
+
+    def is_low_on_space(self, disk):
+        bytes_free = self.table['bytes_free'][disk]
+        return 0 <= bytes_free < LOW_DISK_SPACE_BYTES
+
+    def expected_write_time(self, disk):
+        return max(self.table['write_time'][disk], MIN_WRITE_TIME)
+
+    def get_status(self):
+        """
+        Summary of each disk's measurements for BasicPipeline.get_status
+        """
+        now = time.time()
+        status = {}
+        for disk in range(self.num_disks):
+            row = self.table[disk]
+            status['disk %d write time' % disk] = float(row['write_time'])
+            status['disk %d MBps' % disk] = float(row['write_bandwidth']) / 1e6
+            status['disk %d failures' % disk] = int(row['num_failures'])
+            status['disk %d degraded' % disk] = self.is_degraded(disk, now)
+        return status
@@ -0,0 +1,238 @@
+"""
+Scheduling of files waiting to be sent on the downlinks.
+
+The communicator takes one file at a time from the controller whenever a downlink has room, so the order files are
+taken in decides how long each request waits. A single first in, first out list lets a large shell command output or
+a request for hundreds of images hold up status replies for as long as they take to send. Instead, files are queued in
+priority classes:
+
+    PRIORITY_URGENT     status reports, shell command output and other replies to commands
+    PRIORITY_REQUESTED  requested images and files
+    PRIORITY_STANDARD   standard images requested by the leader
+
+Files are always taken from the highest priority class with any files waiting. Within a class, the requests (by
+request_id) take turns, one file each, so a small request is not stuck behind a large one. Queued requests can be
+cancelled or moved to another class by request_id.
+
+Files below the urgent class that would take the queue past its memory budget are written to spill files on disk and
+read back when their turn comes, and are dropped if the spill budget is also used up.
+"""
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_URGENT = 0
+PRIORITY_REQUESTED = 1
+PRIORITY_STANDARD = 2
+priority_names = OrderedDict([(PRIORITY_URGENT, 'urgent'),
+                              (PRIORITY_REQUESTED, 'requested'),
+                              (PRIORITY_STANDARD, 'standard')])
+
+
+class QueuedFile(object):
+    def __init__(self, num_bytes, buffer=None, spill_filename=None):
+        self.num_bytes = num_bytes
+        self.buffer = buffer
+        self.spill_filename = spill_filename
+
+
+class DownlinkQueue(object):
+    def __init__(self, max_memory_bytes=64 * 2 ** 20, spill_dir=None, max_spill_bytes=2 ** 30):
+        """
+        Parameters
+        ----------
+        max_memory_bytes : int
+            Budget for the total size of the files held in memory. Urgent files are always held in memory, and may
+            take the total past the budget.
+        spill_dir : str
+            Directory for spill files. With None, files over the memory budget are dropped.
+        max_spill_bytes : int
+            Budget for the total size of the spill files
+        """
+        self.max_memory_bytes = max_memory_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        # One OrderedDict per class, mapping request_id to a deque of QueuedFile, in the order requests take turns
+        self.classes = OrderedDict([(priority, OrderedDict()) for priority in priority_names])
+        # Classes set by set_request_priority, which also apply to files of the request queued later
+        self.request_priorities = {}
+        self.memory_bytes = 0
+        self.spill_bytes = 0
+        self.num_spilled = 0
+        self.num_dropped = 0
+        # Render workers, the communicator and Pyro request threads all use the queue
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return sum([len(files) for requests in self.classes.values() for files in requests.values()])
+
+    def put(self, buffer, priority=PRIORITY_REQUESTED, request_id=None):
+        """
+        Queue a file
+
+        Returns
+        -------
+        bool : False if the file was dropped because both budgets are used up
+        """
+        num_bytes = len(buffer)
+        with self.lock:
+            priority = self.request_priorities.get(request_id, priority)
+            spill = priority != PRIORITY_URGENT and self.memory_bytes + num_bytes > self.max_memory_bytes
+            if spill:
+                if self.spill_dir is None or self.spill_bytes + num_bytes > self.max_spill_bytes:
+                    self.num_dropped += 1
+                    logger.warning("Downlink queue is full, dropped %d byte file for request %r"
+                                   % (num_bytes, request_id))
+                    return False
+                # Reserve the space so the file can be written without holding the lock
+                self.spill_bytes += num_bytes
+            else:
+                self.memory_bytes += num_bytes
+                self.add_file(QueuedFile(num_bytes, buffer=buffer), priority, request_id)
+                return True
+        try:
+            spill_filename = self.write_spill_file(buffer)
+        except (IOError, OSError):
+            logger.exception("Failed to spill %d byte file for request %r" % (num_bytes, request_id))
+            with self.lock:
+                self.spill_bytes -= num_bytes
+                self.num_dropped += 1
+            return False
+        with self.lock:
+            # The request may have been moved while the file was written
+            priority = self.request_priorities.get(request_id, priority)
+            self.add_file(QueuedFile(num_bytes, spill_filename=spill_filename), priority, request_id)
+            self.num_spilled += 1
+        return True
+
+    def add_file(self, queued_file, priority, request_id):
+        requests = self.classes[priority]
+        if request_id not in requests:
+            requests[request_id] = deque()
+        requests[request_id].append(queued_file)
+
+    def write_spill_file(self, buffer):
+        fd, spill_filename = tempfile.mkstemp(suffix='.spill', prefix='downlink_', dir=self.spill_dir)
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(buffer)
+        return spill_filename
+
+    def pop(self):
+        """
+        Remove and return the next file to send, or None if the queue is empty
+        """
+        while True:
+            with self.lock:
+                queued_file = self.pop_next_file()
+            if queued_file is None:
+                return None
+            if queued_file.spill_filename is None:
+                return queued_file.buffer
+            try:
+                with open(queued_file.spill_filename, 'rb') as fh:
+                    return fh.read()
+            except IOError:
+                logger.exception("Failed to read spill file %s, skipping it" % queued_file.spill_filename)
+            finally:
+                remove_spill_file(queued_file)
+
+    def pop_next_file(self):
+        for requests in self.classes.values():
+            if not requests:
+                continue
+            request_id, files = requests.popitem(last=False)
+            queued_file = files.popleft()
+            if files:
+                # Back of the line for this request's next file
+                requests[request_id] = files
+            if queued_file.spill_filename is None:
+                self.memory_bytes -= queued_file.num_bytes
+            else:
+                self.spill_bytes -= queued_file.num_bytes
+            return queued_file
+        return None
+
+    def remove_files(self, files):
+        for queued_file in files:
+            if queued_file.spill_filename is None:
+                self.memory_bytes -= queued_file.num_bytes
+            else:
+                self.spill_bytes -= queued_file.num_bytes
+                remove_spill_file(queued_file)
+        return len(files)
+
+    def cancel(self, request_id):
+        """
+        Remove all queued files of *request_id*
+
+        Returns
+        -------
+        int : number of files removed
+        """
+        with self.lock:
+            self.request_priorities.pop(request_id, None)
+            return sum([self.remove_files(requests.pop(request_id, ())) for requests in self.classes.values()])
+
+    def set_request_priority(self, request_id, priority):
+        """
+        Move the queued files of *request_id* to class *priority*, along with any files of the request queued later
+
+        Returns
+        -------
+        int : number of queued files moved
+        """
+        if priority not in priority_names:
+            raise ValueError("Unknown downlink priority %r" % priority)
+        with self.lock:
+            self.request_priorities[request_id] = priority
+            files = deque()
+            for requests in self.classes.values():
+                files.extend(requests.pop(request_id, ()))
+            if files:
+                self.classes[priority][request_id] = files
+            return len(files)
+
+    def clear(self):
+        """
+        Remove all queued files
+
+        Returns
+        -------
+        int : number of files removed
+        """
+        with self.lock:
+            num_files = 0
+            for requests in self.classes.values():
+                for files in requests.values():
+                    num_files += self.remove_files(files)
+                requests.clear()
+            self.request_priorities.clear()
+            return num_files
+
+    def get_depths(self):
+        """
+        Return an OrderedDict with the number of files queued in each class, keyed by class name
+        """
+        with self.lock:
+            return OrderedDict([(name, sum([len(files) for files in self.classes[priority].values()]))
+                                for priority, name in priority_names.items()])
+
+    def get_status(self):
+        status = dict(self.get_depths())
+        with self.lock:
+            status.update(memory_bytes=self.memory_bytes, max_memory_bytes=self.max_memory_bytes,
+                          spill_bytes=self.spill_bytes, max_spill_bytes=self.max_spill_bytes,
+                          spilled=self.num_spilled, dropped=self.num_dropped)
+        return status
+
+
+def remove_spill_file(queued_file):
+    try:
+        os.unlink(queued_file.spill_filename)
+    except OSError:
+        logger.exception("Failed to remove spill file %s" % queued_file.spill_filename)
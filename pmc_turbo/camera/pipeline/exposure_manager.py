@@ -1,7 +1,7 @@
 import numpy as np
 from traitlets.config import Configurable
 from traitlets import Int, Float
-from pmc_turbo.camera.pipeline.write_images import percentiles_to_compute, percentile_keys
+from pmc_turbo.camera.pipeline.write_images import percentiles_to_compute, percentile_keys, histogram_keys
 import logging
 logger = logging.getLogger(__name__)
 
@@ -9,6 +9,17 @@ def get_percentiles_as_fractions(row,maximum_value=2**14-1):
     percentiles = [row[key]/float(maximum_value) for key in percentile_keys]
     return percentiles
 
+def get_saturated_fraction(row):
+    """
+    Fraction of pixels at the saturation value, or None if the index predates the histogram statistics
+    """
+    if 'saturated_pixels' not in row:
+        return None
+    num_pixels = sum([row[key] for key in histogram_keys])
+    if not num_pixels > 0:  # also catches NaN for rows merged from older indexes
+        return None
+    return row['saturated_pixels']/float(num_pixels)
+
 class ExposureManager(Configurable):
     max_percentile_threshold_fraction = Float(default_value=0.9,min=0,max=1).tag(config=True)
     min_peak_threshold_fraction = Float(default_value=0.7, min =0,max=1).tag(config=True)
@@ -17,6 +28,8 @@ class ExposureManager(Configurable):
     maximum_pixel_value = Int(default_value=2**14,min=0).tag(config=True)
     min_exposure = Int(default_value=35, min=0).tag(config=True)
     max_exposure = Int(default_value=100000,min=0).tag(config=True)
+    max_saturated_fraction = Float(default_value=0.001,min=0,max=1,
+                                   help="Reduce exposure if more than this fraction of pixels are saturated").tag(config=True)
     def __init__(self, **kwargs):
         super(ExposureManager,self).__init__(**kwargs)
         self.last_file_analyzed = None
@@ -38,12 +51,16 @@ class ExposureManager(Configurable):
         percentiles = get_percentiles_as_fractions(file_statistics,maximum_value=self.maximum_pixel_value)
         logger.debug("current exposure %d, percentiles: %s" % (current_exposure, ','.join([('%.3f' % pct) for pct in percentiles])))
         factor = 1
+        saturated_fraction = get_saturated_fraction(file_statistics)
         number_too_high = 0
         for pct in percentiles:
             if pct > self.max_percentile_threshold_fraction:
                 number_too_high += 1
         number_too_low = 0
-        if number_too_high == 0:
+        if saturated_fraction is not None and saturated_fraction > self.max_saturated_fraction:
+            factor = 1-self.adjustment_step_size_fraction
+            logger.debug("%f of pixels are saturated, adjusting by %f" % (saturated_fraction, factor))
+        elif number_too_high == 0:
             if percentiles[-1] < self.min_peak_threshold_fraction:
                 factor = self.min_peak_threshold_fraction/percentiles[-1]
                 logger.debug("maximum is less than min_peak_threshold by factor of %f" % factor)
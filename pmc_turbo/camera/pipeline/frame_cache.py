@@ -0,0 +1,85 @@
+"""
+Least recently used cache of decoded frames for the controller.
+
+Focus sweeps, repeated ROI requests for the same timestamp and blob requests all ask for images from the same few
+frames, and decompressing a 31 MB frame (and masking its hot pixels) for each request is most of the cost of serving
+them. The controller keeps recently used frames here, keyed by filename (or segment reference), and evicts the least
+recently used frames whenever the total size of the cached arrays would exceed the configured budget.
+"""
+import collections
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class FrameCache(object):
+    def __init__(self, max_num_bytes):
+        """
+        Parameters
+        ----------
+        max_num_bytes : int
+            Budget for the total size of the cached images and chunk data. Frames larger than the budget are not
+            cached, and 0 disables the cache.
+        """
+        self.max_num_bytes = max_num_bytes
+        self.frames = collections.OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # The controller serves Pyro requests from several threads
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __contains__(self, key):
+        # Does not count as a hit or miss, or change the order of eviction
+        return key in self.frames
+
+    def get(self, key):
+        """
+        Return the cached (image, chunk) for *key*, marking it most recently used, or None if it is not cached
+        """
+        with self.lock:
+            frame = self.frames.pop(key, None)
+            if frame is None:
+                self.misses += 1
+                return None
+            self.frames[key] = frame
+            self.hits += 1
+            return frame
+
+    def put(self, key, image, chunk):
+        """
+        Add a frame, evicting least recently used frames to stay within the budget
+
+        The arrays are made read only, since every later request for the frame shares them.
+        """
+        num_bytes = image.nbytes + chunk.nbytes
+        if num_bytes > self.max_num_bytes:
+            return
+        image.flags.writeable = False
+        chunk.flags.writeable = False
+        with self.lock:
+            old_frame = self.frames.pop(key, None)
+            if old_frame is not None:
+                self.num_bytes -= old_frame[0].nbytes + old_frame[1].nbytes
+            while self.frames and self.num_bytes + num_bytes > self.max_num_bytes:
+                evicted_key, (evicted_image, evicted_chunk) = self.frames.popitem(last=False)
+                self.num_bytes -= evicted_image.nbytes + evicted_chunk.nbytes
+                self.evictions += 1
+                logger.debug("Evicted %s from frame cache" % evicted_key)
+            self.frames[key] = (image, chunk)
+            self.num_bytes += num_bytes
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.num_bytes = 0
+
+    def get_status(self):
+        with self.lock:
+            return dict(frames=len(self.frames), num_bytes=self.num_bytes, max_num_bytes=self.max_num_bytes,
+                        hits=self.hits, misses=self.misses, evictions=self.evictions)
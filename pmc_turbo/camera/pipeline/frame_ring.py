@@ -0,0 +1,261 @@
+"""
+Shared memory ring of frame slots used to hand frames between pipeline processes without queues or locks.
+
+All frame data lives in one contiguous shared memory block divided into fixed size slots. Each slot has an entry in
+an info array (by default using frame_info_dtype, so the camera can write its frame information directly) and a small
+state header that records where the slot is in its life cycle:
+
+    SLOT_FREE -> SLOT_FILLING (queued on the camera) -> SLOT_FILLED (published to consumers) -> SLOT_FREE
+
+Only the producer (the acquire process) ever writes the slot state. When a slot is published, the producer marks a
+per consumer cell as CONSUMER_PENDING for each consumer that should see the frame. A consumer claims the slot by
+setting its own cell to CONSUMER_PROCESSING and hands it back by setting it to CONSUMER_DONE. Each cell therefore has
+exactly one writer at any time (ownership passes back and forth), so no locks are needed. Once every consumer cell of a
+filled slot is CONSUMER_DONE, the producer reclaims the slot and it can be queued on the camera again.
+
+Consumers that stop (for example a writer whose disk is full) deactivate themselves so the producer stops sending them
+frames. Anything they had claimed or were waiting for is handed back as failed, so the producer can redispatch it.
+
+A consumer that cannot process a slot (for example a writer whose disk returned an error) hands it back by setting its
+cell to CONSUMER_FAILED. The cell then belongs to the producer again, which can redispatch the slot to another consumer.
+
+Each slot also has a row of timestamps from the system wide monotonic clock, one per entry of frame_stamp_names. The
+process that owns the slot stamps it as the frame passes each point in the pipeline, and the compressors copy the row
+along with the frame into the compressed frame rings, so the writers end up with the full history of each frame (see
+latency.py).
+"""
+import ctypes
+import logging
+import multiprocessing as mp
+
+import numpy as np
+
+from pmc_turbo.camera.pycamera.dtypes import frame_info_dtype
+from pmc_turbo.utils.process_tuning import allocate_huge_pages, lock_memory
+from pmc_turbo.utils.uptime import get_monotonic_time
+
+logger = logging.getLogger(__name__)
+
+SLOT_FREE = 0
+SLOT_FILLING = 1
+SLOT_FILLED = 2
+
+CONSUMER_DONE = 0
+CONSUMER_PENDING = 1
+CONSUMER_PROCESSING = 2
+CONSUMER_FAILED = 3
+
+# Points in the pipeline at which each frame is stamped:
+#   exposure: when the camera took the frame, converted from the camera timestamp
+#   filled: when the acquire process noticed the camera had filled the buffer, just before publishing it
+#   compress_start, compressed: when a compressor claimed the frame, and published the compressed frame to a writer
+#   write_start, written, indexed: when a writer claimed the compressed frame, wrote it, and added it to the index
+frame_stamp_names = ['exposure', 'filled', 'compress_start', 'compressed', 'write_start', 'written', 'indexed']
+frame_stamp_indexes = dict([(name, k) for k, name in enumerate(frame_stamp_names)])
+
+
+class FrameRing(object):
+    def __init__(self, num_slots, slot_size, num_consumers, info_dtype=frame_info_dtype, huge_pages=False):
+        """
+        Allocate the shared memory for the ring.
+
+        This must be created before the processes that use it are started so that they inherit the shared memory.
+
+        Parameters
+        ----------
+        num_slots : int
+            Number of frame slots in the ring
+        slot_size : int
+            Size of each slot in bytes
+        num_consumers : int
+            Number of consumers that can be handed frames from this ring
+        info_dtype : numpy dtype
+            Data type of the per slot info record
+        huge_pages : bool
+            Allocate the frame data with huge pages if enough are reserved. The huge_pages attribute records whether
+            they were used.
+        """
+        self.num_slots = num_slots
+        self.slot_size = slot_size
+        self.num_consumers = num_consumers
+        self.info_dtype = np.dtype(info_dtype)
+        self._raw_data = None
+        if huge_pages:
+            self._raw_data = allocate_huge_pages(num_slots * slot_size)
+        self.huge_pages = self._raw_data is not None
+        if self._raw_data is None:
+            self._raw_data = mp.RawArray(ctypes.c_uint8, num_slots * slot_size)
+        self._raw_info = mp.RawArray(ctypes.c_uint8, num_slots * self.info_dtype.itemsize)
+        self._raw_slot_state = mp.RawArray(ctypes.c_int32, num_slots)
+        self._raw_sequence = mp.RawArray(ctypes.c_uint64, num_slots)
+        self._raw_consumer_state = mp.RawArray(ctypes.c_int32, num_slots * max(num_consumers, 1))
+        self._raw_consumer_active = mp.RawArray(ctypes.c_int32, max(num_consumers, 1))
+        self._raw_exit_request = mp.RawValue(ctypes.c_int32, 0)
+        self._raw_stamps = mp.RawArray(ctypes.c_double, num_slots * len(frame_stamp_names))
+
+        self.data = np.frombuffer(self._raw_data, dtype=np.uint8,
+                                  count=num_slots * slot_size).reshape((num_slots, slot_size))
+        self.info = np.frombuffer(self._raw_info, dtype=self.info_dtype)
+        self.slot_state = np.frombuffer(self._raw_slot_state, dtype=np.int32)
+        self.sequence = np.frombuffer(self._raw_sequence, dtype=np.uint64)
+        self.consumer_state = np.frombuffer(self._raw_consumer_state,
+                                            dtype=np.int32).reshape((num_slots, max(num_consumers, 1)))
+        self.consumer_active = np.frombuffer(self._raw_consumer_active, dtype=np.int32)
+        self.consumer_active[:] = 1
+        self.stamps = np.frombuffer(self._raw_stamps, dtype=np.float64).reshape((num_slots, len(frame_stamp_names)))
+        self._next_sequence = 1  # Only meaningful in the producer process
+        self._last_consumer = -1  # Only meaningful in the producer process
+
+    def lock_memory(self):
+        """
+        Lock the frame data into RAM so filling a slot never page faults. Returns True if the memory was locked.
+        """
+        return lock_memory(self.data.ctypes.data, self.data.nbytes)
+
+    # Accessors used by everyone
+
+    def get_slot_buffer(self, slot):
+        return self.data[slot]
+
+    def get_slot_info(self, slot):
+        """
+        Return a length one array viewing the info record for *slot*, suitable for passing to the camera
+        """
+        return self.info[slot:slot + 1]
+
+    def stamp(self, slot, name, when=None):
+        """
+        Record that the frame in *slot* reached point *name* (one of frame_stamp_names) at monotonic time *when*, by
+        default now. Only the process that currently owns the slot should stamp it.
+        """
+        if when is None:
+            when = get_monotonic_time()
+        self.stamps[slot, frame_stamp_indexes[name]] = when
+
+    def request_exit(self):
+        self._raw_exit_request.value = 1
+
+    @property
+    def exit_requested(self):
+        return bool(self._raw_exit_request.value)
+
+    def count_slots(self, state):
+        return int(np.sum(self.slot_state == state))
+
+    def num_pending(self, consumer):
+        return int(np.sum(self.consumer_state[:, consumer] != CONSUMER_DONE))
+
+    def is_consumer_active(self, consumer):
+        return bool(self.consumer_active[consumer])
+
+    # Producer methods
+
+    def get_free_slots(self):
+        """
+        Reclaim any filled slots that all consumers are done with, and return the indexes of all free slots
+        """
+        for slot in np.flatnonzero(self.slot_state == SLOT_FILLED):
+            cells = self.consumer_state[slot]
+            for consumer in np.flatnonzero(cells == CONSUMER_PENDING):
+                if not self.consumer_active[consumer]:
+                    cells[consumer] = CONSUMER_DONE
+            if np.all(cells == CONSUMER_DONE):
+                self.slot_state[slot] = SLOT_FREE
+        return [int(slot) for slot in np.flatnonzero(self.slot_state == SLOT_FREE)]
+
+    def mark_filling(self, slot):
+        self.slot_state[slot] = SLOT_FILLING
+
+    def mark_free(self, slot):
+        self.slot_state[slot] = SLOT_FREE
+
+    def publish(self, slot, consumers):
+        """
+        Hand a filled slot to the given consumers.
+
+        If none of the consumers are active, the slot will be reclaimed the next time get_free_slots is called.
+
+        Parameters
+        ----------
+        slot : int
+        consumers : list of int
+            indexes of the consumers that should process this slot
+        """
+        self.sequence[slot] = self._next_sequence
+        self._next_sequence += 1
+        for consumer in consumers:
+            if self.consumer_active[consumer]:
+                self.consumer_state[slot, consumer] = CONSUMER_PENDING
+        self.slot_state[slot] = SLOT_FILLED
+
+    def least_loaded_consumer(self, candidates=None):
+        """
+        Return the active consumer with the fewest slots outstanding, or None if no consumers are active
+
+        Ties are broken round robin so that idle consumers share the work.
+
+        Parameters
+        ----------
+        candidates : list of int
+            Consumers to choose from, by default all of them
+        """
+        best_consumer = None
+        best_pending = None
+        for k in range(self.num_consumers):
+            consumer = (self._last_consumer + 1 + k) % self.num_consumers
+            if (candidates is not None and consumer not in candidates) or not self.consumer_active[consumer]:
+                continue
+            pending = self.num_pending(consumer)
+            if best_pending is None or pending < best_pending:
+                best_consumer = consumer
+                best_pending = pending
+        if best_consumer is not None:
+            self._last_consumer = best_consumer
+        return best_consumer
+
+    def get_failed(self):
+        """
+        Return a list of (slot, consumer) pairs for slots that a consumer could not process
+        """
+        slots, consumers = np.nonzero(self.consumer_state == CONSUMER_FAILED)
+        return [(int(slot), int(consumer)) for slot, consumer in zip(slots, consumers)]
+
+    def redispatch(self, slot, from_consumer, to_consumer):
+        """
+        Hand a failed slot to another consumer, or drop it if *to_consumer* is None
+        """
+        if to_consumer is not None and self.consumer_active[to_consumer]:
+            self.consumer_state[slot, to_consumer] = CONSUMER_PENDING
+        self.consumer_state[slot, from_consumer] = CONSUMER_DONE
+
+    # Consumer methods
+
+    def get_next_filled(self, consumer):
+        """
+        Claim the oldest slot waiting for *consumer*
+
+        Returns
+        -------
+        slot index, or None if nothing is waiting
+        """
+        waiting = np.flatnonzero(self.consumer_state[:, consumer] == CONSUMER_PENDING)
+        if len(waiting) == 0:
+            return None
+        slot = int(waiting[np.argmin(self.sequence[waiting])])
+        self.consumer_state[slot, consumer] = CONSUMER_PROCESSING
+        return slot
+
+    def release(self, slot, consumer):
+        self.consumer_state[slot, consumer] = CONSUMER_DONE
+
+    def fail(self, slot, consumer):
+        self.consumer_state[slot, consumer] = CONSUMER_FAILED
+
+    def deactivate_consumer(self, consumer):
+        """
+        Stop sending frames to *consumer* and hand back anything it had claimed or was waiting for as failed, so the
+        producer can redispatch it with get_failed and redispatch
+        """
+        self.consumer_active[consumer] = 0
+        cells = self.consumer_state[:, consumer]
+        cells[(cells == CONSUMER_PENDING) | (cells == CONSUMER_PROCESSING)] = CONSUMER_FAILED
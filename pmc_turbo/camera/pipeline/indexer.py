@@ -5,17 +5,35 @@ import gc
 
 import pandas as pd
 
+from pmc_turbo.camera.pipeline.binary_index import BinaryIndexWatcher
 from pmc_turbo.utils.index_watcher import IndexWatcher
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_DATA_DIRS = ['/data1', '/data2', '/data3', '/data4']
+BINARY_INDEX_FILENAME = 'index.bin'
 INDEX_FILENAME = 'index.csv'
+# Directories written by the pipeline have a binary index. Older directories only have the CSV index.
+DEFAULT_INDEX_FILENAMES = [BINARY_INDEX_FILENAME, INDEX_FILENAME]
 
 
 class MergedIndex(object):
-    def __init__(self, subdirectory_name, data_dirs=DEFAULT_DATA_DIRS, index_filename=INDEX_FILENAME,
+    def __init__(self, subdirectory_name, data_dirs=DEFAULT_DATA_DIRS, index_filename=DEFAULT_INDEX_FILENAMES,
                  sort_on = 'frame_timestamp_ns'):
+        """
+        Merge the index files found in data_dirs/subdirectory_name into one DataFrame.
+
+        Parameters
+        ----------
+        subdirectory_name : str
+            glob pattern
+        data_dirs : list of str
+        index_filename : str or list of str
+            Name of the index file in each directory. If a list is given, the first name that exists in each directory
+            is used. Files ending in .bin are read as binary indexes, anything else as CSV.
+        sort_on : str
+            Column to sort new rows by, or None
+        """
         self.data_dirs = data_dirs
         self.subdirectory_name = subdirectory_name
         self.index_filename = index_filename
@@ -26,9 +44,18 @@ class MergedIndex(object):
         self.update()
 
     def get_index_filenames(self):
+        if isinstance(self.index_filename, basestring):
+            candidate_names = [self.index_filename]
+        else:
+            candidate_names = self.index_filename
         index_filenames = []
         for data_dir in self.data_dirs:
-            index_filenames.extend(glob.glob(os.path.join(data_dir, self.subdirectory_name, self.index_filename)))
+            for directory in glob.glob(os.path.join(data_dir, self.subdirectory_name)):
+                for name in candidate_names:
+                    filename = os.path.join(directory, name)
+                    if os.path.exists(filename):
+                        index_filenames.append(filename)
+                        break
         return  index_filenames
 
     def update_watchers(self):
@@ -36,7 +63,7 @@ class MergedIndex(object):
         new_index_files = list(set(index_filenames).difference(set(self.index_filenames)))
         if new_index_files:
             logger.info("found new index files: %r" % new_index_files)
-        new_watchers = [IndexWatcher(fn) for fn in new_index_files]
+        new_watchers = [BinaryIndexWatcher(fn) if fn.endswith('.bin') else IndexWatcher(fn) for fn in new_index_files]
         self.watchers = self.watchers + new_watchers
         self.index_filenames = index_filenames
 
@@ -0,0 +1,262 @@
+"""
+Per frame latency through the pipeline.
+
+Every frame slot carries monotonic timestamps for the points listed in frame_ring.frame_stamp_names. Once a writer has
+indexed a frame, it appends the frame's timestamps to its LatencyLog, a small shared memory ring of records that only
+that writer writes. The LatencyAggregator in the main pipeline process drains the logs and accumulates a histogram of
+the time each frame took for each stage transition (see latency_transitions), plus the write time and end to end latency
+of each disk. When the pipeline falls behind, the histograms show which stage frames are waiting in.
+
+The histograms are HDR style: values are counted in buckets whose width grows with the value, keeping the relative
+error below 1 / 2**sub_bucket_bits over the whole range from microseconds to days with a fixed number of counters.
+"""
+import ctypes
+import logging
+import multiprocessing as mp
+import threading
+import time
+
+import numpy as np
+
+from pmc_turbo.camera.pipeline.frame_ring import frame_stamp_indexes, frame_stamp_names
+from pmc_turbo.utils.housekeeping_logger import HousekeepingLogger
+
+logger = logging.getLogger(__name__)
+
+# (name, start stamp, end stamp)
+latency_transitions = [('readout', 'exposure', 'filled'),
+                       ('compress queue', 'filled', 'compress_start'),
+                       ('compress', 'compress_start', 'compressed'),
+                       ('write queue', 'compressed', 'write_start'),
+                       ('write', 'write_start', 'written'),
+                       ('index', 'written', 'indexed'),
+                       ('total', 'exposure', 'indexed')]
+# Transitions also histogrammed separately for each disk
+disk_latency_transitions = ['write', 'total']
+
+latency_record_dtype = np.dtype([('frame_id', np.uint64),
+                                 ('disk', np.int32),
+                                 ('stamps', np.float64, (len(frame_stamp_names),))])
+
+summary_percentiles = [50, 90, 99]
+
+
+class LatencyHistogram(object):
+    def __init__(self, resolution=1e-6, sub_bucket_bits=5, max_exponent=40):
+        """
+        Histogram of latencies with bounded relative error
+
+        Parameters
+        ----------
+        resolution : float
+            Smallest latency in seconds that is distinguished from zero
+        sub_bucket_bits : int
+            Each power of two range of values is split into 2**sub_bucket_bits buckets
+        max_exponent : int
+            Values up to resolution * 2**max_exponent are counted, larger values go in the last bucket
+        """
+        self.resolution = resolution
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 2 ** sub_bucket_bits
+        self.max_exponent = max_exponent
+        self.counts = np.zeros(self.sub_bucket_count * (max_exponent - sub_bucket_bits + 2), dtype=np.uint64)
+        self.reset()
+
+    def reset(self):
+        self.counts[:] = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def bucket_indexes(self, values):
+        units = np.floor(np.clip(np.asarray(values, dtype=np.float64) / self.resolution, 0,
+                                 2.0 ** (self.max_exponent + 1) - 1)).astype(np.int64)
+        # Values below sub_bucket_count get one bucket each, above that each power of two gets sub_bucket_count
+        exponents = np.maximum(np.floor(np.log2(np.maximum(units, 1))).astype(np.int64), self.sub_bucket_bits)
+        shifts = exponents - self.sub_bucket_bits
+        return np.where(units < self.sub_bucket_count, units,
+                        (shifts + 1) * self.sub_bucket_count + (units >> shifts) - self.sub_bucket_count)
+
+    def bucket_bounds(self, index):
+        """
+        Return the range of values in seconds counted in bucket *index*
+        """
+        if index < self.sub_bucket_count:
+            return index * self.resolution, (index + 1) * self.resolution
+        shift, sub_bucket = divmod(index - self.sub_bucket_count, self.sub_bucket_count)
+        low = (self.sub_bucket_count + sub_bucket) << shift
+        return low * self.resolution, (low + (1 << shift)) * self.resolution
+
+    def record(self, values):
+        """
+        Add an array of latencies in seconds
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if values.size == 0:
+            return
+        self.counts += np.bincount(self.bucket_indexes(values), minlength=self.counts.shape[0]).astype(np.uint64)
+        self.count += values.size
+        self.total += values.sum()
+        self.max = max(self.max, values.max())
+
+    def percentile(self, percentile):
+        """
+        Return the latency in seconds below which *percentile* percent of the values fall, to within the bucket width,
+        or nan if nothing has been recorded
+        """
+        if not self.count:
+            return np.nan
+        rank = max(int(np.ceil(percentile / 100. * self.count)), 1)
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        low, high = self.bucket_bounds(index)
+        return min((low + high) / 2., self.max)
+
+    def summary(self):
+        """
+        Return a dict with the count, mean, max and summary_percentiles of the latencies in seconds
+        """
+        result = dict(count=self.count, max=self.max, mean=self.total / self.count if self.count else np.nan)
+        for percentile in summary_percentiles:
+            result['p%d' % percentile] = self.percentile(percentile)
+        return result
+
+
+class LatencyLog(object):
+    def __init__(self, num_records=1024):
+        """
+        Shared memory ring of latency records with one writer process and one reader
+
+        Must be created before the writer process is started. If the reader falls more than *num_records* records
+        behind, the oldest records are lost.
+        """
+        self.num_records = num_records
+        self._raw_records = mp.RawArray(ctypes.c_uint8, num_records * latency_record_dtype.itemsize)
+        self._raw_num_appended = mp.RawValue(ctypes.c_uint64, 0)
+        self.records = np.frombuffer(self._raw_records, dtype=latency_record_dtype)
+
+    @property
+    def num_appended(self):
+        return self._raw_num_appended.value
+
+    def append(self, frame_id, disk, stamps):
+        index = self._raw_num_appended.value % self.num_records
+        self.records[index]['frame_id'] = frame_id
+        self.records[index]['disk'] = disk
+        self.records[index]['stamps'] = stamps
+        # Only publish the record once it is complete
+        self._raw_num_appended.value += 1
+
+    def read_new(self, num_read):
+        """
+        Return the records appended since the first *num_read* records were read
+
+        Returns
+        -------
+        records : array of latency_record_dtype
+        num_read : int
+            Total number of records read, to pass to the next call
+        num_lost : int
+            Number of records overwritten before they could be read
+        """
+        num_appended = self.num_appended
+        num_lost = max(num_appended - num_read - self.num_records, 0)
+        indexes = np.arange(num_read + num_lost, num_appended) % self.num_records
+        return self.records[indexes].copy(), num_appended, num_lost
+
+
+class LatencyAggregator(object):
+    def __init__(self, latency_logs, housekeeping_dir=None, log_interval=60.):
+        """
+        Collect the latency records of all the writers into histograms
+
+        Two sets of histograms are kept: one since the pipeline started, reported by get_status, and one since the last
+        housekeeping log entry, which is written and reset every *log_interval* seconds.
+
+        Parameters
+        ----------
+        latency_logs : list of LatencyLog
+            One per writer, in disk order
+        housekeeping_dir : str
+            Directory for the CSV log of latency statistics, None for no log
+        log_interval : float
+            Seconds between log entries
+        """
+        self.latency_logs = latency_logs
+        self.num_read = [0] * len(latency_logs)
+        self.num_lost = 0
+        self.names = ([name for name, _, _ in latency_transitions]
+                      + ['disk %d %s' % (disk, name) for disk in range(len(latency_logs))
+                         for name in disk_latency_transitions])
+        self.histograms = dict([(name, LatencyHistogram()) for name in self.names])
+        self.interval_histograms = dict([(name, LatencyHistogram()) for name in self.names])
+        self.log_interval = log_interval
+        self.last_log_time = time.time()
+        self.lock = threading.Lock()
+        self.housekeeping_logger = None
+        if housekeeping_dir is not None:
+            columns = ['epoch', 'records_lost']
+            for name in self.names:
+                columns.extend(['%s %s' % (name, key) for key in ['count', 'mean', 'max']
+                                + ['p%d' % percentile for percentile in summary_percentiles]])
+            self.housekeeping_logger = HousekeepingLogger(columns=columns,
+                                                          formats=['%f', '%d'] + ['%g'] * (len(columns) - 2),
+                                                          housekeeping_dir=housekeeping_dir)
+
+    def record(self, records):
+        stamps = records['stamps']
+        for name, start, end in latency_transitions:
+            start_stamps = stamps[:, frame_stamp_indexes[start]]
+            end_stamps = stamps[:, frame_stamp_indexes[end]]
+            # Stamps that were never set are zero, for example the exposure time of frames without camera timestamps
+            valid = (start_stamps > 0) & (end_stamps > 0)
+            durations = end_stamps[valid] - start_stamps[valid]
+            self.histograms[name].record(durations)
+            self.interval_histograms[name].record(durations)
+            if name in disk_latency_transitions:
+                for disk in np.unique(records['disk'][valid]):
+                    disk_name = 'disk %d %s' % (disk, name)
+                    if disk_name in self.histograms:
+                        self.histograms[disk_name].record(durations[records['disk'][valid] == disk])
+                        self.interval_histograms[disk_name].record(durations[records['disk'][valid] == disk])
+
+    def update(self):
+        """
+        Read any new records from the latency logs
+        """
+        with self.lock:
+            for k, latency_log in enumerate(self.latency_logs):
+                records, self.num_read[k], num_lost = latency_log.read_new(self.num_read[k])
+                if num_lost:
+                    logger.warning("Lost %d latency records from disk %d" % (num_lost, k))
+                    self.num_lost += num_lost
+                if records.shape[0]:
+                    self.record(records)
+
+    def get_status(self):
+        """
+        Return a dict mapping each transition name to a summary of its histogram since the pipeline started
+        """
+        self.update()
+        with self.lock:
+            status = dict([(name, histogram.summary()) for name, histogram in self.histograms.items()])
+            status['records lost'] = self.num_lost
+        return status
+
+    def log_if_due(self):
+        """
+        Update, and write an entry to the housekeeping log if one is due
+        """
+        self.update()
+        now = time.time()
+        if self.housekeeping_logger is None or now - self.last_log_time < self.log_interval:
+            return
+        with self.lock:
+            self.last_log_time = now
+            entry = {'epoch': now, 'records_lost': self.num_lost}
+            for name in self.names:
+                for key, value in self.interval_histograms[name].summary().items():
+                    entry['%s %s' % (name, key)] = value
+                self.interval_histograms[name].reset()
+            if not hasattr(self.housekeeping_logger, 'status_log_file'):
+                self.housekeeping_logger.create_log_file()
+            self.housekeeping_logger.write_log_entry(entry)
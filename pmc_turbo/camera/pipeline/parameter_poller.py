@@ -0,0 +1,114 @@
+"""
+Read camera parameters on a schedule that depends on how often each one can change.
+
+Reading a parameter is a round trip on the GigE control channel, which is shared with frame delivery, so reading all
+~250 parameters every second causes packet resends and delays arming the camera. Instead each parameter is assigned a
+tier:
+
+fast
+    Statistics, PTP and lens state, which change continuously. Read every fast interval.
+slow
+    Temperatures. Read every slow interval.
+settings
+    Values that only change when we set them. Read after being set (see invalidate) and otherwise only every settings
+    interval, as a safety net.
+static
+    Identifiers, firmware versions and limits. Read once at startup.
+
+The latest value of every parameter is cached along with the time it was read.
+"""
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+FAST = 'fast'
+SLOW = 'slow'
+SETTINGS = 'settings'
+STATIC = 'static'
+
+fast_parameter_prefixes = ('Stat', 'Ptp', 'EFLensState', 'EFLensLastError', 'GevTimestampValue')
+slow_parameter_prefixes = ('DeviceTemperature',)
+static_parameter_prefixes = ('Device', 'Firmware', 'Sensor', 'GevDevice', 'GevPersistent', 'EFLensID',
+                             'GevTimestampTickFrequency', 'PayloadSize', 'ImageSize', 'NonImagePayloadSize')
+static_parameter_suffixes = ('Max', 'Min', 'StepSize')
+
+temperature_selectors = ['Main', 'Sensor']
+
+
+def get_parameter_tier(name):
+    if name.startswith(fast_parameter_prefixes):
+        return FAST
+    if name.startswith(slow_parameter_prefixes):
+        return SLOW
+    if name.startswith(static_parameter_prefixes) or name.endswith(static_parameter_suffixes):
+        return STATIC
+    return SETTINGS
+
+
+class ParameterPoller(object):
+    def __init__(self, pc, fast_interval=1.0, slow_interval=10.0, settings_interval=60.0):
+        """
+        Parameters
+        ----------
+        pc : PyCamera
+        fast_interval, slow_interval, settings_interval : float
+            Seconds between reads of the parameters in each tier
+        """
+        self.pc = pc
+        self.intervals = {FAST: fast_interval, SLOW: slow_interval, SETTINGS: settings_interval, STATIC: None}
+        self.tiers = dict([(name, get_parameter_tier(name)) for name in pc.parameter_names])
+        self.values = {}
+        self.read_at = {}
+        self.temperatures = {}
+        self.polled_at = dict([(tier, 0) for tier in self.intervals])
+        # Parameters to read at the next poll regardless of their tier
+        self.stale = set(self.tiers)
+
+    def invalidate(self, name):
+        """
+        Read parameter *name* at the next poll, e.g. because it was just set
+        """
+        if name in self.tiers:
+            self.stale.add(name)
+
+    def is_due(self, tier, now):
+        interval = self.intervals[tier]
+        return interval is not None and now - self.polled_at[tier] >= interval
+
+    def poll(self, now=None):
+        """
+        Read the parameters that are due
+
+        Returns
+        -------
+        dict of the parameters whose values changed (or were read for the first time)
+        """
+        if now is None:
+            now = time.time()
+        due_tiers = [tier for tier in self.intervals if self.is_due(tier, now)]
+        to_read = set(self.stale)
+        for name, tier in self.tiers.items():
+            if tier in due_tiers:
+                to_read.add(name)
+        if SLOW in due_tiers:
+            self.temperatures = self._read_temperatures()
+        changed = {}
+        for name in to_read:
+            value = self.pc.get_parameter(name)
+            self.read_at[name] = now
+            if self.values.get(name) != value:
+                self.values[name] = value
+                changed[name] = value
+        self.stale.clear()
+        for tier in due_tiers:
+            self.polled_at[tier] = now
+        logger.debug("Read %d camera parameters, %d changed" % (len(to_read), len(changed)))
+        return changed
+
+    def _read_temperatures(self):
+        temperatures = {}
+        for selector in temperature_selectors:
+            self.pc.set_parameter("DeviceTemperatureSelector", selector)
+            temperatures['%s_temperature' % selector.lower()] = self.pc.get_parameter("DeviceTemperature")
+        return temperatures
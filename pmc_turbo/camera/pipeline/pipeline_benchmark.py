@@ -0,0 +1,183 @@
+"""
+Measure the sustained throughput of the full pipeline using the simulated camera.
+
+The pipeline is started with BasicPyCameraSimulator producing frames at a fixed rate. After a warm up period, the
+frames delivered by the camera, the frames written to disk, the occupancy of the frame buffers and the CPU time used
+by each process are measured over a fixed interval. A configuration can sustain a frame rate if no frames are lost
+(underruns, where the camera had no free buffer) and the number of filled buffers does not keep growing.
+
+Point data_directories at tmpfs (e.g. /dev/shm) to measure the compression limit, or at the flight disks to include
+disk bandwidth.
+
+Example:
+
+    results = run_pipeline_benchmark(config, duration=30)
+    print json.dumps(results, indent=2)
+"""
+import glob
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from pmc_turbo.camera.image_processing.container_file import get_num_bytes
+from pmc_turbo.camera.pipeline import basic_pipeline
+from pmc_turbo.camera.pipeline.binary_index import BinaryIndexReader
+from pmc_turbo.camera.pipeline.frame_ring import SLOT_FREE, SLOT_FILLED
+from pmc_turbo.camera.pipeline.write_images import index_file_name
+
+logger = logging.getLogger(__name__)
+
+_clock_ticks_per_second = os.sysconf('SC_CLK_TCK')
+
+
+def process_cpu_seconds(pid):
+    """
+    User plus system CPU time used so far by process *pid*, read from /proc
+    """
+    with open('/proc/%d/stat' % pid) as fh:
+        # The command name in field 2 may contain spaces, so split after its closing parenthesis
+        fields = fh.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / float(_clock_ticks_per_second)
+
+
+def _get_process_ids(bpl):
+    pids = dict(main=os.getpid(), acquire=bpl.acquire_images.child.pid)
+    for k, compressor in enumerate(bpl.compressors):
+        pids['compressor %d' % k] = compressor.child.pid
+    for k, writer in enumerate(bpl.writers):
+        pids['writer %d' % k] = writer.child.pid
+    return pids
+
+
+def _get_cpu_seconds(pids):
+    cpu_seconds = {}
+    for name, pid in pids.items():
+        try:
+            cpu_seconds[name] = process_cpu_seconds(pid)
+        except (IOError, OSError, IndexError, ValueError):
+            logger.warning("Could not read CPU time of %s process %d" % (name, pid))
+            cpu_seconds[name] = None
+    return cpu_seconds
+
+
+def _cpu_percent(start_cpu_seconds, stop_cpu_seconds, elapsed):
+    if start_cpu_seconds is None or stop_cpu_seconds is None:
+        return None
+    return 100 * (stop_cpu_seconds - start_cpu_seconds) / elapsed
+
+
+def _get_camera_counter(bpl, name):
+    try:
+        return int(bpl.get_status()['all_camera_parameters'][name])
+    except (KeyError, ValueError):
+        return 0
+
+
+def _get_written_frames(bpl, start, stop):
+    """
+    Return the number of frames written and the total size of their files, for frames written between *start* and
+    *stop* (epoch seconds)
+    """
+    num_frames = 0
+    num_bytes = 0
+    for writer in bpl.writers:
+        for dirname in writer.output_dirs:
+            for filename in glob.glob(os.path.join(dirname, index_file_name)):
+                records = BinaryIndexReader(filename).records
+                selected = records[(records['write_timestamp'] >= start) & (records['write_timestamp'] < stop)]
+                num_frames += selected.shape[0]
+                num_bytes += sum([get_num_bytes(name) for name in selected['filename']])
+    return num_frames, num_bytes
+
+
+def run_pipeline_benchmark(config, duration=30., warmup=10., sample_interval=0.1):
+    """
+    Run the pipeline with the simulated camera and measure its throughput
+
+    Parameters
+    ----------
+    config : traitlets Config
+        Pipeline configuration. AcquireImagesProcess.use_simulated_camera is forced on. The frame rate and content
+        are set by AcquireImagesProcess.simulated_frame_rate and simulated_frame_content.
+    duration : float
+        Seconds to measure for
+    warmup : float
+        Seconds to run before starting the measurement
+    sample_interval : float
+        Seconds between samples of the frame buffer occupancy
+
+    Returns
+    -------
+    dict of results, suitable for saving as JSON
+    """
+    config = config.copy()
+    config.AcquireImagesProcess.use_simulated_camera = True
+    bpl = basic_pipeline.BasicPipeline(config=config)
+    bpl.initialize()
+    thread = threading.Thread(target=bpl.run_pyro_loop)
+    thread.daemon = True
+    thread.start()
+    try:
+        time.sleep(warmup)
+        pids = _get_process_ids(bpl)
+        start = time.time()
+        start_cpu_seconds = _get_cpu_seconds(pids)
+        start_delivered = _get_camera_counter(bpl, 'StatFrameDelivered')
+        start_underrun = _get_camera_counter(bpl, 'StatFrameUnderrun')
+        buffers_filled = []
+        buffers_free = []
+        while time.time() - start < duration:
+            buffers_filled.append(bpl.frame_ring.count_slots(SLOT_FILLED))
+            buffers_free.append(bpl.frame_ring.count_slots(SLOT_FREE))
+            time.sleep(sample_interval)
+        stop = time.time()
+        stop_cpu_seconds = _get_cpu_seconds(pids)
+        # The camera counters are only updated about once per camera_parameter_update_interval, so the counts cover
+        # approximately, but not exactly, the measurement interval.
+        frames_delivered = _get_camera_counter(bpl, 'StatFrameDelivered') - start_delivered
+        frames_underrun = _get_camera_counter(bpl, 'StatFrameUnderrun') - start_underrun
+    finally:
+        bpl.close()
+    elapsed = stop - start
+    # Wait for the writers to finish flushing their indexes before counting the frames written
+    time.sleep(bpl.index_flush_interval)
+    frames_written, bytes_written = _get_written_frames(bpl, start, stop)
+    bytes_compressed = frames_written * bpl.geometry.payload_size
+
+    results = dict(duration=elapsed,
+                   frame_rate=bpl.acquire_images.simulated_frame_rate,
+                   frame_content=bpl.acquire_images.simulated_frame_content,
+                   geometry=bpl.geometry.to_dict(),
+                   num_data_buffers=bpl.frame_ring.num_slots,
+                   burst_frame_count=bpl.acquire_images.burst_frame_count,
+                   frame_buffers_huge_pages=bpl.status_dict['frame buffers huge pages'],
+                   frame_buffers_locked=bpl.status_dict['frame buffers locked'],
+                   num_compressors=bpl.num_compressors,
+                   compression_threads=bpl.compression_threads,
+                   compression_codec=bpl.compression_codec,
+                   compression_level=bpl.compression_level,
+                   compression_shuffle=bpl.compression_shuffle,
+                   compression_packed_bits=bpl.compression_packed_bits,
+                   compression_band_rows=bpl.compression_band_rows,
+                   data_directories=list(bpl.data_directories),
+                   frames_delivered=frames_delivered,
+                   frames_underrun=frames_underrun,
+                   frames_written=frames_written,
+                   frames_per_second=frames_written / elapsed,
+                   buffers_filled_mean=float(np.mean(buffers_filled)),
+                   buffers_filled_max=int(np.max(buffers_filled)),
+                   buffers_free_min=int(np.min(buffers_free)),
+                   buffers_filled_at_end=int(buffers_filled[-1]),
+                   compression_ratio=bytes_compressed / float(bytes_written) if bytes_written else None,
+                   compression_MBps=bytes_compressed / elapsed / 1e6,
+                   write_MBps=bytes_written / elapsed / 1e6,
+                   cpu_percent=dict([(name, _cpu_percent(start_cpu_seconds[name], stop_cpu_seconds[name], elapsed))
+                                     for name in pids]),
+                   latency=bpl.latency_aggregator.get_status(),
+                   )
+    logger.info("%(frames_per_second).2f frames/s written, %(frames_underrun)d frames lost, "
+                "%(compression_MBps).1f MB/s compressed, %(write_MBps).1f MB/s written" % results)
+    return results
@@ -0,0 +1,217 @@
+"""
+Background rendering of requested images for the controller.
+
+Serving an image request means decompressing, masking, cropping, resampling and JPEG encoding frames, which takes a
+large fraction of a second per frame. Done inside the Pyro call, a request for 20 images would stall the controller
+long enough for the communicator's get_next_data_for_downlink calls to time out. Instead, the controller submits each
+request as a job to a RenderPool, and the call returns as soon as the job is queued. Worker threads run the jobs and
+append each file to the downlink queue as soon as it is rendered.
+
+Threads are used rather than processes so the workers share the controller's frame cache and merged index. Most of
+the rendering time is spent in blosc, numpy and PIL, which release the GIL.
+"""
+import itertools
+import logging
+import Queue
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+
+class RenderJob(object):
+    def __init__(self, job_id, description, render, request_id=None, output_kwargs=None):
+        self.job_id = job_id
+        self.description = description
+        self.render = render
+        self.request_id = request_id
+        self.output_kwargs = output_kwargs or {}
+        self.state = JOB_QUEUED
+        self.cancel_requested = False
+        self.num_files = 0
+        self.error = ''
+        self.submit_time = time.time()
+        self.start_time = None
+        self.finish_time = None
+
+    def to_dict(self):
+        return dict(job_id=self.job_id, description=self.description, request_id=self.request_id, state=self.state,
+                    num_files=self.num_files,
+                    error=self.error, submit_time=self.submit_time, start_time=self.start_time,
+                    finish_time=self.finish_time)
+
+
+class RenderPool(object):
+    def __init__(self, output, num_workers=2, max_queued_jobs=32, num_finished_jobs_kept=100):
+        """
+        Parameters
+        ----------
+        output : callable
+            Called with each file buffer a job produces, and the job's output_kwargs as keyword arguments, from the
+            worker thread
+        num_workers : int
+            Number of worker threads. With 0, jobs are run synchronously by submit.
+        max_queued_jobs : int
+            submit raises RuntimeError rather than queue more than this many jobs
+        num_finished_jobs_kept : int
+            Status of this many finished jobs is kept for get_job_status
+        """
+        self.output = output
+        self.num_workers = num_workers
+        self.num_finished_jobs_kept = num_finished_jobs_kept
+        self.job_queue = Queue.Queue(maxsize=max_queued_jobs)
+        self.jobs = OrderedDict()
+        self.job_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.num_failed = 0
+        self.num_rejected = 0
+        self.num_cancelled = 0
+        self.workers = []
+        for k in range(num_workers):
+            worker = threading.Thread(target=self.run_worker, name='render worker %d' % k)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, description, render, request_id=None, output_kwargs=None):
+        """
+        Queue a job
+
+        Parameters
+        ----------
+        description : str
+            Summary of the request for the job status
+        render : callable
+            Called with no arguments by a worker, returns an iterable of file buffers. Using a generator lets each
+            file be downlinked as soon as it is rendered.
+        request_id : int
+            Request the job is for, so it can be cancelled with cancel
+        output_kwargs : dict
+            Keyword arguments passed to output with each file buffer
+
+        Returns
+        -------
+        job_id : int
+        """
+        with self.lock:
+            job = RenderJob(self.job_ids.next(), description, render, request_id=request_id,
+                            output_kwargs=output_kwargs)
+            self.jobs[job.job_id] = job
+        if not self.num_workers:
+            self.run_job(job)
+            return job.job_id
+        try:
+            self.job_queue.put_nowait(job)
+        except Queue.Full:
+            with self.lock:
+                del self.jobs[job.job_id]
+                self.num_rejected += 1
+            raise RuntimeError("Render queue is full with %d jobs, rejected %s" % (self.job_queue.qsize(), description))
+        logger.debug("Queued render job %d: %s" % (job.job_id, description))
+        return job.job_id
+
+    def run_worker(self):
+        while True:
+            job = self.job_queue.get()
+            if job is None:
+                self.job_queue.task_done()
+                return
+            try:
+                self.run_job(job)
+            finally:
+                self.job_queue.task_done()
+
+    def run_job(self, job):
+        if job.cancel_requested:
+            job.state = JOB_CANCELLED
+            logger.debug("Skipping cancelled render job %d" % job.job_id)
+            self.forget_finished_jobs()
+            return
+        job.state = JOB_RUNNING
+        job.start_time = time.time()
+        try:
+            for file_buffer in job.render():
+                if job.cancel_requested:
+                    break
+                self.output(file_buffer, **job.output_kwargs)
+                job.num_files += 1
+        except Exception as e:
+            logger.exception("Render job %d (%s) failed" % (job.job_id, job.description))
+            job.error = '%s: %s' % (type(e).__name__, e)
+            job.state = JOB_FAILED
+            with self.lock:
+                self.num_failed += 1
+        else:
+            job.state = JOB_CANCELLED if job.cancel_requested else JOB_DONE
+        job.finish_time = time.time()
+        logger.debug("Render job %d %s with %d files in %.2f s" % (job.job_id, job.state, job.num_files,
+                                                                   job.finish_time - job.start_time))
+        self.forget_finished_jobs()
+
+    def forget_finished_jobs(self):
+        with self.lock:
+            finished = [job_id for job_id, job in self.jobs.items() if job.state in (JOB_DONE, JOB_FAILED, JOB_CANCELLED)]
+            for job_id in finished[:max(len(finished) - self.num_finished_jobs_kept, 0)]:
+                del self.jobs[job_id]
+
+    def cancel(self, request_id):
+        """
+        Cancel the queued and running jobs for *request_id*. Queued jobs are skipped, and running jobs stop before
+        outputting their next file.
+
+        Returns
+        -------
+        int : number of jobs cancelled
+        """
+        with self.lock:
+            jobs = [job for job in self.jobs.values()
+                    if job.request_id == request_id and job.state in (JOB_QUEUED, JOB_RUNNING)
+                    and not job.cancel_requested]
+            for job in jobs:
+                job.cancel_requested = True
+            self.num_cancelled += len(jobs)
+        if jobs:
+            logger.info("Cancelled %d render jobs for request %r" % (len(jobs), request_id))
+        return len(jobs)
+
+    def get_job_status(self, job_id):
+        """
+        Return a dict describing job *job_id*. Raises KeyError if the job is unknown or finished long ago.
+        """
+        with self.lock:
+            return self.jobs[job_id].to_dict()
+
+    def get_status(self):
+        with self.lock:
+            states = [job.state for job in self.jobs.values()]
+            return dict(workers=self.num_workers, queue_depth=self.job_queue.qsize(),
+                        running=states.count(JOB_RUNNING), failed=self.num_failed, rejected=self.num_rejected,
+                        cancelled=self.num_cancelled)
+
+    def wait_until_idle(self, timeout=None):
+        """
+        Wait until all queued jobs have finished
+
+        Returns
+        -------
+        bool : True if the pool is idle, False if *timeout* seconds passed first
+        """
+        start = time.time()
+        while self.job_queue.unfinished_tasks:
+            if timeout is not None and time.time() - start > timeout:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self):
+        for worker in self.workers:
+            self.job_queue.put(None)
+        for worker in self.workers:
+            worker.join()
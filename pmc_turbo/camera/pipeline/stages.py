@@ -0,0 +1,323 @@
+"""
+Extra consumers of the raw camera frames, running alongside the compressors.
+
+A stage is a process that registers as a consumer of the frame ring (see BasicPipeline.add_stage). The acquire process
+publishes every decimation-th frame, at most one every min_interval seconds, to each stage, in addition to the compressor that archives it. The frame ring
+already counts references: a slot is only queued on the camera again once the compressor and every stage it was
+published to have released it. So that a slow stage can never starve the camera, a frame is skipped for a stage that
+still has max_pending frames outstanding.
+
+Stages see the uncompressed frame in shared memory, so analysis doesn't need to wait for the frame to be written and
+then read it back and decompress it.
+
+To add a stage, subclass FrameStage and override process_frame (and setup for anything that should be created in the
+child process).
+
+LatestFrameTap is a stage that keeps a copy of the most recent frame, with its index record, in a file in /dev/shm.
+The controller reads it with LatestFrameReader to serve the latest image without going through the disk. The tap also
+keeps the frame binned by each preview factor (see preview_pyramid.py), so downsampled images such as the standard
+image are made without copying or hot pixel masking the full frame. The tap does not compute the frame statistics again: each compressor posts the statistics of the frames it compresses to its own
+row of the file, and the reader adds those of the frame it returns.
+"""
+import logging
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+
+from pmc_turbo.camera.image_processing.hot_pixels import HotPixelMasker, hot_pixels_for_geometry
+from pmc_turbo.camera.image_processing.image_statistics import NUM_COARSE_HISTOGRAM_BINS
+from pmc_turbo.camera.image_processing.preview_pyramid import (check_preview_factors, choose_preview_factor,
+                                                               make_preview_pyramid)
+from pmc_turbo.camera.pipeline.binary_index import (fill_frame_record, fill_statistics, index_record_dtype,
+                                                    percentiles_to_compute)
+from pmc_turbo.camera.pipeline.status_table import StatusTable, make_record_dtype
+from pmc_turbo.camera.pycamera.dtypes import chunk_num_bytes, chunk_dtype
+from pmc_turbo.camera.pycamera.geometry import full_frame_geometry
+
+logger = logging.getLogger(__name__)
+
+
+class FrameStage(object):
+    def __init__(self, name, decimation=1, min_interval=0, max_pending=1, poll_interval=0.01):
+        """
+        Parameters
+        ----------
+        name : str
+            Used for the status of the stage
+        decimation : int
+            Process every decimation-th frame
+        min_interval : float
+            Skip frames that arrive less than min_interval seconds after the last frame given to this stage
+        max_pending : int
+            Skip frames while this many frames are waiting for or being processed by this stage
+        poll_interval : float
+            Seconds to sleep when there is nothing to do
+        """
+        self.name = name
+        self.decimation = decimation
+        self.min_interval = min_interval
+        self.max_pending = max_pending
+        self.poll_interval = poll_interval
+        self.input_ring = None
+        self.consumer_index = None
+        self.geometry = full_frame_geometry
+        self.status = None
+        self.tuning = None
+        self.child = None
+
+    def attach(self, input_ring, consumer_index, status, geometry):
+        """
+        Called by BasicPipeline to connect the stage to the frame ring once the ring has been allocated
+        """
+        self.input_ring = input_ring
+        self.consumer_index = consumer_index
+        self.geometry = geometry
+        self.status = status
+        self.status.value = "starting"
+        self.child = mp.Process(target=self.run)
+
+    def setup(self):
+        """
+        Called in the child process before the first frame
+        """
+        pass
+
+    def process_frame(self, image, chunk_data, frame_info):
+        """
+        Process one frame. The arrays refer directly to the shared frame slot, so copy anything that is needed after
+        returning.
+
+        Parameters
+        ----------
+        image : uint16 array with the shape of the frame geometry
+        chunk_data : chunk_dtype record
+        frame_info : frame_info_dtype record
+
+        The base stage does nothing with the frame.
+        """
+        pass
+
+    def run(self):
+        if self.tuning is not None:
+            self.tuning.apply()
+        self.setup()
+        while not self.input_ring.exit_requested:
+            slot = self.input_ring.get_next_filled(self.consumer_index)
+            if slot is None:
+                self.status.value = "waiting"
+                time.sleep(self.poll_interval)
+                continue
+            self.status.value = "processing %d" % slot
+            payload = self.input_ring.get_slot_buffer(slot)[:self.geometry.payload_size]
+            image = payload[:self.geometry.image_num_bytes].view('uint16').reshape(self.geometry.image_shape)
+            chunk_data = payload[-chunk_num_bytes:].view(chunk_dtype)[0]
+            try:
+                self.process_frame(image, chunk_data, self.input_ring.get_slot_info(slot)[0])
+            except Exception:
+                logger.exception("Stage %s failed to process frame in slot %d" % (self.name, slot))
+            finally:
+                self.input_ring.release(slot, self.consumer_index)
+        self.status.value = "exiting"
+        return None
+
+
+latest_frame_statistics_dtype = make_record_dtype([('frame_id', np.uint64),
+                                                   ('percentiles', np.float64, (len(percentiles_to_compute),)),
+                                                   ('mean', np.float64),
+                                                   ('saturated_pixels', np.uint64),
+                                                   ('coarse_histogram', np.uint64, (NUM_COARSE_HISTOGRAM_BINS,))])
+
+
+PREVIEW_FIELD_PREFIX = 'preview_'
+
+
+def _preview_field(factor):
+    return PREVIEW_FIELD_PREFIX + str(factor)
+
+
+def _latest_frame_sections(geometry, preview_factors, num_statistics_rows):
+    image_fields = [('image', np.uint16, geometry.image_shape)]
+    image_fields += [(_preview_field(factor), np.uint16, (geometry.height // factor, geometry.width // factor))
+                     for factor in preview_factors]
+    return [('record', make_record_dtype([('frame', index_record_dtype)]), 1),
+            ('image', make_record_dtype(image_fields), 1),
+            ('statistics', latest_frame_statistics_dtype, num_statistics_rows)]
+
+
+class LatestFrameTap(FrameStage):
+    def __init__(self, filename, decimation=1, min_interval=0, preview_factors=None, hot_pixels=None, **kwargs):
+        """
+        Keep the most recent frame and its index record in a shared memory file
+
+        The 'statistics' section of the file has a row for each consumer of the frame ring. Compressor k posts the
+        statistics of each frame it compresses to row k with post_statistics.
+
+        Parameters
+        ----------
+        filename : str
+            Usually in /dev/shm
+        decimation : int
+        min_interval : float
+        preview_factors : list of int
+            Binning factors of the previews to keep with the frame, None or empty for no previews
+        hot_pixels : array of (row, column)
+            Hot pixels to mask in the previews
+        """
+        super(LatestFrameTap, self).__init__(name='latest frame', decimation=decimation, min_interval=min_interval,
+                                             **kwargs)
+        self.filename = filename
+        if preview_factors is None:
+            preview_factors = []
+        check_preview_factors(preview_factors)
+        self.preview_factors = preview_factors
+        if hot_pixels is None:
+            hot_pixels = []
+        self.hot_pixels = hot_pixels
+        self.hot_pixel_masker = None
+        self.table = None
+
+    def attach(self, input_ring, consumer_index, status, geometry):
+        super(LatestFrameTap, self).attach(input_ring, consumer_index, status, geometry)
+        self.table = StatusTable(self.filename, _latest_frame_sections(geometry, self.preview_factors,
+                                                                       input_ring.num_consumers))
+
+    def setup(self):
+        self.hot_pixel_masker = HotPixelMasker(hot_pixels_for_geometry(self.hot_pixels, self.geometry),
+                                               image_shape=self.geometry.image_shape)
+
+    def process_frame(self, image, chunk_data, frame_info):
+        levels = []
+        if self.preview_factors:
+            levels = make_preview_pyramid(image, self.preview_factors, hot_pixel_masker=self.hot_pixel_masker)
+        record = np.zeros((1,), dtype=index_record_dtype)
+        # The statistics are added by the reader once the compressor has posted them
+        fill_frame_record(record, frame_info, chunk_data, statistics=None, geometry=self.geometry)
+        # The frame has not been written yet, so file_index and filename are left empty
+        record['write_timestamp'] = time.time()
+        # The image and record are published together by bumping both sequences around the copy. Readers check both.
+        image_record = self.table.sections['image'][0:1]
+        frame_record = self.table.sections['record'][0:1]
+        image_record['sequence'] += 1
+        frame_record['sequence'] += 1
+        image_record['image'][0] = image
+        for factor, level in zip(self.preview_factors, levels):
+            image_record[_preview_field(factor)][0] = level
+        frame_record['frame'] = record
+        frame_record['sequence'] += 1
+        image_record['sequence'] += 1
+
+
+def post_statistics(table, row, frame_id, statistics):
+    """
+    Post the statistics of a frame to a LatestFrameTap
+
+    Parameters
+    ----------
+    table : StatusTable
+        The table attribute of the tap
+    row : int
+        Consumer index of the caller in the frame ring
+    frame_id : int
+    statistics : dict from compute_frame_statistics
+    """
+    table.update('statistics', row, frame_id=frame_id, **statistics)
+
+
+class LatestFrameReader(object):
+    def __init__(self, filename):
+        """
+        Read the frame kept by a LatestFrameTap, possibly in another process
+        """
+        self.filename = filename
+        self.table = None
+        self.inode = None
+
+    def open_table(self):
+        inode = os.stat(self.filename).st_ino
+        if inode != self.inode:
+            # The tap replaces the file when the pipeline restarts
+            self.table = StatusTable.open(self.filename)
+            self.inode = inode
+
+    def get_sequence(self):
+        """
+        Return a number that changes whenever the tap copies a new frame, 0 if it has not seen a frame yet, without
+        copying the frame
+        """
+        self.open_table()
+        return int(self.table.sections['image']['sequence'][0]) // 2 * 2
+
+    def read(self, field='image', max_tries=1000):
+        """
+        Parameters
+        ----------
+        field : str
+            'image' for the full frame, or the field of a preview level, see read_preview
+
+        Returns
+        -------
+        image : uint16 array
+        record : index_record_dtype record describing the frame. The statistics are zero if no compressor has
+            posted them for the frame, which is the case while writing is disabled since the compressors then skip
+            the frames.
+
+        or None if the tap has not seen a frame yet
+        """
+        self.open_table()
+        image_records = self.table.sections['image']
+        frame_records = self.table.sections['record']
+        for attempt in xrange(max_tries):
+            sequence = image_records['sequence'][0]
+            if sequence == 0:
+                return None
+            if sequence % 2 == 0 and frame_records['sequence'][0] == sequence:
+                image = image_records[field][0].copy()
+                record = frame_records['frame'][0].copy()
+                if image_records['sequence'][0] == sequence:
+                    self.add_statistics(record)
+                    return image, record
+            time.sleep(0.001)
+        raise RuntimeError("Could not get a consistent read of the latest frame")
+
+    def read_preview(self, scale_by):
+        """
+        Read the preview level of the latest frame best suited to making an image scaled by *scale_by*, copying only
+        that level
+
+        Returns
+        -------
+        factor : int
+        image : uint16 array binned by factor, with hot pixels masked
+        record : index_record_dtype record describing the frame, as from read
+
+        or None if the tap has not seen a frame yet or keeps no suitable preview
+        """
+        self.open_table()
+        factors = sorted([int(name[len(PREVIEW_FIELD_PREFIX):]) for name in self.table.sections['image'].dtype.names
+                          if name.startswith(PREVIEW_FIELD_PREFIX)])
+        factor = choose_preview_factor(factors, scale_by)
+        if factor is None:
+            return None
+        latest_frame = self.read(field=_preview_field(factor))
+        if latest_frame is None:
+            return None
+        image, record = latest_frame
+        return factor, image, record
+
+    def add_statistics(self, record):
+        """
+        Fill the statistics fields of *record* from those posted for its frame, if any
+
+        Returns
+        -------
+        bool : True if statistics were found
+        """
+        for row in xrange(self.table.sections['statistics'].shape[0]):
+            statistics = self.table.read('statistics', row)
+            # A sequence of 0 means the row has never been written
+            if statistics['sequence'] and statistics['frame_id'] == record['frame_id']:
+                fill_statistics(record, statistics)
+                return True
+        return False
@@ -0,0 +1,204 @@
+"""
+Shared memory table of pipeline status, readable by other processes on the same host without Pyro.
+
+The table is a file in /dev/shm holding a fixed schema: a number of named sections, each an array of records. The file
+starts with a header like the binary index:
+
+    magic (8 bytes), header length (little endian uint32), JSON encoded {section: [numpy dtype description, rows]},
+    padding
+
+followed by the records of each section in the order given in the header. Every record starts with a sequence
+number, and each record is only ever written by one process. Writers use a sequence lock: the sequence is incremented
+to an odd value before updating the record and to an even value afterwards. Readers copy a record and retry if the
+sequence was odd or changed during the copy, so they never see a half written record and never block the writer.
+
+Readers in other processes use StatusTable.open, which maps the file read only, or a StatusTableReader, which opens the
+table again whenever the file is replaced.
+"""
+import json
+import logging
+import multiprocessing.util
+import os
+import struct
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STATUS_TABLE_MAGIC = 'PMCSTATS'
+header_length_format = '<I'
+header_prefix_num_bytes = len(STATUS_TABLE_MAGIC) + struct.calcsize(header_length_format)
+HEADER_ALIGNMENT = 512
+
+STATUS_NUM_CHARACTERS = 32
+process_status_dtype = np.dtype([('sequence', np.uint64),
+                                 ('name', 'S%d' % STATUS_NUM_CHARACTERS),
+                                 ('status', 'S%d' % STATUS_NUM_CHARACTERS),
+                                 ('updated_at', np.float64),
+                                 ('pid', np.int64),
+                                 ('cpus', 'S%d' % STATUS_NUM_CHARACTERS),
+                                 ('niceness', np.int64),
+                                 ('tuning_applied', np.bool_)])
+
+
+def make_record_dtype(fields):
+    """
+    Add the sequence number required by the table to a list of (name, type) fields
+    """
+    return np.dtype([('sequence', np.uint64)] + list(fields))
+
+
+def _description_to_json(sections):
+    return json.dumps([[name, [list(field) for field in dtype.descr], num_rows] for name, dtype, num_rows in sections])
+
+
+def _field_from_json(field):
+    name, field_type = field[:2]
+    if isinstance(field_type, list):
+        field_type = [_field_from_json(subfield) for subfield in field_type]
+    else:
+        field_type = str(field_type)
+    if len(field) > 2:
+        return str(name), field_type, tuple(field[2])
+    return str(name), field_type
+
+
+def _description_from_json(text):
+    return [(str(name), np.dtype([_field_from_json(field) for field in descr]), num_rows)
+            for name, descr, num_rows in json.loads(text)]
+
+
+class StatusTable(object):
+    def __init__(self, filename, sections):
+        """
+        Create the table file, replacing any existing one. Create the table before starting the processes that
+        update it.
+
+        Parameters
+        ----------
+        filename : str
+            Usually in /dev/shm
+        sections : list of (name, dtype, num_rows)
+            Record dtypes must start with a uint64 'sequence' field, see make_record_dtype
+        """
+        description = _description_to_json(sections)
+        header = STATUS_TABLE_MAGIC + struct.pack(header_length_format, len(description)) + description
+        header += '\x00' * (-len(header) % HEADER_ALIGNMENT)
+        num_bytes = len(header) + sum([dtype.itemsize * num_rows for _, dtype, num_rows in sections])
+        # Write to a temporary file and rename so readers never open a partially written table
+        temporary_filename = filename + '.new'
+        with open(temporary_filename, 'wb') as fh:
+            fh.write(header)
+            fh.truncate(num_bytes)
+        os.rename(temporary_filename, filename)
+        self._map(filename, sections, len(header), mode='r+')
+
+    @classmethod
+    def open(cls, filename):
+        """
+        Map an existing table read only
+        """
+        with open(filename, 'rb') as fh:
+            prefix = fh.read(header_prefix_num_bytes)
+            if len(prefix) < header_prefix_num_bytes or not prefix.startswith(STATUS_TABLE_MAGIC):
+                raise ValueError("%s is not a status table" % filename)
+            description_length, = struct.unpack(header_length_format, prefix[len(STATUS_TABLE_MAGIC):])
+            sections = _description_from_json(fh.read(description_length))
+        header_length = header_prefix_num_bytes + description_length
+        self = cls.__new__(cls)
+        self._map(filename, sections, header_length + (-header_length % HEADER_ALIGNMENT), mode='r')
+        return self
+
+    def _map(self, filename, sections, offset, mode):
+        self.filename = filename
+        self.section_names = [name for name, _, _ in sections]
+        self.sections = {}
+        for name, dtype, num_rows in sections:
+            self.sections[name] = np.memmap(filename, dtype=dtype, mode=mode, offset=offset, shape=(num_rows,))
+            offset += dtype.itemsize * num_rows
+
+    def update(self, section, row, **values):
+        """
+        Set fields of one record. Only the process that owns the record may call this.
+        """
+        record = self.sections[section][row:row + 1]
+        record['sequence'] += 1
+        for key, value in values.items():
+            record[key] = value
+        record['sequence'] += 1
+
+    def read(self, section, row, max_tries=1000):
+        """
+        Return a consistent copy of one record
+        """
+        records = self.sections[section]
+        for attempt in xrange(max_tries):
+            sequence = records['sequence'][row]
+            if sequence % 2 == 0:
+                record = records[row].copy()
+                if records['sequence'][row] == sequence:
+                    return record
+            time.sleep(0)
+        raise RuntimeError("Could not get a consistent read of %s record %d" % (section, row))
+
+    def read_section(self, section):
+        return [self.read(section, row) for row in range(self.sections[section].shape[0])]
+
+    def get_status_value(self, row):
+        return StatusValue(self, row)
+
+
+class StatusValue(object):
+    def __init__(self, table, row):
+        """
+        One row of the processes section, used by a process to report what it is doing
+
+        This is a drop in replacement for a multiprocessing.Array of characters: assign a string to the value
+        attribute to update the status.
+        """
+        self.table = table
+        self.row = row
+        self.pid = os.getpid()
+        # Status values are created before the processes that use them are started
+        multiprocessing.util.register_after_fork(self, StatusValue._update_pid)
+
+    def _update_pid(self):
+        self.pid = os.getpid()
+
+    @property
+    def value(self):
+        return self.table.read('processes', self.row)['status']
+
+    @value.setter
+    def value(self, status):
+        self.table.update('processes', self.row, status=status, updated_at=time.time(), pid=self.pid)
+
+    def report_tuning(self, cpus, niceness, tuning_applied):
+        """
+        Record the cores and niceness the process is running with, and whether the requested settings were applied
+        (see process_tuning.py)
+        """
+        self.table.update('processes', self.row, cpus=cpus, niceness=niceness, tuning_applied=tuning_applied)
+
+
+class StatusTableReader(object):
+    def __init__(self, filename):
+        """
+        Read a table that may be replaced by its creator, as BasicPipeline does whenever it starts
+        """
+        self.filename = filename
+        self.table = None
+        self.inode = None
+
+    def get_table(self):
+        """
+        Return the table, opened again if the file has been replaced since the last call
+
+        Raises IOError or OSError if the file does not exist and ValueError if it is not a status table.
+        """
+        inode = os.stat(self.filename).st_ino
+        if inode != self.inode:
+            self.table = StatusTable.open(self.filename)
+            self.inode = inode
+        return self.table
@@ -0,0 +1,27 @@
+from pmc_turbo.camera.pipeline.acquire_images import coalesce_commands, next_command_batch
+
+
+def test_coalesce_commands():
+    superseded = {}
+    commands = [('ExposureTimeAbs', '1000', 1), ('EFLensFocusCurrent', '2000', 2), ('ExposureTimeAbs', '2000', 3),
+                ('EFLensFocusCurrent', '2010', 4), ('EFLensInitialize', None, 5)]
+    remaining = coalesce_commands(commands, ['ExposureTimeAbs'], superseded)
+    assert remaining == commands[1:]
+    assert superseded == {3: [1]}
+    remaining = coalesce_commands(remaining + [('ExposureTimeAbs', '3000', 6)], ['ExposureTimeAbs'], superseded)
+    assert [tag for _, _, tag in remaining] == [2, 4, 5, 6]
+    assert superseded == {6: [3, 1]}
+
+
+def test_next_command_batch():
+    commands = [('ExposureTimeAbs', '1000', 1), ('Gain', '2', 2), ('EFLensFocusCurrent', '2000', 3),
+                ('EFLensFocusCurrent', '2010', 4), ('Gain', '3', 5)]
+    batch, remaining = next_command_batch(commands, max_commands=10)
+    assert batch == commands[:3]
+    assert remaining == commands[3:]
+    batch, remaining = next_command_batch(remaining, max_commands=10)
+    assert batch == commands[3:]
+    assert remaining == []
+    batch, remaining = next_command_batch(commands, max_commands=2)
+    assert batch == commands[:2]
+    assert next_command_batch([], max_commands=2) == ([], [])
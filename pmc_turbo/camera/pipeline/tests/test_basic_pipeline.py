@@ -1,3 +1,4 @@
+import os
 import shutil
 import tempfile
 import threading
@@ -5,7 +6,11 @@ import time
 
 from nose.tools import timed
 
+from pmc_turbo.camera.image_processing import container_file
+from pmc_turbo.camera.image_processing.blosc_file import load_blosc_image
 from pmc_turbo.camera.pipeline import basic_pipeline
+from pmc_turbo.camera.pipeline.binary_index import BinaryIndexReader
+from pmc_turbo.camera.pipeline.write_images import index_file_name
 from pmc_turbo.utils.tests import test_config
 harness = test_config.BasicTestHarness()
 harness.setup()
@@ -27,11 +32,20 @@ def test_pipeline_runs():
     thread.daemon=True
     thread.start()
     time.sleep(1)
-    bpl.get_status()
+    status = bpl.get_status()
+    assert 'total' in status['latency']
+    assert status['acquire tuning applied']
+    assert status['acquire cpus']
+    assert not status['frame buffers locked']
     tag = bpl.send_camera_command("ExposureTimeAbs","10000")
     name,value,result,gate_time = bpl.send_camera_command_get_result("ExposureTimeAbs","1000",timeout=5)
     name,value,result,gate_time = bpl.get_camera_command_result(tag)
+    name,value,result,gate_time = bpl.send_camera_command_get_result("AcquisitionFrameCount","2",timeout=5)
+    assert result == 0
+    name,value,result,gate_time = bpl.send_camera_command_get_result("AcquisitionFrameCount","1000",timeout=5)
+    assert result != 0
     time.sleep(1)
+    assert bpl.get_status()['burst_frame_count'] == 2
     bpl.close()
 
 @timed(20)
@@ -48,6 +62,59 @@ def test_pipeline_runs_no_disk():
     time.sleep(1)
     bpl.close()
 
+@timed(20)
+def test_commands_batched_per_gate():
+    config = basic_config.copy()
+    bpl = basic_pipeline.BasicPipeline(config=config)
+    bpl.initialize()
+    thread = threading.Thread(target=bpl.run_pyro_loop)
+    thread.daemon=True
+    thread.start()
+    time.sleep(1)
+    tags = [bpl.send_camera_command(name, value) for name, value in [("ExposureTimeAbs", "1000"), ("Gain", "2"),
+                                                                       ("ExposureTimeAbs", "2000"),
+                                                                       ("EFLensFocusCurrent", "2000"),
+                                                                       ("EFLensFocusCurrent", "2010")]]
+    results = {}
+    start = time.time()
+    while len(results) < len(tags) and time.time() - start < 10:
+        for tag in tags:
+            try:
+                results[tag] = bpl.get_camera_command_result(tag)
+            except KeyError:
+                pass
+        time.sleep(0.1)
+    bpl.close()
+    exposure, gain, superseded_exposure, focus, next_focus = [results[tag] for tag in tags]
+    assert exposure == superseded_exposure == ("ExposureTimeAbs", "2000", 0, exposure[3])
+    assert gain[3] == exposure[3] == focus[3]
+    assert next_focus[3] > focus[3]
+
+@timed(20)
+def test_pipeline_writes_segments():
+    config = basic_config.copy()
+    config.BasicPipeline.default_write_enable=1
+    config.BasicPipeline.container_segment_size=2**20
+    bpl = basic_pipeline.BasicPipeline(config=config)
+    bpl.initialize()
+    thread = threading.Thread(target=bpl.run_pyro_loop)
+    thread.daemon=True
+    thread.start()
+    time.sleep(2)
+    bpl.close()
+    references = []
+    for writer in bpl.writers:
+        for dirname in writer.output_dirs:
+            references.extend(BinaryIndexReader(os.path.join(dirname, index_file_name)).records['filename'])
+    assert references
+    assert all([container_file.is_reference(reference) for reference in references])
+    image, chunk = load_blosc_image(references[-1])
+    assert image.shape == bpl.geometry.image_shape
+
+def test_burst_num_data_buffers():
+    assert basic_pipeline.burst_num_data_buffers(1, num_compressors=4) == 5
+    assert basic_pipeline.burst_num_data_buffers(20, num_compressors=4, stage_max_pending=1) == 25
+
 if __name__ == "__main__":
     import pmc_turbo.utils.log
     import logging
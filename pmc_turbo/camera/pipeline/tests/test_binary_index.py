@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from pmc_turbo.camera.pipeline import binary_index
+from pmc_turbo.camera.pipeline.indexer import MergedIndex
+
+
+class TestBinaryIndex(object):
+    def setup(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.temp_dir, 'index.bin')
+
+    def teardown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_records(self, writer, start, stop):
+        for k in range(start, stop):
+            record = writer.new_record()
+            record['file_index'] = k
+            record['frame_timestamp_ns'] = 1000 * k
+            record['filename'] = '/data/frame_%d' % k
+            record['percentile_100'] = k / 2.
+            writer.append(record)
+
+    def test_write_and_read(self):
+        writer = binary_index.BinaryIndexWriter(self.filename, flush_interval=100, flush_records=4)
+        self.write_records(writer, 0, 3)
+        reader = binary_index.BinaryIndexReader(self.filename)
+        assert len(reader) == 0  # not flushed yet
+        self.write_records(writer, 3, 10)
+        assert reader.update() == 8
+        writer.close()
+        assert reader.update() == 10
+        assert reader.records['filename'][9] == '/data/frame_9'
+        assert reader.search_timestamp(4500) == 5
+        df = reader.to_dataframe(start=8)
+        assert list(df.columns) == binary_index.index_keys
+        assert list(df.file_index) == [8, 9]
+
+    def test_flush_interval(self):
+        writer = binary_index.BinaryIndexWriter(self.filename, flush_interval=0, flush_records=100)
+        self.write_records(writer, 0, 2)
+        assert binary_index.BinaryIndexReader(self.filename).update() == 2
+
+    def test_export_csv(self):
+        writer = binary_index.BinaryIndexWriter(self.filename)
+        self.write_records(writer, 0, 5)
+        writer.close()
+        csv_filename = os.path.join(self.temp_dir, 'index.csv')
+        binary_index.export_csv(self.filename, csv_filename)
+        df = pd.read_csv(csv_filename)
+        assert list(df.columns) == binary_index.index_keys
+        assert np.all(df.percentile_100 == np.arange(5) / 2.)
+
+    def test_merged_index(self):
+        subdir = os.path.join(self.temp_dir, 'data1', '2017-01-01_000000')
+        os.makedirs(subdir)
+        writer = binary_index.BinaryIndexWriter(os.path.join(subdir, 'index.bin'), flush_records=1)
+        self.write_records(writer, 0, 5)
+        mi = MergedIndex('*', data_dirs=[os.path.join(self.temp_dir, 'data1')])
+        assert mi.get_latest()['frame_timestamp_ns'] == 4000
+        self.write_records(writer, 5, 7)
+        assert mi.get_latest()['frame_timestamp_ns'] == 6000
+        assert mi.df.shape[0] == 7
+        writer.close()
@@ -12,8 +12,10 @@ import pandas as pd
 
 import pmc_turbo.camera.pipeline.indexer
 import pmc_turbo.communication.file_format_classes
+from pmc_turbo.camera.image_processing.blosc_file import write_image_blosc
 from pmc_turbo.camera.pipeline import basic_pipeline
 from pmc_turbo.camera.pipeline import controller
+from pmc_turbo.camera.pycamera.dtypes import chunk_dtype, image_dimensions
 from pmc_turbo.communication.file_format_classes import decode_file_from_buffer, GeneralFile, JPEGFile, ShellCommandFile
 
 from pmc_turbo.utils.tests.test_config import BasicTestHarness
@@ -54,6 +56,7 @@ class TestMultiIndex(BasicTestHarness):
                         os.path.join(data_dir, self.subdir, 'index.csv'))
 
     def teardown(self):
+        self.controller_no_pipeline.close()
         super(TestMultiIndex,self).teardown()
         shutil.rmtree(self.top_dir, ignore_errors=True)
 
@@ -144,13 +147,17 @@ class TestMultiIndex(BasicTestHarness):
 
         with assert_raises(IndexError):
             sis.request_image_by_index(200, request_id=128)
-        sis.request_image_by_index(2,request_id=128)
+        job_id = sis.request_image_by_index(2,request_id=128)
+        assert sis.render_pool.wait_until_idle(timeout=10)
+        assert sis.get_render_job_status(job_id)['state'] == 'done'
+        assert sis.get_render_job_status(job_id)['num_files'] == 1
         result = sis.get_next_data_for_downlink()
         result = decode_file_from_buffer(result)
         assert result.request_id == 128
 
         #sis.request_image_by_index(2, request_id=129)
         sis.request_image_by_index(2,request_id=129)
+        assert sis.render_pool.wait_until_idle(timeout=10)
         result2 = sis.get_next_data_for_downlink()
         result2 = decode_file_from_buffer(result2)
         for attr in dir(result):
@@ -163,11 +170,86 @@ class TestMultiIndex(BasicTestHarness):
                 print attr, getattr(result, attr), getattr(result2, attr)
                 assert False
 
+        for request_id in [130, 131]:
+            sis.request_image_by_index(2, request_id=request_id, num_rows=256, num_columns=256, scale_by=1)
+            assert sis.render_pool.wait_until_idle(timeout=10)
+            assert decode_file_from_buffer(sis.get_next_data_for_downlink()).request_id == request_id
+        frame_cache_status = sis.get_status()['frame cache']
+        assert frame_cache_status['misses'] == 1
+        assert frame_cache_status['hits'] == 1
+
         result = sis.get_latest_jpeg(request_id=999)
+        sis.close()
 
         bpl.close()
         time.sleep(1)
 
+    def test_standard_image_sent_once_per_frame(self):
+        config = copy.deepcopy(self.basic_config)
+        config.Controller.standard_image_poll_interval = 0
+        sis = controller.Controller(pipeline=None, config=config)
+        frame = [1]
+        renders = []
+
+        class StandardImage(object):
+            def to_buffer(self):
+                renders.append(frame[0])
+                return 'standard image of frame %d' % frame[0]
+
+        sis.get_latest_frame_key = lambda: frame[0]
+        sis.get_latest_standard_image = StandardImage
+        assert sis.get_next_data_for_downlink() == 'standard image of frame 1'
+        assert sis.get_next_data_for_downlink() is None
+        frame[0] = 2
+        assert sis.get_next_data_for_downlink() == 'standard image of frame 2'
+        sis.resend_standard_images = True
+        assert sis.get_next_data_for_downlink() == 'standard image of frame 2'
+        assert renders == [1, 2]
+        sis.close()
+
+    def test_retry_rejected_command_image(self):
+        class Pipeline(object):
+            def get_camera_command_result(self, tag):
+                raise KeyError(tag)
+
+        class Index(object):
+            df = pd.DataFrame(dict(frame_timestamp_ns=[int(100e9)]))
+
+            def get_index_of_timestamp(self, timestamp):
+                return 0
+
+        sis = controller.Controller(pipeline=Pipeline(), config=self.basic_config)
+        sis.merged_index = Index()
+        requests = []
+
+        def request_image_by_index(index, **kwargs):
+            requests.append(kwargs['request_id'])
+            if len(requests) == 1:
+                raise RuntimeError("Render queue is full")
+
+        sis.request_image_by_index = request_image_by_index
+        sis.outstanding_command_tags[1.0] = dict(request_id=7)
+        sis.completed_command_tags[1.0] = ('ExposureTimeAbs', '1000', 0, 100.0)
+        sis.check_for_completed_commands()
+        assert 1.0 in sis.outstanding_command_tags
+        sis.check_for_completed_commands()
+        assert requests == [7, 7]
+        assert sis.outstanding_command_tags == {}
+        assert sis.completed_command_tags == {}
+        sis.close()
+
+    def test_load_frame_region(self):
+        image = np.random.RandomState(0).randint(0, 2 ** 14, size=image_dimensions).astype('uint16')
+        data = image.tostring() + np.zeros((1,), dtype=chunk_dtype).tostring()
+        filename = os.path.join(self.top_dir, 'banded_frame')
+        write_image_blosc(filename, data, band_rows=64)
+        sis = self.controller_no_pipeline
+        region = sis.load_frame_region(filename, row_offset=1000, column_offset=2000, num_rows=100, num_columns=50)
+        assert np.all(region == sis.hot_pixel_masker.process(image)[1000:1101, 2000:2051])
+        write_image_blosc(filename, data)
+        assert sis.load_frame_region(filename, row_offset=1000, column_offset=2000, num_rows=100,
+                                     num_columns=50) is None
+
     def test_full_file_access(self):
 
         self.controller_no_pipeline.request_specific_file(self.general_filename, 2 ** 20, 123)
@@ -202,6 +284,17 @@ class TestMultiIndex(BasicTestHarness):
         self.controller_no_pipeline.request_specific_file(filename="doesnt_exist", max_num_bytes=2 ** 20,
                                                           request_id=123)
 
+    def test_command_replies_sent_first(self):
+        self.controller_no_pipeline.request_specific_file(self.general_filename, 2 ** 20, 123)
+        self.controller_no_pipeline.request_specific_file(self.general_filename, 16, 125)
+        self.controller_no_pipeline.run_shell_command(command_line="true", max_num_bytes_returned=100,
+                                                      request_id=124, timeout=10.0)
+        assert self.controller_no_pipeline.get_downlink_queue_depths() == dict(urgent=1, requested=2, standard=0)
+        assert self.controller_no_pipeline.cancel_request(123) == 1
+        buffers = [self.controller_no_pipeline.get_next_data_for_downlink() for k in range(2)]
+        assert [decode_file_from_buffer(buffer).request_id for buffer in buffers] == [124, 125]
+        assert self.controller_no_pipeline.get_downlink_queue_depth() == 0
+
     def test_simple_shell_command(self):
         self.controller_no_pipeline.run_shell_command(command_line="ls -lhtr", max_num_bytes_returned=int(1e6),
                                                       request_id=124, timeout=10.0)
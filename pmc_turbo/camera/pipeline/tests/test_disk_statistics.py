@@ -0,0 +1,60 @@
+import ctypes
+import multiprocessing as mp
+
+from pmc_turbo.camera.pipeline import disk_statistics
+from pmc_turbo.camera.pipeline.compress_images import CompressImageProcess, compressed_frame_info_dtype
+from pmc_turbo.camera.pipeline.frame_ring import FrameRing
+
+
+def test_moving_average_and_back_off():
+    stats = disk_statistics.DiskStatistics(num_disks=2, smoothing=0.5, max_write_time=1.0, initial_backoff=1.0,
+                                           max_backoff=3.0)
+    stats.record_write(0, duration=0.1, num_bytes=1e6, bytes_free=10 ** 12, now=0)
+    stats.record_write(0, duration=0.3, num_bytes=1e6, bytes_free=10 ** 12, now=1)
+    assert abs(stats.table['write_time'][0] - 0.2) < 1e-9
+    assert not stats.is_degraded(0, now=1)
+
+    stats.record_failure(0, now=10)
+    assert stats.is_degraded(0, now=10.5)
+    assert not stats.is_degraded(0, now=11.5)
+    stats.record_failure(0, now=12)
+    assert stats.is_degraded(0, now=13.5)
+    stats.record_failure(0, now=14)
+    assert stats.table['degraded_until'][0] == 17  # limited by max_backoff
+
+    # the first write after backing off replaces the old average
+    stats.record_write(0, duration=0.5, num_bytes=1e6, bytes_free=10 ** 12, now=20)
+    assert stats.table['write_time'][0] == 0.5
+    assert not stats.is_degraded(0, now=20)
+
+    stats.record_write(1, duration=5, num_bytes=1e6, bytes_free=10 ** 12, now=0)
+    assert stats.is_degraded(1, now=0.5)
+    assert stats.get_status()['disk 0 failures'] == 3
+
+
+def make_compressor(num_writers, stats):
+    rings = [FrameRing(num_slots=2, slot_size=16, num_consumers=num_writers, info_dtype=compressed_frame_info_dtype)]
+    write_enables = [mp.Value(ctypes.c_int32, 1) for k in range(num_writers)]
+    return CompressImageProcess(input_ring=FrameRing(num_slots=2, slot_size=16, num_consumers=1), consumer_index=0,
+                                output_ring=rings[0], writer_rings=rings, write_enables=write_enables,
+                                disk_statistics=stats, status=mp.Array(ctypes.c_char, 32))
+
+
+def test_choose_writer():
+    stats = disk_statistics.DiskStatistics(num_disks=3)
+    compressor = make_compressor(3, stats)
+    # with no measurements the writers are used in turn
+    assert [compressor.choose_writer() for k in range(3)] == [0, 1, 2]
+
+    stats.record_write(0, duration=0.5, num_bytes=1e6, bytes_free=10 ** 12)
+    stats.record_write(1, duration=0.1, num_bytes=1e6, bytes_free=10 ** 12)
+    stats.record_write(2, duration=0.1, num_bytes=1e6, bytes_free=10 ** 6)
+    assert compressor.choose_writer() == 1
+    assert compressor.choose_writer(exclude=1) == 0  # disk 2 is low on space
+
+    stats.record_failure(1)
+    stats.record_failure(0)
+    assert compressor.choose_writer() == 2
+    compressor.write_enables[2].value = 0
+    # degraded disks are still used rather than dropping frames
+    assert compressor.choose_writer() in [0, 1]
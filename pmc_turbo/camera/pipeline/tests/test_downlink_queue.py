@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+
+from pmc_turbo.camera.pipeline.downlink_queue import (DownlinkQueue, PRIORITY_URGENT, PRIORITY_REQUESTED,
+                                                      PRIORITY_STANDARD)
+
+
+def drain(queue):
+    result = []
+    while True:
+        buffer = queue.pop()
+        if buffer is None:
+            return result
+        result.append(buffer)
+
+
+class TestDownlinkQueue(object):
+    def setup(self):
+        self.spill_dir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.spill_dir)
+
+    def test_priority_order(self):
+        queue = DownlinkQueue()
+        queue.put('standard', PRIORITY_STANDARD, request_id=1)
+        queue.put('requested', PRIORITY_REQUESTED, request_id=2)
+        queue.put('urgent', PRIORITY_URGENT, request_id=3)
+        assert queue.get_depths() == dict(urgent=1, requested=1, standard=1)
+        assert drain(queue) == ['urgent', 'requested', 'standard']
+        assert len(queue) == 0
+
+    def test_requests_take_turns(self):
+        queue = DownlinkQueue()
+        for k in range(3):
+            queue.put('a%d' % k, request_id=1)
+        queue.put('b0', request_id=2)
+        queue.put('a3', request_id=1)
+        queue.put('c0', request_id=3)
+        assert drain(queue) == ['a0', 'b0', 'c0', 'a1', 'a2', 'a3']
+
+    def test_spill_to_disk(self):
+        queue = DownlinkQueue(max_memory_bytes=10, spill_dir=self.spill_dir, max_spill_bytes=20)
+        queue.put('x' * 8, request_id=1)
+        queue.put('y' * 8, request_id=1)
+        queue.put('z' * 8, request_id=1)
+        queue.put('dropped', request_id=1)
+        queue.put('urgent' * 4, PRIORITY_URGENT)
+        status = queue.get_status()
+        assert status['spilled'] == 2
+        assert status['dropped'] == 1
+        assert status['memory_bytes'] == 8 + 24
+        assert len(os.listdir(self.spill_dir)) == 2
+        assert drain(queue) == ['urgent' * 4, 'x' * 8, 'y' * 8, 'z' * 8]
+        assert os.listdir(self.spill_dir) == []
+        status = queue.get_status()
+        assert status['memory_bytes'] == 0 and status['spill_bytes'] == 0
+
+    def test_cancel(self):
+        queue = DownlinkQueue(max_memory_bytes=4, spill_dir=self.spill_dir)
+        queue.put('a0', request_id=1)
+        queue.put('b0', request_id=2)
+        queue.put('a1', request_id=1)
+        queue.put('a2', PRIORITY_STANDARD, request_id=1)
+        assert queue.cancel(1) == 3
+        assert os.listdir(self.spill_dir) == []
+        assert drain(queue) == ['b0']
+        assert queue.get_status()['memory_bytes'] == 0
+
+    def test_prioritize_request(self):
+        queue = DownlinkQueue()
+        queue.put('urgent', PRIORITY_URGENT)
+        for k in range(2):
+            queue.put('a%d' % k, request_id=1)
+        queue.put('b0', request_id=2)
+        assert queue.set_request_priority(2, PRIORITY_URGENT) == 1
+        # Files of the request queued later follow it to its new class
+        queue.put('b1', PRIORITY_STANDARD, request_id=2)
+        assert queue.get_depths() == dict(urgent=3, requested=2, standard=0)
+        assert drain(queue) == ['urgent', 'b0', 'b1', 'a0', 'a1']
+
+    def test_clear(self):
+        queue = DownlinkQueue(max_memory_bytes=2, spill_dir=self.spill_dir)
+        queue.put('a0', request_id=1)
+        queue.put('a1', request_id=1)
+        assert queue.clear() == 2
+        assert len(queue) == 0
+        assert os.listdir(self.spill_dir) == []
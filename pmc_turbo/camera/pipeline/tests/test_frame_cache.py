@@ -0,0 +1,47 @@
+import numpy as np
+
+from pmc_turbo.camera.pipeline.frame_cache import FrameCache
+
+
+def make_frame(value, num_pixels=1000):
+    return np.zeros((num_pixels,), dtype='uint16') + value, np.zeros((1,), dtype='uint8')
+
+
+def test_least_recently_used_evicted():
+    frame_num_bytes = sum([array.nbytes for array in make_frame(0)])
+    cache = FrameCache(max_num_bytes=3 * frame_num_bytes)
+    for k in range(3):
+        cache.put('frame_%d' % k, *make_frame(k))
+    assert cache.get('frame_0')[0][0] == 0
+    cache.put('frame_3', *make_frame(3))
+    assert cache.get('frame_1') is None
+    assert cache.get('frame_0') is not None
+    assert len(cache) == 3
+    status = cache.get_status()
+    assert status['num_bytes'] == 3 * frame_num_bytes
+    assert (status['hits'], status['misses'], status['evictions']) == (2, 1, 1)
+
+
+def test_budget_respected():
+    cache = FrameCache(max_num_bytes=5000)
+    cache.put('big', *make_frame(0, num_pixels=3000))
+    assert len(cache) == 0
+    cache.put('small', *make_frame(0, num_pixels=1500))
+    cache.put('small', *make_frame(1, num_pixels=1500))
+    assert cache.get_status()['num_bytes'] == 3001
+    cache.put('another', *make_frame(2, num_pixels=1500))
+    assert len(cache) == 1
+    assert cache.get_status()['num_bytes'] <= 5000
+
+
+def test_cached_frames_read_only():
+    cache = FrameCache(max_num_bytes=10000)
+    cache.put('frame', *make_frame(0))
+    image, chunk = cache.get('frame')
+    assert not image.flags.writeable
+
+
+def test_disabled():
+    cache = FrameCache(max_num_bytes=0)
+    cache.put('frame', *make_frame(0))
+    assert cache.get('frame') is None
@@ -0,0 +1,138 @@
+import multiprocessing as mp
+
+from nose.tools import timed
+
+from pmc_turbo.camera.pipeline import frame_ring
+
+
+def test_slot_life_cycle():
+    ring = frame_ring.FrameRing(num_slots=4, slot_size=16, num_consumers=2)
+    free = ring.get_free_slots()
+    assert free == [0, 1, 2, 3]
+    ring.mark_filling(0)
+    ring.mark_filling(1)
+    assert ring.get_free_slots() == [2, 3]
+    assert ring.count_slots(frame_ring.SLOT_FILLING) == 2
+
+    ring.publish(1, consumers=[0, 1])
+    ring.publish(0, consumers=[0])
+    assert ring.num_pending(0) == 2
+    assert ring.num_pending(1) == 1
+
+    # oldest published slot comes first
+    assert ring.get_next_filled(0) == 1
+    assert ring.get_next_filled(0) == 0
+    assert ring.get_next_filled(0) is None
+    ring.release(1, 0)
+    ring.release(0, 0)
+    assert 0 in ring.get_free_slots()
+    # slot 1 is still held by consumer 1
+    assert 1 not in ring.get_free_slots()
+    assert ring.get_next_filled(1) == 1
+    ring.release(1, 1)
+    assert ring.get_free_slots() == [0, 1, 2, 3]
+
+
+def test_least_loaded_consumer():
+    ring = frame_ring.FrameRing(num_slots=4, slot_size=16, num_consumers=2)
+    ring.mark_filling(0)
+    ring.publish(0, consumers=[ring.least_loaded_consumer()])
+    ring.mark_filling(1)
+    ring.publish(1, consumers=[ring.least_loaded_consumer()])
+    assert ring.num_pending(0) == 1
+    assert ring.num_pending(1) == 1
+    assert ring.least_loaded_consumer(candidates=[1]) == 1
+
+
+def test_deactivated_consumer():
+    ring = frame_ring.FrameRing(num_slots=2, slot_size=16, num_consumers=2)
+    ring.mark_filling(0)
+    ring.publish(0, consumers=[1])
+    ring.deactivate_consumer(1)
+    assert ring.least_loaded_consumer() == 0
+    # The pending slot is handed back for redispatch rather than dropped
+    assert ring.get_failed() == [(0, 1)]
+    assert ring.get_free_slots() == [1]
+    ring.redispatch(0, 1, ring.least_loaded_consumer(candidates=[0]))
+    assert ring.get_next_filled(0) == 0
+    ring.release(0, 0)
+    assert ring.get_free_slots() == [0, 1]
+    ring.deactivate_consumer(0)
+    assert ring.least_loaded_consumer() is None
+    ring.mark_filling(1)
+    ring.publish(1, consumers=[])
+    assert ring.get_free_slots() == [0, 1]
+
+
+def test_deactivate_hands_back_claimed_and_failed():
+    ring = frame_ring.FrameRing(num_slots=3, slot_size=16, num_consumers=2)
+    for slot in range(3):
+        ring.mark_filling(slot)
+        ring.publish(slot, consumers=[0])
+    assert ring.get_next_filled(0) == 0
+    ring.fail(0, 0)
+    assert ring.get_next_filled(0) == 1
+    ring.deactivate_consumer(0)
+    # The failed, claimed and pending slots are all left for the producer to redispatch
+    assert ring.get_failed() == [(0, 0), (1, 0), (2, 0)]
+    assert ring.get_free_slots() == []
+
+
+def consume_one(ring, consumer):
+    while True:
+        slot = ring.get_next_filled(consumer)
+        if slot is not None:
+            ring.get_slot_buffer(slot)[:] += 1
+            ring.release(slot, consumer)
+            return
+
+
+@timed(10)
+def test_shared_between_processes():
+    ring = frame_ring.FrameRing(num_slots=2, slot_size=16, num_consumers=1)
+    ring.mark_filling(1)
+    ring.get_slot_buffer(1)[:] = 41
+    ring.publish(1, consumers=[0])
+    child = mp.Process(target=consume_one, args=(ring, 0))
+    child.start()
+    child.join()
+    assert ring.get_free_slots() == [0, 1]
+    assert ring.get_slot_buffer(1)[0] == 42
+    ring.request_exit()
+    assert ring.exit_requested
+
+
+def test_failed_slot_redispatch():
+    ring = frame_ring.FrameRing(num_slots=2, slot_size=16, num_consumers=2)
+    ring.mark_filling(0)
+    ring.publish(0, consumers=[0])
+    assert ring.get_next_filled(0) == 0
+    ring.fail(0, 0)
+    assert ring.get_failed() == [(0, 0)]
+    assert 0 not in ring.get_free_slots()
+    ring.redispatch(0, 0, 1)
+    assert ring.get_failed() == []
+    assert ring.get_next_filled(1) == 0
+    ring.release(0, 1)
+    assert ring.get_free_slots() == [0, 1]
+
+    ring.mark_filling(1)
+    ring.publish(1, consumers=[1])
+    ring.fail(ring.get_next_filled(1), 1)
+    ring.redispatch(1, 1, None)
+    assert ring.get_free_slots() == [0, 1]
+
+
+@timed(10)
+def test_huge_pages_and_locking():
+    # Falls back to ordinary shared memory if no huge pages are reserved
+    ring = frame_ring.FrameRing(num_slots=2, slot_size=16, num_consumers=1, huge_pages=True)
+    assert ring.data.shape == (2, 16)
+    assert ring.lock_memory()
+    ring.mark_filling(1)
+    ring.get_slot_buffer(1)[:] = 41
+    ring.publish(1, consumers=[0])
+    child = mp.Process(target=consume_one, args=(ring, 0))
+    child.start()
+    child.join()
+    assert ring.get_slot_buffer(1)[0] == 42
@@ -0,0 +1,88 @@
+import glob
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from pmc_turbo.camera.pipeline import latency
+from pmc_turbo.camera.pipeline.frame_ring import frame_stamp_indexes, frame_stamp_names
+
+
+def test_histogram_percentiles():
+    values = np.random.RandomState(0).lognormal(mean=-4, sigma=1.5, size=10000)
+    histogram = latency.LatencyHistogram()
+    histogram.record(values[:5000])
+    histogram.record(values[5000:])
+    assert histogram.count == values.size
+    assert histogram.max == values.max()
+    assert np.allclose(histogram.summary()['mean'], values.mean())
+    for percentile in [1, 50, 90, 99, 100]:
+        expected = np.percentile(values, percentile, interpolation='higher')
+        assert abs(histogram.percentile(percentile) - expected) <= expected / 2 ** histogram.sub_bucket_bits + 1e-6
+
+
+def test_histogram_buckets():
+    histogram = latency.LatencyHistogram()
+    values = np.array([0, 3e-6, 31e-6, 32e-6, 1e-3, 0.7, 12.5, 1e5])
+    for value, index in zip(values, histogram.bucket_indexes(values)):
+        low, high = histogram.bucket_bounds(index)
+        assert low <= value * (1 + 1e-12) and value < high
+    assert histogram.bucket_indexes([1e12])[0] == histogram.counts.shape[0] - 1
+    histogram.reset()
+    assert np.isnan(histogram.percentile(50))
+
+
+def test_latency_log():
+    log = latency.LatencyLog(num_records=4)
+    stamps = np.arange(len(frame_stamp_names), dtype=np.float64)
+    for frame_id in range(3):
+        log.append(frame_id, 1, stamps + frame_id)
+    records, num_read, num_lost = log.read_new(0)
+    assert list(records['frame_id']) == [0, 1, 2]
+    assert np.all(records['stamps'][2] == stamps + 2)
+    assert (num_read, num_lost) == (3, 0)
+    for frame_id in range(3, 10):
+        log.append(frame_id, 1, stamps)
+    records, num_read, num_lost = log.read_new(num_read)
+    assert list(records['frame_id']) == [6, 7, 8, 9]
+    assert (num_read, num_lost) == (10, 3)
+    assert log.read_new(num_read)[0].shape[0] == 0
+
+
+class TestLatencyAggregator(object):
+    def setup(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_aggregate(self):
+        logs = [latency.LatencyLog(), latency.LatencyLog()]
+        aggregator = latency.LatencyAggregator(logs, housekeeping_dir=self.temp_dir, log_interval=0)
+        stamps = np.arange(1, len(frame_stamp_names) + 1, dtype=np.float64) * 0.1
+        logs[0].append(0, 0, stamps)
+        logs[1].append(1, 1, stamps * 2)
+        stamps[frame_stamp_indexes['exposure']] = 0
+        logs[1].append(2, 1, stamps)
+        status = aggregator.get_status()
+        assert status['compress']['count'] == 3
+        assert status['readout']['count'] == 2
+        assert status['total']['count'] == 2
+        assert status['disk 0 write']['count'] == 1
+        assert status['disk 1 write']['count'] == 2
+        assert np.allclose(status['disk 1 write']['max'], 0.2)
+        assert status['records lost'] == 0
+
+        aggregator.log_if_due()
+        logs[0].append(3, 0, stamps)
+        aggregator.log_if_due()
+        log_files = glob.glob(os.path.join(self.temp_dir, '*.csv'))
+        assert len(log_files) == 1
+        with open(log_files[0]) as fh:
+            lines = fh.readlines()
+        assert len(lines) == 3
+        columns = lines[0].strip().split(',')
+        second_entry = dict(zip(columns, lines[2].strip().split(',')))
+        assert second_entry['compress count'] == '1'
+        assert aggregator.get_status()['compress']['count'] == 4
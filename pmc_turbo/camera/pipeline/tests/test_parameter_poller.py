@@ -0,0 +1,57 @@
+from pmc_turbo.camera.pycamera.pycamera import PyCamera
+from pmc_turbo.camera.pipeline import parameter_poller
+from pmc_turbo.camera.pipeline.parameter_poller import ParameterPoller, get_parameter_tier
+
+
+class CountingCamera(object):
+    def __init__(self):
+        self.pc = PyCamera(use_simulated_camera=True)
+        self.parameter_names = self.pc.parameter_names
+        self.reads = []
+
+    def get_parameter(self, name):
+        self.reads.append(name)
+        return self.pc.get_parameter(name)
+
+    def set_parameter(self, name, value):
+        return self.pc.set_parameter(name, value)
+
+
+def test_get_parameter_tier():
+    assert get_parameter_tier('StatFrameDelivered') == parameter_poller.FAST
+    assert get_parameter_tier('PtpStatus') == parameter_poller.FAST
+    assert get_parameter_tier('DeviceTemperature') == parameter_poller.SLOW
+    assert get_parameter_tier('DeviceID') == parameter_poller.STATIC
+    assert get_parameter_tier('EFLensFocusMax') == parameter_poller.STATIC
+    assert get_parameter_tier('ExposureTimeAbs') == parameter_poller.SETTINGS
+
+
+def test_poll():
+    camera = CountingCamera()
+    poller = ParameterPoller(camera, fast_interval=1, slow_interval=10, settings_interval=60)
+    changed = poller.poll(now=1000)
+    assert set(poller.values) == set(camera.parameter_names)
+    assert set(changed) == set(camera.parameter_names)
+    assert 'main_temperature' in poller.temperatures
+
+    camera.reads = []
+    assert poller.poll(now=1000.5) == {}
+    assert camera.reads == []
+
+    camera.reads = []
+    poller.poll(now=1001)
+    assert set(camera.reads) == set([name for name in camera.parameter_names
+                                     if get_parameter_tier(name) == parameter_poller.FAST])
+    assert poller.read_at['StatFrameDelivered'] == 1001
+    assert poller.read_at['DeviceID'] == 1000
+
+    camera.set_parameter('ExposureTimeAbs', 1234)
+    poller.invalidate('ExposureTimeAbs')
+    changed = poller.poll(now=1001.1)
+    assert changed == {'ExposureTimeAbs': '1234'}
+
+    camera.reads = []
+    poller.poll(now=1070)
+    assert 'ExposureTimeAbs' in camera.reads
+    assert 'DeviceID' not in camera.reads
+    camera.pc._pc.quit()
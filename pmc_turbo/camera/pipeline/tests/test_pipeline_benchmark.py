@@ -0,0 +1,22 @@
+import json
+
+from nose.tools import timed
+
+from pmc_turbo.camera.pipeline.pipeline_benchmark import run_pipeline_benchmark
+from pmc_turbo.utils.tests import test_config
+
+
+class TestPipelineBenchmark(test_config.BasicTestHarness):
+    @timed(60)
+    def test_benchmark(self):
+        config = self.basic_config.copy()
+        config.AcquireImagesProcess.simulated_frame_rate = 10
+        config.AcquireImagesProcess.camera_parameter_update_interval = 0.2
+        config.AcquireImagesProcess.capture_geometry_configuration = [('Width', '512'), ('Height', '512')]
+        config.BasicPipeline.default_write_enable = 1
+        results = run_pipeline_benchmark(config, duration=3, warmup=2)
+        json.dumps(results)
+        assert results['frames_written'] > 0
+        assert results['frames_delivered'] > 0
+        assert results['geometry']['width'] == 512
+        assert results['cpu_percent']['compressor 0'] is not None
@@ -0,0 +1,93 @@
+import threading
+import time
+
+from nose.tools import assert_raises
+
+from pmc_turbo.camera.pipeline.render_pool import RenderPool
+
+
+def test_files_output_as_rendered():
+    output = []
+    pool = RenderPool(output.append, num_workers=2)
+    job_ids = [pool.submit('job %d' % k, lambda k=k: ['%d_%d' % (k, n) for n in range(3)]) for k in range(4)]
+    assert pool.wait_until_idle(timeout=5)
+    assert sorted(output) == sorted(['%d_%d' % (k, n) for k in range(4) for n in range(3)])
+    for job_id in job_ids:
+        status = pool.get_job_status(job_id)
+        assert status['state'] == 'done'
+        assert status['num_files'] == 3
+    pool.close()
+
+
+def test_failed_job():
+    def render():
+        yield 'first'
+        raise ValueError("bad frame")
+
+    output = []
+    pool = RenderPool(output.append, num_workers=1)
+    job_id = pool.submit('failing job', render)
+    assert pool.wait_until_idle(timeout=5)
+    status = pool.get_job_status(job_id)
+    assert status['state'] == 'failed'
+    assert 'bad frame' in status['error']
+    assert output == ['first']
+    assert pool.get_status()['failed'] == 1
+    pool.close()
+
+
+def test_queue_bounded():
+    release = threading.Event()
+    pool = RenderPool(lambda file_buffer: None, num_workers=1, max_queued_jobs=2)
+
+    def blocked():
+        release.wait()
+        return []
+
+    job_ids = [pool.submit('blocked', blocked)]
+    start = time.time()
+    while pool.get_status()['running'] != 1 and time.time() - start < 5:
+        time.sleep(0.01)
+    job_ids += [pool.submit('blocked', blocked) for k in range(2)]  # one running, two queued
+    with assert_raises(RuntimeError):
+        pool.submit('one too many', blocked)
+    assert pool.get_status()['rejected'] == 1
+    release.set()
+    assert pool.wait_until_idle(timeout=5)
+    assert [pool.get_job_status(job_id)['state'] for job_id in job_ids] == ['done'] * 3
+    pool.close()
+
+
+def test_cancel():
+    release = threading.Event()
+    output = []
+    pool = RenderPool(lambda file_buffer, **kwargs: output.append((file_buffer, kwargs)), num_workers=1)
+
+    def blocked():
+        yield 'first'
+        release.wait()
+        yield 'second'
+
+    running_id = pool.submit('running', blocked, request_id=1, output_kwargs=dict(priority=2))
+    start = time.time()
+    while not output and time.time() - start < 5:
+        time.sleep(0.01)
+    queued_id = pool.submit('queued', lambda: ['never'], request_id=1)
+    other_id = pool.submit('other request', lambda: ['other'], request_id=2)
+    assert pool.cancel(1) == 2
+    release.set()
+    assert pool.wait_until_idle(timeout=5)
+    assert output == [('first', dict(priority=2)), ('other', {})]
+    assert pool.get_job_status(running_id)['state'] == 'cancelled'
+    assert pool.get_job_status(queued_id)['state'] == 'cancelled'
+    assert pool.get_job_status(other_id)['state'] == 'done'
+    assert pool.get_status()['cancelled'] == 2
+    pool.close()
+
+
+def test_synchronous():
+    output = []
+    pool = RenderPool(output.append, num_workers=0)
+    job_id = pool.submit('job', lambda: ['a'])
+    assert output == ['a']
+    assert pool.get_job_status(job_id)['state'] == 'done'
@@ -0,0 +1,107 @@
+import ctypes
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from pmc_turbo.camera.image_processing.image_statistics import compute_frame_statistics
+from pmc_turbo.camera.image_processing.preview_pyramid import make_preview_pyramid
+from pmc_turbo.camera.pipeline.binary_index import percentiles_to_compute
+from pmc_turbo.camera.pipeline.frame_ring import FrameRing
+from pmc_turbo.camera.pipeline.stages import FrameStage, LatestFrameTap, LatestFrameReader, post_statistics
+from pmc_turbo.camera.pycamera.dtypes import chunk_num_bytes, chunk_dtype
+from pmc_turbo.camera.pycamera.geometry import FrameGeometry
+
+
+class CountingStage(FrameStage):
+    def setup(self):
+        self.frame_ids = []
+
+    def process_frame(self, image, chunk_data, frame_info):
+        self.frame_ids.append(frame_info['frame_id'])
+        if len(self.frame_ids) == 2:
+            self.input_ring.request_exit()
+
+
+class TestStages(object):
+    def setup(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.geometry = FrameGeometry(width=64, height=32)
+        self.ring = FrameRing(num_slots=4, slot_size=self.geometry.payload_size, num_consumers=2)
+
+    def teardown(self):
+        shutil.rmtree(self.tempdir)
+
+    def publish_frame(self, slot, frame_id, consumers):
+        self.ring.mark_filling(slot)
+        payload = self.ring.get_slot_buffer(slot)[:self.geometry.payload_size]
+        image = payload[:self.geometry.image_num_bytes].view('uint16').reshape(self.geometry.image_shape)
+        image[:] = np.arange(image.size, dtype=np.uint16).reshape(image.shape) + frame_id
+        chunk = np.zeros((1,), dtype=chunk_dtype)
+        chunk['exposure_us'] = 1000 * frame_id
+        payload[-chunk_num_bytes:] = chunk.view('uint8')
+        info = self.ring.get_slot_info(slot)
+        info['frame_id'] = frame_id
+        info['is_filled'] = 1
+        self.ring.publish(slot, consumers=consumers)
+        return image.copy()
+
+    def test_stage_releases_frames(self):
+        stage = CountingStage('counter')
+        stage.attach(self.ring, consumer_index=1, status=mp.Array(ctypes.c_char, 32), geometry=self.geometry)
+        self.publish_frame(0, 5, consumers=[0, 1])
+        self.publish_frame(1, 6, consumers=[1])
+        stage.run()
+        assert stage.frame_ids == [5, 6]
+        assert stage.status.value == 'exiting'
+        # slot 0 is still held by consumer 0, slot 1 was only published to the stage
+        assert self.ring.get_free_slots() == [1, 2, 3]
+
+    def test_latest_frame_tap(self):
+        filename = os.path.join(self.tempdir, 'latest_frame')
+        tap = LatestFrameTap(filename, preview_factors=[2, 4], hot_pixels=[(0, 0)])
+        tap.attach(self.ring, consumer_index=1, status=mp.Array(ctypes.c_char, 32), geometry=self.geometry)
+        tap.setup()
+        reader = LatestFrameReader(filename)
+        assert reader.read() is None
+        assert reader.read_preview(1 / 4.) is None
+        assert reader.get_sequence() == 0
+
+        sequences = []
+        for slot, frame_id in enumerate([3, 4]):
+            expected = self.publish_frame(slot, frame_id, consumers=[1])
+            slot = self.ring.get_next_filled(1)
+            payload = self.ring.get_slot_buffer(slot)[:self.geometry.payload_size]
+            image = payload[:self.geometry.image_num_bytes].view('uint16').reshape(self.geometry.image_shape)
+            tap.process_frame(image, payload[-chunk_num_bytes:].view(chunk_dtype)[0], self.ring.get_slot_info(slot)[0])
+            self.ring.release(slot, 1)
+            sequences.append(reader.get_sequence())
+        assert 0 < sequences[0] < sequences[1]
+
+        image, record = reader.read()
+        assert np.all(image == expected)
+        assert record['frame_id'] == 4
+        assert record['exposure_us'] == 4000
+        assert record['filename'] == ''
+        assert record['percentile_100'] == 0
+
+        factor, preview, record = reader.read_preview(1 / 4.)
+        assert factor == 4
+        assert np.all(preview == make_preview_pyramid(expected, [2, 4], hot_pixel_masker=tap.hot_pixel_masker)[1])
+        assert record['frame_id'] == 4
+        assert reader.read_preview(1.) is None
+
+        # statistics posted by a compressor are only used for the frame they describe
+        post_statistics(tap.table, 0, 3, compute_frame_statistics(expected - 1, percentiles_to_compute))
+        assert reader.read()[1]['percentile_100'] == 0
+        post_statistics(tap.table, 0, 4, compute_frame_statistics(expected, percentiles_to_compute))
+        image, record = reader.read()
+        assert record['percentile_100'] == expected.max()
+        assert record['histogram_0'] > 0
+
+        # the file is replaced when the pipeline restarts
+        LatestFrameTap(filename).attach(self.ring, consumer_index=1, status=mp.Array(ctypes.c_char, 32),
+                                        geometry=self.geometry)
+        assert reader.read() is None
@@ -0,0 +1,75 @@
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from nose.tools import assert_raises
+
+from pmc_turbo.camera.pipeline.status_table import (StatusTable, StatusTableReader, make_record_dtype,
+                                                    process_status_dtype)
+
+
+def set_status(status, value):
+    status.value = value
+
+
+class TestStatusTable(object):
+    def setup(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'status')
+        self.metrics_dtype = make_record_dtype([('frames', np.int64), ('rate', np.float64)])
+        self.table = StatusTable(self.filename, [('processes', process_status_dtype, 2),
+                                                 ('metrics', self.metrics_dtype, 1)])
+
+    def teardown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_update_and_read(self):
+        self.table.update('processes', 1, name='writer')
+        status = self.table.get_status_value(1)
+        status.value = 'waiting'
+        self.table.update('metrics', 0, frames=12, rate=2.5)
+
+        reader = StatusTable.open(self.filename)
+        assert reader.section_names == ['processes', 'metrics']
+        record = reader.read('processes', 1)
+        assert record['name'] == 'writer'
+        assert record['status'] == 'waiting'
+        assert record['pid'] == os.getpid()
+        assert record['sequence'] % 2 == 0
+        metrics = reader.read('metrics', 0)
+        assert metrics['frames'] == 12 and metrics['rate'] == 2.5
+        assert status.value == 'waiting'
+        # updates after opening are visible to the reader
+        self.table.update('metrics', 0, frames=13)
+        assert reader.read('metrics', 0)['frames'] == 13
+
+    def test_status_pid_after_fork(self):
+        status = self.table.get_status_value(0)
+        child = mp.Process(target=set_status, args=(status, 'running'))
+        child.start()
+        child.join()
+        record = self.table.read('processes', 0)
+        assert record['status'] == 'running'
+        assert record['pid'] == child.pid
+
+    def test_reader_follows_replaced_file(self):
+        reader = StatusTableReader(self.filename)
+        self.table.update('metrics', 0, frames=1)
+        assert reader.get_table().read('metrics', 0)['frames'] == 1
+        table = StatusTable(self.filename, [('metrics', self.metrics_dtype, 1)])
+        table.update('metrics', 0, frames=2)
+        assert reader.get_table().section_names == ['metrics']
+        assert reader.get_table().read('metrics', 0)['frames'] == 2
+
+    def test_inconsistent_read(self):
+        self.table.sections['metrics']['sequence'][0] = 1  # a writer is part way through an update
+        with assert_raises(RuntimeError):
+            StatusTable.open(self.filename).read('metrics', 0, max_tries=3)
+
+    def test_not_a_status_table(self):
+        with open(self.filename, 'w') as fh:
+            fh.write('not a status table')
+        with assert_raises(ValueError):
+            StatusTable.open(self.filename)
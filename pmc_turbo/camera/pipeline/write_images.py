@@ -2,52 +2,58 @@ import logging
 import multiprocessing as mp
 import os
 import time
-from Queue import Empty as EmptyException
 
 logger = logging.getLogger(__name__)
 
-
-import numpy as np
-
-from pmc_turbo.camera.image_processing.blosc_file import write_image_blosc
-from pmc_turbo.camera.pycamera.dtypes import frame_info_dtype, chunk_num_bytes, chunk_dtype
+from pmc_turbo.camera.image_processing.blosc_file import write_compressed_blosc
+from pmc_turbo.camera.image_processing.container_file import SegmentWriter
+from pmc_turbo.camera.image_processing.preview_pyramid import get_preview_filename
+from pmc_turbo.camera.pipeline.binary_index import (BinaryIndexWriter, fill_frame_record, index_keys,
+                                                    percentiles_to_compute, percentile_keys, histogram_keys,
+                                                    statistics_keys)
+from pmc_turbo.camera.pycamera.geometry import full_frame_geometry
 from pmc_turbo.utils.watchdog import setup_reset_watchdog
 
-percentiles_to_compute = [0,1,10,20,30,40,50,60,70,80,90,99,100]
-percentile_keys = ['percentile_%d' % k for k in percentiles_to_compute]
-
-index_file_name = 'index.csv'
-index_keys = ['file_index',
-              'write_timestamp',
-              'frame_timestamp_ns',
-              'frame_status',
-              'frame_id',
-              'acquisition_count',
-              'lens_status',
-              'focus_step',
-              'aperture_stop',
-              'exposure_us',
-              'gain_db',
-              'focal_length_mm',
-              'filename'] + percentile_keys
-index_file_header = ",".join(index_keys) + '\n'
+# frame info fields used to build the file name
+frame_info_keys = ['frame_id', 'timestamp', 'frame_status']
+
+index_file_name = 'index.bin'
 
 DISK_MIN_BYTES_AVAILABLE = 100*1024*1024 # 100 MiB
 
 
+def get_bytes_available(directory):
+    stats = os.statvfs(directory)
+    return stats.f_bavail*stats.f_frsize
+
 
 class WriteImageProcess(object):
-    def __init__(self, input_buffers, input_queue, output_queue, info_buffer, status, output_dir,
-                 available_disks, write_enable, rate_limit_interval, use_watchdog):
-        self.data_buffers = input_buffers
-        self.input_queue = input_queue
-        self.output_queue = output_queue
-        self.info_buffer = info_buffer
+    def __init__(self, input_rings, consumer_index, disk_statistics, status, output_dir,
+                 available_disks, write_enable, rate_limit_interval, use_watchdog, geometry=full_frame_geometry,
+                 index_flush_interval=1.0, index_flush_records=1, latency_log=None, segment_size=0,
+                 poll_interval=0.01):
+        """
+        Write compressed frames to disk and index them
+
+        segment_size : int
+            If nonzero, append frames to segment files of about this many bytes (see container_file.py) instead of
+            writing each frame and its preview to their own files. The index then refers to frames by segment
+            reference instead of filename.
+        """
+        self.input_rings = input_rings
+        self.consumer_index = consumer_index
+        self.disk_statistics = disk_statistics
+        self.poll_interval = poll_interval
         self.original_disks = available_disks
         self.available_disks = self.check_disk_space(self.original_disks)
         self.write_enable = write_enable
         self.rate_limit_interval = rate_limit_interval
         self.use_watchdog=use_watchdog
+        self.geometry = geometry
+        self.index_flush_interval = index_flush_interval
+        self.index_flush_records = index_flush_records
+        self.latency_log = latency_log
+        self.segment_size = segment_size
         if rate_limit_interval:
             logger.info("Rate limiting writer thread for disks %r to %d second intervals"
                         % (self.available_disks, self.rate_limit_interval))
@@ -59,18 +65,30 @@ class WriteImageProcess(object):
                 logger.exception("Error creating data directory %s" % dname)
         self.disk_to_use = 0
         self.status = status
+        self.tuning = None  # ProcessTuning applied when the process starts
         if self.output_dirs:
             self.status.value = "starting"
         else:
             self.status.value = "no disk space"
             self.write_enable.value = False
+            self.deactivate()
         self.child = mp.Process(target=self.run)
 
+    def deactivate(self):
+        for ring in self.input_rings:
+            ring.deactivate_consumer(self.consumer_index)
+
+    def get_next_compressed_frame(self):
+        for ring in self.input_rings:
+            slot = ring.get_next_filled(self.consumer_index)
+            if slot is not None:
+                return ring, slot
+        return None, None
+
     def check_disk_space(self,directories):
         directories_with_free_space = []
         for disk in directories:
-            stats = os.statvfs(disk)
-            bytes_available = stats.f_bavail*stats.f_frsize
+            bytes_available = get_bytes_available(disk)
             if bytes_available > DISK_MIN_BYTES_AVAILABLE:
                 directories_with_free_space.append(disk)
             else:
@@ -78,93 +96,109 @@ class WriteImageProcess(object):
         return directories_with_free_space
 
     def run(self):
+        if self.tuning is not None:
+            self.tuning.apply()
         if not self.available_disks:
             logger.warning("No disk space available on any of %s, exiting" % (' '.join(self.original_disks)))
             return
         frame_indexes = dict([(dirname,0) for dirname in self.output_dirs])
-        for dirname in self.output_dirs:
-            with open(os.path.join(dirname,index_file_name),'w') as fh:
-                fh.write(index_file_header)
-        while True:
-            try:
-                process_me = self.input_queue.get_nowait()
-            except EmptyException:
+        index_writers = dict([(dirname, BinaryIndexWriter(os.path.join(dirname, index_file_name),
+                                                          flush_interval=self.index_flush_interval,
+                                                          flush_records=self.index_flush_records))
+                              for dirname in self.output_dirs])
+        segment_writers = {}
+        if self.segment_size:
+            segment_writers = dict([(dirname, SegmentWriter(dirname, segment_size=self.segment_size))
+                                    for dirname in self.output_dirs])
+        while not self.input_rings[0].exit_requested:
+            ring, process_me = self.get_next_compressed_frame()
+            if process_me is None:
                 self.status.value = "waiting"
-                time.sleep(0.1)
+                for index_writer in index_writers.values():
+                    index_writer.flush_if_due()
+                time.sleep(self.poll_interval)
                 continue
-            if process_me is None:
-                self.status.value = "exiting"
-                logger.info("Exiting normally")
-                break
-            else:
-                self.status.value = "checking disk"
-                self.output_dirs = self.check_disk_space(self.output_dirs)
-                if not self.output_dirs:
-                    self.status.value = "no disk space"
-                    logger.warning("No disk space available on any of %s, exiting" % (' '.join(self.original_disks)))
-                    break
-                if self.disk_to_use >= len(self.output_dirs):
-                    self.disk_to_use = 0
-                self.status.value = "waiting for lock"
-                with self.data_buffers[process_me].get_lock():
-                    self.status.value = "processing %d" % process_me
-                    logger.debug(self.status.value)
-
-                    image_buffer = np.frombuffer(self.data_buffers[process_me].get_obj(), dtype='uint16')
-                    npy_info_buffer = np.frombuffer(self.info_buffer[process_me].get_obj(),dtype=frame_info_dtype)
-                    info = dict([(k,npy_info_buffer[0][k]) for k in frame_info_dtype.fields.keys()])
-                    chunk_data = image_buffer.view('uint8')[-chunk_num_bytes:].view(chunk_dtype)[0]
-                    image = image_buffer.view('uint8')[:-chunk_num_bytes].view('uint16')
-
-                    # make filename
-                    ts = time.strftime("%Y-%m-%d_%H%M%S")
-                    info_str = '_'.join([('%s=%r' % (k,v)) for (k,v) in info.items()])
-                    ts = ts + '_' + info_str
-                    dirname = self.output_dirs[self.disk_to_use]
-                    fname = os.path.join(dirname,ts)
-
-                    lens_status = chunk_data['lens_status_focus'] >> 10
-                    focus_step = chunk_data['lens_status_focus'] & 0x3FF
-
-                    #compute some image statistics
-                    self.status.value = "computing statistics"
-                    percentiles = np.percentile(image[::16],percentiles_to_compute)
-                    percentiles_string = ','.join([('%f' % pct) for pct in percentiles])
-
-                    if self.write_enable.value:
-                        self.status.value = "writing %d" % process_me
-                        write_image_blosc(fname, image_buffer)  # write the blosc compressed image to disk
-
-                        # add the file to the index
-                        with open(os.path.join(dirname,index_file_name),'a') as fh:
-                            fh.write('%d,%f,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%s,%s\n' %
-                                     (frame_indexes[dirname],
-                                      time.time(),
-                                      info['timestamp'],
-                                      info['frame_status'],
-                                      info['frame_id'],
-                                      chunk_data['acquisition_count'],
-                                      lens_status,
-                                      focus_step,
-                                      chunk_data['lens_aperture'],
-                                      chunk_data['exposure_us'],
-                                      chunk_data['gain_db'],
-                                      chunk_data['lens_focal_length'],
-                                      fname,
-                                      percentiles_string
-                                      ))
-                        if self.use_watchdog:
-                            setup_reset_watchdog()
-                        if self.rate_limit_interval:
-                            self.status.value = "throttling"
-                            time.sleep(self.rate_limit_interval)
-                    self.disk_to_use = (self.disk_to_use + 1) % len(self.output_dirs) # if this thread is cycling
-                                                                                # between disks, do the cycling here.
-                    frame_indexes[dirname] = frame_indexes[dirname] + 1
-                    self.status.value = "finishing %d" % process_me
-                    self.output_queue.put(process_me)
-
+            self.status.value = "checking disk"
+            self.output_dirs = self.check_disk_space(self.output_dirs)
+            if not self.output_dirs:
+                self.status.value = "no disk space"
+                logger.warning("No disk space available on any of %s, exiting" % (' '.join(self.original_disks)))
+                # Hand the frame back so the compressor can send it to a writer whose disk has space
+                ring.fail(process_me, self.consumer_index)
+                self.deactivate()
+                for writer in index_writers.values() + segment_writers.values():
+                    writer.close()
+                return None
+            if self.disk_to_use >= len(self.output_dirs):
+                self.disk_to_use = 0
+            ring.stamp(process_me, 'write_start')
+            self.status.value = "processing %d" % process_me
+            logger.debug(self.status.value)
+
+            info = ring.get_slot_info(process_me)[0]
+            chunk_data = info['chunk']
+            compressed_data = ring.get_slot_buffer(process_me)[:info['compressed_size']]
+            preview_data = ring.get_slot_buffer(process_me)[info['compressed_size']:
+                                                            info['compressed_size'] + info['preview_size']]
+
+            # make filename
+            ts = time.strftime("%Y-%m-%d_%H%M%S")
+            info_str = '_'.join([('%s=%r' % (k,info[k])) for k in frame_info_keys])
+            ts = ts + '_' + info_str
+            dirname = self.output_dirs[self.disk_to_use]
+            fname = os.path.join(dirname,ts)
+
+            if self.write_enable.value:
+                self.status.value = "writing %d" % process_me
+                start = time.time()
+                try:
+                    if segment_writers:
+                        fname = segment_writers[dirname].append(ts, compressed_data, preview_data)
+                    else:
+                        write_compressed_blosc(fname, compressed_data)  # write the blosc compressed image to disk
+                        if preview_data.shape[0]:
+                            write_compressed_blosc(get_preview_filename(fname), preview_data)
+                except (IOError, OSError):
+                    logger.exception("Failed to write %s, handing frame back to be written elsewhere" % fname)
+                    self.disk_statistics.record_failure(self.consumer_index)
+                    self.status.value = "write failed"
+                    ring.fail(process_me, self.consumer_index)
+                    continue
+                ring.stamp(process_me, 'written')
+
+                # add the file to the index. The frame is on disk by now, so it is not handed back if this fails,
+                # which would write it a second time.
+                try:
+                    record = index_writers[dirname].new_record()
+                    fill_frame_record(record, info, chunk_data, statistics=info, geometry=self.geometry)
+                    record['file_index'] = frame_indexes[dirname]
+                    record['write_timestamp'] = time.time()
+                    record['filename'] = fname
+                    index_writers[dirname].append(record)
+                    ring.stamp(process_me, 'indexed')
+                except (IOError, OSError):
+                    logger.exception("Wrote %s but failed to add it to the index" % fname)
+                bytes_free = get_bytes_available(dirname)
+                self.disk_statistics.record_write(self.consumer_index, duration=time.time() - start,
+                                                  num_bytes=compressed_data.shape[0] + preview_data.shape[0],
+                                                  bytes_free=bytes_free)
+                if self.latency_log is not None:
+                    self.latency_log.append(info['frame_id'], self.consumer_index, ring.stamps[process_me])
+                if self.use_watchdog:
+                    setup_reset_watchdog()
+                if self.rate_limit_interval:
+                    self.status.value = "throttling"
+                    time.sleep(self.rate_limit_interval)
+            self.disk_to_use = (self.disk_to_use + 1) % len(self.output_dirs) # if this thread is cycling
+                                                                        # between disks, do the cycling here.
+            frame_indexes[dirname] = frame_indexes[dirname] + 1
+            self.status.value = "finishing %d" % process_me
+            ring.release(process_me, self.consumer_index)
+
+        for writer in index_writers.values() + segment_writers.values():
+            writer.close()
         self.status.value = "exiting"
+        logger.info("Exiting normally")
         return None
 
 
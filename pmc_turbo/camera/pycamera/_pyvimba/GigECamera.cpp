@@ -10,6 +10,7 @@
 #include <sstream>
 #include <cstring>
 #include <cstdlib>
+#include <unistd.h>
 
 #include "GigECamera.h"
 
@@ -17,6 +18,11 @@ using namespace std;
 
 GigECamera::GigECamera() : m_system ( VimbaSystem::GetInstance() ) {
 	buffer_size = 0;
+	notification_fd = -1;
+}
+
+void GigECamera::SetFrameNotificationFd(int fd) {
+	notification_fd = fd;
 }
 
 uint32_t GigECamera::Connect(const char *ip_string, const uint32_t num_buffers) {
@@ -81,7 +87,7 @@ uint32_t GigECamera::Connect(const char *ip_string, const uint32_t num_buffers)
 		parameter_names.push_back(name->c_str());
 		delete name;
 	}
-	IFrameObserverPtr pObserver(new FrameObserver(m_pCamera));
+	IFrameObserverPtr pObserver(new FrameObserver(m_pCamera, &notification_fd));
 	frame_observer = pObserver;
 	return VmbErrorSuccess;
 
@@ -249,7 +255,8 @@ string GigECamera::GetParameter(const char *name){
 	return value;
 }
 
-FrameObserver::FrameObserver(CameraPtr pCamera) : IFrameObserver(pCamera)
+FrameObserver::FrameObserver(CameraPtr pCamera, const int *p_notification_fd) : IFrameObserver(pCamera),
+		p_notification_fd(p_notification_fd)
 {
 	cout << "Hi from frame observer" << endl;
 }
@@ -267,6 +274,13 @@ void FrameObserver::FrameReceived(FramePtr pFrame)
 	cframe->info->frame_status = frame_status;
 	cframe->info->is_filled = 1;
 	cout << "got frame " << frame_id << " ts: " << timestamp << " id: " << cframe->info->frame_id<< endl;
+	if (*p_notification_fd >= 0) {
+		// wake up anyone waiting for a frame. The pipe is non-blocking, so if it is already full the waiter has
+		// plenty of wake ups pending and dropping this one does no harm.
+		uint8_t wake_byte = 1;
+		ssize_t written = write(*p_notification_fd, &wake_byte, 1);
+		(void)written;
+	}
 	//m_pCamera->QueueFrame(pFrame);
 	delete pFrame.get();
 	pFrame.reset();
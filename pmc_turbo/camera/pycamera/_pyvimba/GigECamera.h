@@ -38,8 +38,11 @@ public:
 	uint32_t GetImage(uint8_t *data, uint64_t &frame_id,
 			uint64_t &timestamp, uint32_t &frame_status);
 	uint32_t QueueFrameFromBuffer(uint8_t *data, uint32_t size, frame_info *p_info);
+	void SetFrameNotificationFd(int fd);
 	uint32_t buffer_size;
 private:
+	// File descriptor written to whenever a frame is received, -1 if disabled
+	int notification_fd;
 	// A reference to the Vimba singleton
 	VimbaSystem &m_system;
     CameraPtr m_pCamera;
@@ -50,8 +53,10 @@ private:
 class FrameObserver : public IFrameObserver
 {
 public:
-	FrameObserver(CameraPtr pCamera);
+	FrameObserver(CameraPtr pCamera, const int *p_notification_fd);
 	void FrameReceived(FramePtr pFrame );
+private:
+	const int *p_notification_fd;
 };
 
 
@@ -24,6 +24,7 @@ cdef extern from "GigECamera.h":
         uint32_t QueueFrameFromBuffer(uint8_t *data, uint32_t size, frame_info *p_info)
         uint32_t StartCapture()
         uint32_t EndCapture()
+        void SetFrameNotificationFd(int fd)
 #        void GetBuffer(PvBuffer *output)
     cdef packed struct frame_info:
         uint64_t frame_id
@@ -70,6 +71,8 @@ cdef class PyCamera:
         info = dict(size=size,frame_id=frame_id,
                     timestamp=timestamp, frame_status=frame_status)
         return info
+    def set_frame_notification_fd(self, int fd):
+        self.c_camera.SetFrameNotificationFd(fd)
     def queue_buffer(self, np.ndarray[np.uint8_t] data, np.ndarray[frame_info] info):
         cdef uint8_t *buffer = <uint8_t *> data.data
         cdef uint32_t size = data.size
@@ -1,40 +1,135 @@
 import Queue
+import errno
 import logging
+import os
 import threading
 import time
 
 import numpy as np
 
-from pmc_turbo.camera.pycamera.dtypes import frame_info_dtype,chunk_num_bytes
+from pmc_turbo.camera.pycamera.dtypes import frame_info_dtype,chunk_num_bytes,chunk_dtype
 
 gt4907_parameter_names = ["AcquisitionAbort", "AcquisitionFrameCount", "AcquisitionFrameRateAbs", "AcquisitionFrameRateLimit", "AcquisitionMode", "AcquisitionStart", "AcquisitionStop", "ActionDeviceKey", "ActionGroupKey", "ActionGroupMask", "ActionSelector", "BandwidthControlMode", "BinningHorizontal", "BinningVertical", "ChunkModeActive", "DSPSubregionBottom", "DSPSubregionLeft", "DSPSubregionRight", "DSPSubregionTop", "DecimationHorizontal", "DecimationVertical", "DefectMaskEnable", "DeviceFirmwareVersion", "DeviceID", "DeviceModelName", "DevicePartNumber", "DeviceScanType", "DeviceTemperature", "DeviceTemperatureSelector", "DeviceUserID", "DeviceVendorName", "EFLensFStopCurrent", "EFLensFStopDecrease", "EFLensFStopIncrease", "EFLensFStopMax", "EFLensFStopMin", "EFLensFStopStepSize", "EFLensFocusCurrent", "EFLensFocusDecrease", "EFLensFocusIncrease", "EFLensFocusMax", "EFLensFocusMin", "EFLensFocusStepSize", "EFLensFocusSwitch", "EFLensID", "EFLensInitialize", "EFLensLastError", "EFLensState", "EFLensZoomCurrent", "EFLensZoomMax", "EFLensZoomMin", "EventAcquisitionEnd", "EventAcquisitionEndFrameID", "EventAcquisitionEndTimestamp", "EventAcquisitionRecordTrigger", "EventAcquisitionRecordTriggerFrameID", "EventAcquisitionRecordTriggerTimestamp", "EventAcquisitionStart", "EventAcquisitionStartFrameID", "EventAcquisitionStartTimestamp", "EventAction0", "EventAction0FrameID", "EventAction0Timestamp", "EventAction1", "EventAction1FrameID", "EventAction1Timestamp", "EventError", "EventErrorFrameID", "EventErrorTimestamp", "EventExposureEnd", "EventExposureEndFrameID", "EventExposureEndTimestamp", "EventExposureStart", "EventExposureStartFrameID", "EventExposureStartTimestamp", "EventFrameTrigger", "EventFrameTriggerFrameID", "EventFrameTriggerReady", "EventFrameTriggerReadyFrameID", "EventFrameTriggerReadyTimestamp", "EventFrameTriggerTimestamp", "EventLine1FallingEdge", "EventLine1FallingEdgeFrameID", "EventLine1FallingEdgeTimestamp", "EventLine1RisingEdge", "EventLine1RisingEdgeFrameID", "EventLine1RisingEdgeTimestamp", "EventLine2FallingEdge", "EventLine2FallingEdgeFrameID", "EventLine2FallingEdgeTimestamp", "EventLine2RisingEdge", "EventLine2RisingEdgeFrameID", "EventLine2RisingEdgeTimestamp", "EventNotification", "EventOverflow", "EventOverflowFrameID", "EventOverflowTimestamp", "EventPtpSyncLocked", "EventPtpSyncLockedFrameID", "EventPtpSyncLockedTimestamp", "EventPtpSyncLost", "EventPtpSyncLostFrameID", "EventPtpSyncLostTimestamp", "EventSelector", "EventsEnable1", "ExposureAuto", "ExposureAutoAdjustTol", "ExposureAutoAlg", "ExposureAutoMax", "ExposureAutoMin", "ExposureAutoOutliers", "ExposureAutoRate", "ExposureAutoTarget", "ExposureMode", "ExposureTimeAbs", "FirmwareVerBuild", "FirmwareVerMajor", "FirmwareVerMinor", "GVCPCmdRetries", "GVCPCmdTimeout", "GVSPAdjustPacketSize", "GVSPBurstSize", "GVSPDriver", "GVSPFilterVersion", "GVSPHostReceiveBuffers", "GVSPMaxLookBack", "GVSPMaxRequests", "GVSPMaxWaitSize", "GVSPMissingSize", "GVSPPacketSize", "GVSPTiltingSize", "GVSPTimeout", "Gain", "GainAuto", "GainAutoAdjustTol", "GainAutoMax", "GainAutoMin", "GainAutoOutliers", "GainAutoRate", "GainAutoTarget", "GainSelector", "Gamma", "GevCurrentDefaultGateway", "GevCurrentIPAddress", "GevCurrentSubnetMask", "GevDeviceMACAddress", "GevHeartbeatInterval", "GevHeartbeatTimeout", "GevIPConfigurationMode", "GevPersistentDefaultGateway", "GevPersistentIPAddress", "GevPersistentSubnetMask", "GevSCPSPacketSize", "GevTimestampControlLatch", "GevTimestampControlReset", "GevTimestampTickFrequency", "GevTimestampValue", "Height", "HeightMax", "ImageSize", "LUTAddress", "LUTBitDepthIn", "LUTBitDepthOut", "LUTEnable", "LUTIndex", "LUTLoadAll", "LUTMode", "LUTSaveAll", "LUTSelector", "LUTSizeBytes", "LUTValue", "MulticastEnable", "MulticastIPAddress", "NonImagePayloadSize", "OffsetX", "OffsetY", "PayloadSize", "PixelFormat", "PtpAcquisitionGateTime", "PtpMode", "PtpStatus", "RecorderPreEventCount", "ReverseX", "ReverseY", "SensorBits", "SensorDigitizationTaps", "SensorHeight", "SensorTaps", "SensorType", "SensorWidth", "StatFrameDelivered", "StatFrameDropped", "StatFrameRate", "StatFrameRescued", "StatFrameShoved", "StatFrameUnderrun", "StatLocalRate", "StatPacketErrors", "StatPacketMissed", "StatPacketReceived", "StatPacketRequested", "StatPacketResent", "StatTimeElapsed", "StreamAnnounceBufferMinimum", "StreamAnnouncedBufferCount", "StreamBufferHandlingMode", "StreamBytesPerSecond", "StreamFrameRateConstrain", "StreamHoldCapacity", "StreamHoldEnable", "StreamID", "StreamType", "StrobeDelay", "StrobeDuration", "StrobeDurationMode", "StrobeSource", "SyncInGlitchFilter", "SyncInLevels", "SyncInSelector", "SyncOutLevels", "SyncOutPolarity", "SyncOutSelector", "SyncOutSource", "TriggerActivation", "TriggerDelayAbs", "TriggerMode", "TriggerOverlap", "TriggerSelector", "TriggerSoftware", "TriggerSource", "UserSetDefaultSelector", "UserSetLoad", "UserSetSave", "UserSetSelector", "VsubValue", "Width", "WidthMax"]
 
 logger = logging.getLogger(__name__)
 
+# Lens status bits reported in the chunk data, see dtypes.decode_lens_status_chunk_data
+LENS_ATTACHED = 0x10
+
 class BasicPyCameraSimulator:
     def __init__(self,ip=None,num_buffers=None):
-        self.bytes_per_image = 3232*4864*2 + chunk_num_bytes
+        # The geometry parameters are simulated so that ROI and binning modes can be exercised without a camera
+        self._geometry_parameters = dict(SensorWidth=4864, SensorHeight=3232, Width=4864, Height=3232, OffsetX=0,
+                                         OffsetY=0, BinningHorizontal=1, BinningVertical=1)
+        # Values of other parameters that have been set, reported back by get_parameter and in the chunk data
+        self._parameters = {}
         self._time_per_image = 0.4
+        self._frame_content = 'empty'
+        self._star_field = None
+        self._frames_delivered = 0
+        self._frames_underrun = 0
         self._buffer_queue = Queue.Queue()
+        self._notification_fd = -1
         self._quit = False
         self._thread = threading.Thread(target=self._run)
         self._thread.daemon = True
         self._thread.start()
 
+    @property
+    def bytes_per_image(self):
+        return self._geometry_parameters['Width']*self._geometry_parameters['Height']*2 + chunk_num_bytes
+
+    def set_frame_rate(self, frame_rate):
+        """
+        Set the rate in frames per second at which queued buffers are filled.
+        """
+        self._time_per_image = 1.0 / frame_rate
+
+    def set_frame_content(self, content):
+        """
+        Choose what is written into each filled buffer
+
+        Parameters
+        ----------
+        content : str
+            'empty' leaves the image unchanged (fastest), 'noise' writes a noisy background and 'stars' writes a
+            drifting star field with hot pixels (see synthetic_star_field.py). Chunk data is written in every case.
+        """
+        if content not in ('empty', 'noise', 'stars'):
+            raise ValueError("Unknown frame content %r" % content)
+        self._frame_content = content
+        self._star_field = None
+        if content != 'empty':
+            # Compute the noisy backgrounds now rather than delaying the first frame
+            self._get_star_field().make_frame(0, self._get_exposure_us())
+
+    def _get_star_field(self):
+        shape = (self._geometry_parameters['Height'], self._geometry_parameters['Width'])
+        if self._star_field is None or self._star_field.shape != shape:
+            from pmc_turbo.camera.image_processing.synthetic_star_field import StarFieldGenerator
+            if self._frame_content == 'stars':
+                self._star_field = StarFieldGenerator(shape=shape)
+            else:
+                self._star_field = StarFieldGenerator(shape=shape, num_stars=0, num_hot_pixels=0)
+        return self._star_field
+
+    def _get_exposure_us(self):
+        return float(self._parameters.get('ExposureTimeAbs', 100000))
+
+    def _fill_buffer(self, data):
+        width = self._geometry_parameters['Width']
+        height = self._geometry_parameters['Height']
+        image_num_bytes = width * height * 2
+        if self._frame_content != 'empty':
+            image = data[:image_num_bytes].view(np.uint16).reshape((height, width))
+            self._get_star_field().make_frame(self._frames_delivered, self._get_exposure_us(), out=image)
+        chunk = np.zeros((1,), dtype=chunk_dtype)
+        chunk['image_chunk_length'] = image_num_bytes
+        chunk['acquisition_count'] = self._frames_delivered
+        focus_step = int(float(self._parameters.get('EFLensFocusCurrent', 0)))
+        chunk['lens_status_focus'] = (LENS_ATTACHED << 10) | (focus_step & 0x3FF)
+        f_stop = float(self._parameters.get('EFLensFStopCurrent', 0))
+        if f_stop:
+            chunk['lens_aperture'] = int(f_stop * 8 + 8)  # inverse of dtypes.decode_aperture_chunk_data
+        chunk['lens_focal_length'] = int(float(self._parameters.get('EFLensZoomCurrent', 0)))
+        chunk['exposure_us'] = int(self._get_exposure_us())
+        chunk['gain_db'] = int(float(self._parameters.get('Gain', 0)))
+        chunk['chunk_length'] = chunk_num_bytes - 16  # excludes the two chunk headers
+        data[image_num_bytes:image_num_bytes + chunk_num_bytes] = chunk.view(np.uint8)
+
     def get_parameter_names(self):
         return gt4907_parameter_names[:]
     def start_capture(self):
         return 0
     def end_capture(self):
         return 0
+    def set_frame_notification_fd(self,fd):
+        self._notification_fd = fd
     def set_parameter_from_string(self,name,value):
+        if name in ('SensorWidth', 'SensorHeight'):
+            return -3
+        if name in self._geometry_parameters:
+            try:
+                self._geometry_parameters[name] = int(value)
+            except ValueError:
+                return -3
+            return 0
         if name in gt4907_parameter_names:
+            self._parameters[name] = str(value)
             return 0
         else:
             return -3
     def get_parameter(self,name):
+        if name == 'PayloadSize':
+            return str(self.bytes_per_image)
+        if name == 'StatFrameDelivered':
+            return str(self._frames_delivered)
+        if name == 'StatFrameUnderrun':
+            return str(self._frames_underrun)
+        if name in self._geometry_parameters:
+            return str(self._geometry_parameters[name])
         if name in gt4907_parameter_names:
-            return "0"
+            return self._parameters.get(name, "0")
         else:
             return 'Error No Such Feature'
     def run_feature_command(self,name):
@@ -70,16 +165,30 @@ class BasicPyCameraSimulator:
             logger.exception("Failed to quit thread")
             pass
     def _run(self):
+        # Frames are produced at a fixed rate. A frame that arrives when no buffer is queued is lost and counted as
+        # an underrun, as on the real camera.
+        next_frame_at = time.time()
         while not self._quit:
+            delay = next_frame_at - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            next_frame_at = max(next_frame_at + self._time_per_image, time.time() - self._time_per_image)
             try:
                 data,info = self._buffer_queue.get(block=False)
-                logger.debug("got buffer, marking it filled")
-                info = info.view(frame_info_dtype)
-                info[0]['is_filled'] = 1
-                info[0]['frame_id'] = 0
-                info[0]['frame_status'] = 0
-                info[0]['timestamp'] = int(time.time()*1e9)
-
             except Queue.Empty:
-                pass
-            time.sleep(self._time_per_image)
\ No newline at end of file
+                self._frames_underrun += 1
+                continue
+            logger.debug("got buffer, marking it filled")
+            self._fill_buffer(data)
+            info = info.view(frame_info_dtype)
+            info[0]['is_filled'] = 1
+            info[0]['frame_id'] = self._frames_delivered
+            info[0]['frame_status'] = 0
+            info[0]['timestamp'] = int(time.time()*1e9)
+            self._frames_delivered += 1
+            if self._notification_fd >= 0:
+                try:
+                    os.write(self._notification_fd, '\x01')
+                except OSError as e:
+                    if e.errno != errno.EAGAIN:
+                        raise
@@ -0,0 +1,102 @@
+"""
+Frame geometry: the size, position and binning of the region the camera reads out.
+
+The pipeline reads the geometry from the camera at startup and sizes its buffers from PayloadSize, so region of
+interest (ROI) and binned capture modes need no code changes. The geometry is recorded in each file header and in the
+index so readers can unpack any frame.
+"""
+from pmc_turbo.camera.pycamera.dtypes import image_dimensions, chunk_num_bytes
+
+# Geometry attribute name -> camera parameter name
+camera_parameter_names = [('width', 'Width'),
+                          ('height', 'Height'),
+                          ('offset_x', 'OffsetX'),
+                          ('offset_y', 'OffsetY'),
+                          ('binning_horizontal', 'BinningHorizontal'),
+                          ('binning_vertical', 'BinningVertical'),
+                          ('payload_size', 'PayloadSize')]
+
+geometry_keys = [name for name, _ in camera_parameter_names]
+
+BYTES_PER_PIXEL = 2
+
+
+class FrameGeometry(object):
+    def __init__(self, width=image_dimensions[1], height=image_dimensions[0], offset_x=0, offset_y=0,
+                 binning_horizontal=1, binning_vertical=1, payload_size=None):
+        """
+        Parameters
+        ----------
+        width, height : int
+            Size of the image in (binned) pixels
+        offset_x, offset_y : int
+            Position of the region of interest on the sensor
+        binning_horizontal, binning_vertical : int
+        payload_size : int
+            Bytes in each frame buffer, including the chunk data. Computed from the image size if not given.
+        """
+        self.width = int(width)
+        self.height = int(height)
+        self.offset_x = int(offset_x)
+        self.offset_y = int(offset_y)
+        self.binning_horizontal = int(binning_horizontal)
+        self.binning_vertical = int(binning_vertical)
+        if payload_size is None:
+            payload_size = self.image_num_bytes + chunk_num_bytes
+        self.payload_size = int(payload_size)
+        if self.payload_size < self.image_num_bytes + chunk_num_bytes:
+            raise ValueError("Payload size %d is too small for a %d x %d image with chunk data"
+                             % (self.payload_size, self.width, self.height))
+
+    @property
+    def image_shape(self):
+        return (self.height, self.width)
+
+    @property
+    def image_num_bytes(self):
+        return self.width * self.height * BYTES_PER_PIXEL
+
+    @property
+    def is_full_frame(self):
+        return self == full_frame_geometry
+
+    def to_dict(self):
+        return dict([(name, getattr(self, name)) for name in geometry_keys])
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**dict([(str(name), d[name]) for name in geometry_keys if name in d]))
+
+    def __eq__(self, other):
+        return isinstance(other, FrameGeometry) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'FrameGeometry(%s)' % ', '.join(['%s=%d' % (name, getattr(self, name)) for name in geometry_keys])
+
+
+full_frame_geometry = FrameGeometry()
+
+
+def query_geometry(pc):
+    """
+    Read the current frame geometry from a camera
+
+    Parameters
+    ----------
+    pc : PyCamera
+
+    Returns
+    -------
+    FrameGeometry
+    """
+    values = {}
+    for name, parameter_name in camera_parameter_names:
+        value = pc.get_parameter(parameter_name)
+        try:
+            values[name] = int(value)
+        except ValueError:
+            raise RuntimeError("Could not read camera parameter %s, got %r" % (parameter_name, value))
+    return FrameGeometry(**values)
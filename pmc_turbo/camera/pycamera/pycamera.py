@@ -1,4 +1,8 @@
+import errno
+import fcntl
 import logging
+import os
+import select
 import time
 
 import numpy as np
@@ -21,6 +25,49 @@ class PyCamera():
         self._num_buffers = num_buffers
         self.exposure_counts = 0
         self.parameter_names = self._pc.get_parameter_names()
+        self._notification_read_fd = None
+        self._notification_write_fd = None
+
+    def enable_frame_notification(self):
+        """
+        Ask the camera to signal every received frame through a pipe, so that wait_for_frame can block instead of
+        polling the is_filled flags of the queued buffers.
+        """
+        if self._notification_read_fd is not None:
+            return
+        read_fd, write_fd = os.pipe()
+        for fd in (read_fd, write_fd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._notification_read_fd = read_fd
+        self._notification_write_fd = write_fd
+        self._pc.set_frame_notification_fd(write_fd)
+
+    def wait_for_frame(self, timeout):
+        """
+        Block until the camera signals that a frame was received, or until *timeout* seconds have elapsed.
+
+        enable_frame_notification must have been called first.
+
+        Parameters
+        ----------
+        timeout : float
+            Maximum time to wait in seconds
+
+        Returns
+        -------
+        True if at least one frame was received while waiting, False on timeout.
+        """
+        readable, _, _ = select.select([self._notification_read_fd], [], [], max(timeout, 0))
+        if not readable:
+            return False
+        try:
+            while os.read(self._notification_read_fd, 4096):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+        return True
 
     def get_all_parameters(self):
         return dict([(name, self.get_parameter(name)) for name in self.parameter_names])
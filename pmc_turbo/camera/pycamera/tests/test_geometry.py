@@ -0,0 +1,33 @@
+from nose.tools import assert_raises
+
+from pmc_turbo.camera.pycamera.pycamera import PyCamera
+from pmc_turbo.camera.pycamera.dtypes import image_dimensions, chunk_num_bytes
+from pmc_turbo.camera.pycamera.geometry import FrameGeometry, full_frame_geometry, query_geometry
+
+
+def test_full_frame_geometry():
+    assert full_frame_geometry.image_shape == image_dimensions
+    assert full_frame_geometry.is_full_frame
+    assert FrameGeometry.from_dict(full_frame_geometry.to_dict()) == full_frame_geometry
+
+
+def test_payload_too_small():
+    with assert_raises(ValueError):
+        FrameGeometry(width=100, height=100, payload_size=100 * 100 * 2)
+
+
+def test_query_geometry():
+    pc = PyCamera(use_simulated_camera=True)
+    assert query_geometry(pc) == full_frame_geometry
+    pc.set_parameter('BinningHorizontal', 2)
+    pc.set_parameter('BinningVertical', 2)
+    pc.set_parameter('Width', 1000)
+    pc.set_parameter('Height', 800)
+    pc.set_parameter('OffsetX', 16)
+    geometry = query_geometry(pc)
+    assert not geometry.is_full_frame
+    assert geometry.image_shape == (800, 1000)
+    assert geometry.binning_horizontal == 2
+    assert geometry.offset_x == 16
+    assert geometry.payload_size == 1000 * 800 * 2 + chunk_num_bytes
+    assert pc._pc.bytes_per_image == geometry.payload_size
@@ -1,6 +1,6 @@
 import numpy as np
 from pmc_turbo.camera.pycamera.pycamera import PyCamera
-from pmc_turbo.camera.pycamera.dtypes import image_dimensions
+from pmc_turbo.camera.pycamera.dtypes import image_dimensions, frame_info_dtype, chunk_dtype
 
 def test_pycamera_methods():
     pc = PyCamera(use_simulated_camera=True)
@@ -10,4 +10,36 @@ def test_pycamera_methods():
     pc.get_timestamp()
     pc.get_image()
     pc.get_image_with_info()
-    pc.get_image_into_buffer(np.zeros(image_dimensions,dtype='uint16'))
\ No newline at end of file
+    pc.get_image_into_buffer(np.zeros(image_dimensions,dtype='uint16'))
+
+def test_wait_for_frame():
+    pc = PyCamera(use_simulated_camera=True)
+    pc.enable_frame_notification()
+    assert not pc.wait_for_frame(timeout=0)
+    data = np.zeros((pc._pc.bytes_per_image,), dtype='uint8')
+    info = np.zeros((1,), dtype=frame_info_dtype)
+    pc._pc.queue_buffer(data, info)
+    assert pc.wait_for_frame(timeout=2)
+    assert info[0]['is_filled']
+    pc._pc.quit()
+
+def test_simulated_frame_content():
+    pc = PyCamera(use_simulated_camera=True)
+    pc.set_parameter('Width', 256)
+    pc.set_parameter('Height', 128)
+    pc.set_parameter('ExposureTimeAbs', 100000)
+    pc._pc.set_frame_rate(50)
+    pc._pc.set_frame_content('stars')
+    pc.enable_frame_notification()
+    data = np.zeros((pc._pc.bytes_per_image,), dtype='uint8')
+    info = np.zeros((1,), dtype=frame_info_dtype)
+    pc._pc.queue_buffer(data, info)
+    assert pc.wait_for_frame(timeout=2)
+    assert info[0]['is_filled']
+    image = data[:256 * 128 * 2].view('uint16')
+    assert image.mean() > 500
+    assert int(pc.get_parameter('StatFrameDelivered')) == 1
+    chunk = data[256 * 128 * 2:].view(chunk_dtype)[0]
+    assert chunk['exposure_us'] == 100000
+    assert chunk['image_chunk_length'] == 256 * 128 * 2
+    pc._pc.quit()
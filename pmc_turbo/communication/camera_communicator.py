@@ -19,6 +19,8 @@ from pymodbus.exceptions import ConnectionException
 from traitlets import Int, Unicode, Bool, List, Float, Tuple, TCPAddress, Enum
 
 import pmc_turbo.housekeeping.bmon
+from pmc_turbo.camera.pipeline.basic_pipeline import read_status_table
+from pmc_turbo.camera.pipeline.status_table import StatusTableReader
 from pmc_turbo.utils.uptime import get_uptime
 from pmc_turbo.utils.watchdog import get_watchdog_info
 from pmc_turbo.communication import housekeeping_classes
@@ -117,6 +119,8 @@ class Communicator(GlobalConfiguration):
                 controller_uri = 'PYRO:controller@%s:%d' % ('0.0.0.0', self.controller_pyro_port)
                 self.controller = Pyro4.Proxy(controller_uri)
 
+        self.status_table_reader = StatusTableReader(self.status_table_filename)
+
         self.peer_polling_order_idx = 0
         self.peer_polling_order = self.initial_peer_polling_order
 
@@ -568,6 +572,12 @@ class Communicator(GlobalConfiguration):
     def run_shell_command(self, command_line, max_num_bytes_returned, request_id, timeout):
         self.controller.run_shell_command(command_line, max_num_bytes_returned, request_id, timeout)
 
+    def cancel_request(self, request_id):
+        self.controller.cancel_request(request_id)
+
+    def prioritize_request(self, request_id, priority):
+        self.controller.prioritize_request(request_id, priority)
+
     def flush_downlink_queues(self):
         self.controller.flush_downlink_queue()
         for link in self.downlinks.values():
@@ -657,6 +667,26 @@ class Communicator(GlobalConfiguration):
 
     ###################################################################################################################
 
+    def get_pipeline_status(self):
+        """
+        Get the pipeline status, reading the process and camera status from the pipeline's shared status table on this
+        computer and only the disk and latency extras from the controller
+
+        Returns
+        -------
+        dict in the format of BasicPipeline.get_status, or None if the pipeline is not running
+        """
+        extra_status = self.controller.get_pipeline_extra_status()
+        if extra_status is None:
+            return None
+        try:
+            status = read_status_table(self.status_table_reader.get_table())
+        except (IOError, OSError, ValueError, RuntimeError):
+            # The pipeline is on another computer
+            return self.controller.get_pipeline_status()
+        status.update(extra_status)
+        return status
+
     def one_byte_summary(self, timestamp):
         clock_offset = time.time() - timestamp
         try:
@@ -668,7 +698,7 @@ class Communicator(GlobalConfiguration):
         status = None
         if controller_alive:
             try:
-                status = self.controller.get_pipeline_status()
+                status = self.get_pipeline_status()
             except Pyro4.errors.CommunicationError:
                 pass
         pipeline_alive = (status is not None)
@@ -805,6 +835,16 @@ class Communicator(GlobalConfiguration):
         except Exception:
             logger.exception("Failed to get downlink_queue_depth from controller")
             ss.downlink_queue_depth = np.nan
+        try:
+            depths = self.controller.get_downlink_queue_depths()
+            ss.downlink_queue_depth_urgent = depths['urgent']
+            ss.downlink_queue_depth_requested = depths['requested']
+            ss.downlink_queue_depth_standard = depths['standard']
+        except Exception:
+            logger.exception("Failed to get downlink queue depths from controller")
+            ss.downlink_queue_depth_urgent = np.nan
+            ss.downlink_queue_depth_requested = np.nan
+            ss.downlink_queue_depth_standard = np.nan
         ss.free_disk_root_mb = self.housekeeping.get_recent_value("df-root_df_complex-free") / 1e6
         ss.free_disk_var_mb = self.housekeeping.get_recent_value("df-var_df_complex-free") / 1e6
         ss.free_disk_data_1_mb = self.housekeeping.get_recent_value("df-data1_df_complex-free") / 1e6
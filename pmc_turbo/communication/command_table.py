@@ -114,6 +114,12 @@ command_manager.add_command(Command("request_blobs_by_timestamp",
 
 command_manager.add_command(Command("set_trigger_interval",
                                     [("interval", "B")]))
+command_manager.add_command(Command("cancel_request", [("request_id", "I")],
+                                    docstring="Stop rendering and drop queued downlink files of `request_id`"))
+command_manager.add_command(Command("prioritize_request", [("request_id", "I"),
+                                                           ("priority", "B")],
+                                    docstring="Move queued and future downlink files of `request_id` to `priority`.\n"
+                                              "0 is urgent (command replies), 1 requested, 2 standard images"))
 
 # add command to set pyro comm timeout?
 
@@ -154,6 +154,9 @@ class ShortStatusCamera(ShortStatusBase):
                               ("watchdog_status","h"),
                               ("leader_id", "B"),
                               ("downlink_queue_depth", "H"),
+                              ("downlink_queue_depth_urgent", "H"),
+                              ("downlink_queue_depth_requested", "H"),
+                              ("downlink_queue_depth_standard", "H"),
 
                               ("free_disk_root_mb", "I"),
                               ("free_disk_var_mb", "I"),
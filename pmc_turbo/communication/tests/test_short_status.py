@@ -16,6 +16,9 @@ def test_camera_encode():
     ss.load = 1231
     ss.watchdog_status = -600
     ss.downlink_queue_depth = 20
+    ss.downlink_queue_depth_urgent = 2
+    ss.downlink_queue_depth_requested = 15
+    ss.downlink_queue_depth_standard = 3
     ss.free_disk_root_mb = 123000
     ss.free_disk_var_mb = 127000
     ss.free_disk_data_1_mb = 123000
@@ -73,6 +76,9 @@ def test_coerce():
     ss.watchdog_status = -600
     ss.leader_id =0
     ss.downlink_queue_depth = 20
+    ss.downlink_queue_depth_urgent = 2
+    ss.downlink_queue_depth_requested = 15
+    ss.downlink_queue_depth_standard = 3
     ss.free_disk_root_mb = 12300000000 # intentionally > 2^32 to check clipping
     ss.free_disk_var_mb = 16400
     ss.free_disk_data_1_mb = 123000
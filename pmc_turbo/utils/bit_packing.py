@@ -0,0 +1,90 @@
+"""
+Pack uint16 pixels holding fewer than 16 significant bits (e.g. the 12 or 14 bits delivered by the sensor) into a
+dense byte stream, and unpack them again.
+
+Pixels are packed in groups of four. The four pixels of a group are viewed as one little endian uint64 word, shifted
+together so that pixel i occupies bits [i * bits, (i + 1) * bits), and the low bits / 2 bytes of the word are kept.
+Working on whole uint64 words avoids the strided per pixel slicing used in twelve_bit.py, which is several times
+slower. Note that this is not the byte order of the camera's packed pixel formats that twelve_bit.py reads. The words
+are always little endian, whatever the byte order of the host, so packed data can be read on any machine.
+"""
+import numpy as np
+
+PIXELS_PER_GROUP = 4
+
+
+def check_bits(bits):
+    if bits % 2 or not 0 < bits < 16:
+        raise ValueError("Can only pack an even number of bits less than 16, not %r" % bits)
+
+
+def packed_num_bytes(num_values, bits):
+    """
+    Number of bytes pack_bits produces for *num_values* values
+    """
+    num_groups = -(-num_values // PIXELS_PER_GROUP)
+    return num_groups * bits // 2
+
+
+def fits_in_bits(values, bits):
+    return values.size == 0 or int(values.max()) < 2 ** bits
+
+
+def pack_bits(values, bits):
+    """
+    Parameters
+    ----------
+    values : uint16 array
+        Every value must be less than 2**bits (see fits_in_bits), higher bits are discarded
+    bits : int
+        Even number of significant bits
+
+    Returns
+    -------
+    uint8 array of packed_num_bytes(values.size, bits) bytes
+    """
+    check_bits(bits)
+    values = np.ascontiguousarray(values, dtype='<u2').ravel()
+    if values.size % PIXELS_PER_GROUP:
+        values = np.concatenate((values, np.zeros(PIXELS_PER_GROUP - values.size % PIXELS_PER_GROUP,
+                                                  dtype='<u2')))
+    words = values.view('<u8')
+    mask = 2 ** bits - 1
+    packed = words & np.uint64(mask)
+    shifted = np.empty_like(words)
+    for k in range(1, PIXELS_PER_GROUP):
+        np.right_shift(words, np.uint64((16 - bits) * k), out=shifted)
+        shifted &= np.uint64(mask << (bits * k))
+        packed |= shifted
+    # The arithmetic is done in the native byte order, which makes no copy on little endian hosts
+    return packed.astype('<u8', copy=False).view(np.uint8).reshape((-1, 8))[:, :bits // 2].ravel()
+
+
+def unpack_bits(packed, bits, num_values):
+    """
+    Inverse of pack_bits
+
+    Parameters
+    ----------
+    packed : uint8 array or str
+    bits : int
+    num_values : int
+
+    Returns
+    -------
+    uint16 array of num_values values
+    """
+    check_bits(bits)
+    packed = np.frombuffer(packed, dtype=np.uint8)[:packed_num_bytes(num_values, bits)]
+    group_num_bytes = bits // 2
+    padded = np.zeros((packed.shape[0] // group_num_bytes, 8), dtype=np.uint8)
+    padded[:, :group_num_bytes] = packed.reshape((-1, group_num_bytes))
+    packed_words = padded.view('<u8').ravel()
+    mask = 2 ** bits - 1
+    words = packed_words & np.uint64(mask)
+    shifted = np.empty_like(packed_words)
+    for k in range(1, PIXELS_PER_GROUP):
+        np.left_shift(packed_words, np.uint64((16 - bits) * k), out=shifted)
+        shifted &= np.uint64(mask << (16 * k))
+        words |= shifted
+    return words.astype('<u8', copy=False).view('<u2')[:num_values].astype(np.uint16, copy=False)
@@ -1,6 +1,6 @@
 import os
 
-from traitlets import (Bool, Int, List, Unicode)
+from traitlets import (Bool, Dict, Int, List, Unicode)
 from traitlets.config import Configurable
 from pmc_turbo import root_dir
 
@@ -24,4 +24,9 @@ class GlobalConfiguration(Configurable):
     housekeeping_dir = Unicode('/var/pmclogs/housekeeping').tag(config=True)
     counters_dir = Unicode('/var/pmclogs/counters').tag(config=True)
     camera_commands_dir = Unicode('/var/pmclogs/camera_commands').tag(config=True)
+    latest_frame_filename = Unicode('/dev/shm/pmc_turbo_latest_frame',
+                                    help="Shared memory file holding the most recent frame").tag(config=True)
+    status_table_filename = Unicode('/dev/shm/pmc_turbo_pipeline_status',
+                                    help="Shared memory file holding the process and camera status").tag(config=True)
+    hot_pixel_file_dictionary = Dict(help="Camera id -> hot pixel file in the camera data directory").tag(config=True)
 
@@ -0,0 +1,154 @@
+"""
+Control where and how urgently a process runs, and keep memory resident.
+
+The flight computers have few cores, and frames are dropped when the acquire process has to wait for a core while the
+compressors are busy. These functions pin processes to cores, set their niceness, lock memory so it is never paged out,
+and allocate memory backed by huge pages. Most of these need privileges (CAP_SYS_NICE to raise priority,
+CAP_IPC_LOCK or a large RLIMIT_MEMLOCK to lock memory, and huge pages reserved in /proc/sys/vm/nr_hugepages), so they
+log a warning and return False instead of raising when a setting can't be applied.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import mmap
+import os
+
+logger = logging.getLogger(__name__)
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+_CPU_SET_NUM_WORDS = 1024 // (8 * ctypes.sizeof(ctypes.c_ulong))
+_cpu_set_type = ctypes.c_ulong * _CPU_SET_NUM_WORDS
+_bits_per_word = 8 * ctypes.sizeof(ctypes.c_ulong)
+
+MAP_HUGETLB = 0x40000
+HUGE_PAGE_SIZE = 2 * 1024 * 1024
+
+
+def _error_message():
+    error = ctypes.get_errno()
+    return '%s (%s)' % (os.strerror(error), errno.errorcode.get(error, error))
+
+
+def get_cpu_affinity():
+    """
+    Return the sorted list of cores this process may run on
+    """
+    mask = _cpu_set_type()
+    if _libc.sched_getaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)):
+        raise OSError(ctypes.get_errno(), _error_message())
+    return [word * _bits_per_word + bit for word in range(_CPU_SET_NUM_WORDS) for bit in range(_bits_per_word)
+            if mask[word] & (1 << bit)]
+
+
+def set_cpu_affinity(cpus):
+    """
+    Restrict this process (and children it starts afterwards) to the cores in *cpus*
+
+    Returns
+    -------
+    bool : True if the affinity was set
+    """
+    mask = _cpu_set_type()
+    for cpu in cpus:
+        mask[cpu // _bits_per_word] |= 1 << (cpu % _bits_per_word)
+    if _libc.sched_setaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)):
+        logger.warning("Could not set CPU affinity to %r: %s" % (list(cpus), _error_message()))
+        return False
+    return True
+
+
+def get_niceness():
+    return os.nice(0)
+
+
+def set_niceness(niceness):
+    """
+    Set the niceness of this process, -20 (most favourable scheduling) to 19. Values below the current niceness need
+    CAP_SYS_NICE.
+
+    Returns
+    -------
+    bool : True if the niceness was set
+    """
+    try:
+        os.nice(niceness - os.nice(0))
+    except OSError as e:
+        logger.warning("Could not set niceness to %d: %s" % (niceness, e))
+        return False
+    return get_niceness() == niceness
+
+
+def lock_memory(address, num_bytes):
+    """
+    Lock the pages from *address* to *address* + *num_bytes* into RAM, faulting them in now
+
+    The lock is held by the calling process and is not inherited by children, but shared memory locked in the parent
+    stays resident for the children too.
+
+    Returns
+    -------
+    bool : True if the memory was locked
+    """
+    if _libc.mlock(ctypes.c_void_p(address), ctypes.c_size_t(num_bytes)):
+        logger.warning("Could not lock %d bytes of memory: %s" % (num_bytes, _error_message()))
+        return False
+    return True
+
+
+def allocate_huge_pages(num_bytes):
+    """
+    Allocate shared anonymous memory backed by huge pages, which is inherited by child processes
+
+    Returns
+    -------
+    mmap of at least *num_bytes* bytes, or None if not enough huge pages are available
+    """
+    num_bytes += -num_bytes % HUGE_PAGE_SIZE
+    try:
+        return mmap.mmap(-1, num_bytes, flags=mmap.MAP_SHARED | MAP_HUGETLB)
+    except (mmap.error, EnvironmentError) as e:
+        logger.warning("Could not allocate %d bytes of huge pages: %s" % (num_bytes, e))
+        return None
+
+
+def format_cpus(cpus):
+    return ','.join(['%d' % cpu for cpu in cpus])
+
+
+class ProcessTuning(object):
+    def __init__(self, cpus=None, niceness=None, status=None):
+        """
+        Settings to apply in a pipeline process when it starts
+
+        Parameters
+        ----------
+        cpus : list of int
+            Cores to run on, None or empty to leave the affinity alone
+        niceness : int
+            Niceness to run at, None to leave it alone
+        status : StatusValue
+            The process's row of the pipeline status table, where the settings in effect are reported
+        """
+        self.cpus = cpus
+        self.niceness = niceness
+        self.status = status
+
+    def apply(self):
+        """
+        Apply the settings, and report the settings in effect afterwards to the status table
+
+        Returns
+        -------
+        bool : True if everything requested was applied
+        """
+        applied = True
+        if self.cpus:
+            applied = set_cpu_affinity(self.cpus) and applied
+        if self.niceness is not None:
+            applied = set_niceness(self.niceness) and applied
+        if self.status is not None:
+            self.status.report_tuning(cpus=format_cpus(get_cpu_affinity()), niceness=get_niceness(),
+                                      tuning_applied=applied)
+        return applied
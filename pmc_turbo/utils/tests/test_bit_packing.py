@@ -0,0 +1,44 @@
+import struct
+
+import numpy as np
+from nose.tools import assert_raises
+
+from pmc_turbo.utils import bit_packing
+
+
+def test_round_trip():
+    random_state = np.random.RandomState(0)
+    for bits in [12, 14]:
+        for num_values in [0, 1, 4, 1001, 4096]:
+            values = random_state.randint(0, 2 ** bits, size=num_values).astype('uint16')
+            packed = bit_packing.pack_bits(values, bits)
+            assert packed.dtype == np.uint8
+            assert packed.size == bit_packing.packed_num_bytes(num_values, bits)
+            assert np.all(bit_packing.unpack_bits(packed, bits, num_values) == values)
+            assert np.all(bit_packing.unpack_bits(packed.tostring(), bits, num_values) == values)
+
+
+def test_extreme_values():
+    values = np.array([2 ** 14 - 1, 0, 2 ** 14 - 1, 1, 2 ** 13, 2 ** 14 - 1], dtype='uint16')
+    assert np.all(bit_packing.unpack_bits(bit_packing.pack_bits(values, 14), 14, values.size) == values)
+
+
+def test_little_endian_layout():
+    values = np.array([1, 2, 3, 4], dtype='uint16')
+    word = 1 | 2 << 12 | 3 << 24 | 4 << 36
+    expected = struct.pack('<Q', word)[:6]
+    assert bit_packing.pack_bits(values, 12).tostring() == expected
+    assert bit_packing.pack_bits(values.astype('>u2'), 12).tostring() == expected
+    assert np.all(bit_packing.unpack_bits(expected, 12, 4) == values)
+
+
+def test_fits_in_bits():
+    assert bit_packing.fits_in_bits(np.array([0, 4095], dtype='uint16'), 12)
+    assert not bit_packing.fits_in_bits(np.array([0, 4096], dtype='uint16'), 12)
+    assert bit_packing.fits_in_bits(np.array([], dtype='uint16'), 12)
+
+
+def test_bad_bits():
+    for bits in [0, 13, 16]:
+        with assert_raises(ValueError):
+            bit_packing.pack_bits(np.zeros(4, dtype='uint16'), bits)
@@ -21,6 +21,8 @@ class BasicTestHarness(object):
             self.basic_config.GlobalConfiguration.log_dir, 'camera_commands')
         self.basic_config.GlobalConfiguration.counters_dir = os.path.join(self.basic_config.GlobalConfiguration.log_dir,
                                                                           'counters')
+        self.basic_config.GlobalConfiguration.latest_frame_filename = os.path.join(
+            self.basic_config.GlobalConfiguration.log_dir, 'latest_frame')
         self.basic_config.GlobalConfiguration.data_directories = disk_dirs
 
     def teardown(self):
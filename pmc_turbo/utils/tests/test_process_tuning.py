@@ -0,0 +1,57 @@
+import ctypes
+import multiprocessing as mp
+
+import numpy as np
+
+from pmc_turbo.utils import process_tuning
+
+
+class FakeStatus(object):
+    def report_tuning(self, **values):
+        self.reported = values
+
+
+def test_cpu_affinity():
+    cpus = process_tuning.get_cpu_affinity()
+    assert cpus
+    assert process_tuning.set_cpu_affinity(cpus)
+    assert process_tuning.get_cpu_affinity() == cpus
+    assert not process_tuning.set_cpu_affinity([1000])
+    assert process_tuning.get_cpu_affinity() == cpus
+
+
+def _raise_niceness(queue):
+    niceness = process_tuning.get_niceness() + 1
+    queue.put((process_tuning.set_niceness(niceness), process_tuning.get_niceness() == niceness))
+
+
+def test_niceness():
+    # Niceness can't be lowered again without privileges, so raise it in a child process
+    queue = mp.Queue()
+    child = mp.Process(target=_raise_niceness, args=(queue,))
+    child.start()
+    assert queue.get(timeout=10) == (True, True)
+    child.join()
+    assert process_tuning.set_niceness(process_tuning.get_niceness())
+
+
+def test_lock_memory():
+    data = np.zeros(2 ** 16, dtype=np.uint8)
+    assert process_tuning.lock_memory(data.ctypes.data, data.nbytes)
+
+
+def test_allocate_huge_pages():
+    # Succeeds only if huge pages are reserved on this machine
+    buffer = process_tuning.allocate_huge_pages(1000)
+    if buffer is not None:
+        assert len(buffer) == process_tuning.HUGE_PAGE_SIZE
+
+
+def test_process_tuning_reports():
+    status = FakeStatus()
+    cpus = process_tuning.get_cpu_affinity()
+    assert process_tuning.ProcessTuning(cpus=cpus, status=status).apply()
+    assert status.reported == dict(cpus=process_tuning.format_cpus(cpus), niceness=process_tuning.get_niceness(),
+                                   tuning_applied=True)
+    assert not process_tuning.ProcessTuning(cpus=[1000], status=status).apply()
+    assert not status.reported['tuning_applied']
@@ -1,4 +1,9 @@
-from pmc_turbo.utils.uptime import get_uptime
+from pmc_turbo.utils.uptime import get_monotonic_time, get_uptime
 
 def test_uptime():
-    assert get_uptime() > 0
\ No newline at end of file
+    assert get_uptime() > 0
+
+def test_monotonic_time():
+    first = get_monotonic_time()
+    assert first > 0
+    assert get_monotonic_time() >= first
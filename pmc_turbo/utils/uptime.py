@@ -1,4 +1,32 @@
+import ctypes
+import ctypes.util
+import os
+
+CLOCK_MONOTONIC = 1
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+_librt = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'), use_errno=True)
+_clock_gettime = _librt.clock_gettime
+_clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+
+
 def get_uptime():
     with open('/proc/uptime') as fh:
         data = fh.read()
-        return float(data.split()[0])
\ No newline at end of file
+        return float(data.split()[0])
+
+
+def get_monotonic_time():
+    """
+    Seconds on the system wide monotonic clock, which all processes share and which does not jump when the system
+    clock is set
+    """
+    timespec = _Timespec()
+    if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(timespec)):
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+    return timespec.tv_sec + timespec.tv_nsec * 1e-9
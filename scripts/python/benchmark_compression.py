@@ -0,0 +1,41 @@
+import argparse
+import glob
+
+import pandas as pd
+
+from pmc_turbo.camera.image_processing import compression_benchmark
+import pmc_turbo.utils.log
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark blosc codecs on archived or synthetic frames. "
+                                                 "Speeds are for a single core.")
+    parser.add_argument('files', nargs='*', help="Archived blosc image files or glob patterns. If none are given, "
+                                                 "synthetic star fields are used.")
+    parser.add_argument('--max-frames', type=int, default=8)
+    parser.add_argument('--codecs', nargs='+', default=compression_benchmark.default_codecs)
+    parser.add_argument('--levels', nargs='+', type=int, default=compression_benchmark.default_levels)
+    parser.add_argument('--shuffles', nargs='+', default=['bit'], choices=['none', 'byte', 'bit'])
+    parser.add_argument('--blocksizes', nargs='+', type=int, default=[0])
+    parser.add_argument('--packed-bits', nargs='+', type=int, default=[0], choices=[0, 12, 14],
+                        help="Pack frames to this many bits per pixel before compressing, 0 for no packing")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', default='', help="Save the results to this CSV file")
+    args = parser.parse_args()
+
+    pmc_turbo.utils.log.setup_stream_handler(level=pmc_turbo.utils.log.logging.INFO)
+
+    filenames = []
+    for pattern in args.files:
+        filenames.extend(sorted(glob.glob(pattern)))
+    if filenames:
+        frames = compression_benchmark.load_frames(filenames[:args.max_frames])
+    else:
+        frames = compression_benchmark.make_synthetic_frames(args.max_frames)
+    print "Benchmarking with %d frames" % len(frames)
+    results = compression_benchmark.benchmark_codecs(frames, codecs=args.codecs, levels=args.levels,
+                                                     shuffles=args.shuffles, blocksizes=args.blocksizes,
+                                                     packed_bits=args.packed_bits, num_repeats=args.repeats)
+    pd.set_option('display.width', 200)
+    print results.sort_values(['ratio'], ascending=False).to_string(index=False)
+    if args.output:
+        results.to_csv(args.output, index=False)
@@ -0,0 +1,69 @@
+import argparse
+import json
+import shutil
+import socket
+import tempfile
+import time
+
+import traitlets.config.loader
+
+from pmc_turbo.camera.pipeline import pipeline_benchmark
+from pmc_turbo.utils.configuration import default_config_dir
+import pmc_turbo.utils.log
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the sustained frame rate of the pipeline using the "
+                                                 "simulated camera. Results are printed as JSON.")
+    parser.add_argument('--config', default='no_hardware.py', help="Configuration file in the default config dir")
+    parser.add_argument('--data-dirs', nargs='+', default=[],
+                        help="Directories to write frames to. Defaults to temporary directories in /dev/shm, "
+                             "one for each of --num-disks. Files written are deleted afterwards only for the "
+                             "temporary directories.")
+    parser.add_argument('--num-disks', type=int, default=4)
+    parser.add_argument('--frame-rate', type=float, default=5.0)
+    parser.add_argument('--frame-content', default='stars', choices=['empty', 'noise', 'stars'])
+    parser.add_argument('--num-buffers', type=int, default=16)
+    parser.add_argument('--num-compressors', type=int, default=4)
+    parser.add_argument('--compression-threads', type=int, default=1)
+    parser.add_argument('--codec', default='lz4')
+    parser.add_argument('--level', type=int, default=9)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=10)
+    parser.add_argument('--output', default='', help="Also append the results as one line of JSON to this file")
+    args = parser.parse_args()
+
+    pmc_turbo.utils.log.setup_stream_handler(level=pmc_turbo.utils.log.logging.INFO)
+
+    config = traitlets.config.loader.load_pyconfig_files([args.config], default_config_dir)
+    log_dir = tempfile.mkdtemp()
+    temporary_dirs = []
+    if args.data_dirs:
+        data_dirs = args.data_dirs
+    else:
+        temporary_dirs = [tempfile.mkdtemp(dir='/dev/shm') for k in range(args.num_disks)]
+        data_dirs = temporary_dirs
+    config.GlobalConfiguration.data_directories = data_dirs
+    config.GlobalConfiguration.log_dir = log_dir
+    config.GlobalConfiguration.housekeeping_dir = log_dir + '/housekeeping'
+    config.GlobalConfiguration.camera_commands_dir = log_dir + '/camera_commands'
+    config.GlobalConfiguration.counters_dir = log_dir + '/counters'
+    config.BasicPipeline.default_write_enable = 1
+    config.BasicPipeline.num_data_buffers = args.num_buffers
+    config.BasicPipeline.num_compressors = args.num_compressors
+    config.BasicPipeline.compression_threads = args.compression_threads
+    config.BasicPipeline.compression_codec = args.codec
+    config.BasicPipeline.compression_level = args.level
+    config.AcquireImagesProcess.simulated_frame_rate = args.frame_rate
+    config.AcquireImagesProcess.simulated_frame_content = args.frame_content
+
+    try:
+        results = pipeline_benchmark.run_pipeline_benchmark(config, duration=args.duration, warmup=args.warmup)
+    finally:
+        for dirname in temporary_dirs + [log_dir]:
+            shutil.rmtree(dirname, ignore_errors=True)
+    results['hostname'] = socket.gethostname()
+    results['timestamp'] = time.strftime("%Y-%m-%d %H:%M:%S")
+    print json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'a') as fh:
+            fh.write(json.dumps(results, sort_keys=True) + '\n')
@@ -0,0 +1,17 @@
+import argparse
+import os
+
+from pmc_turbo.camera.pipeline import binary_index
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert binary frame index files to the index.csv format")
+    parser.add_argument('filenames', nargs='+', help="index.bin files to convert")
+    parser.add_argument('--output', default='', help="Output filename, only valid with a single input file. "
+                                                     "Defaults to index.csv next to each input file.")
+    args = parser.parse_args()
+    if args.output and len(args.filenames) > 1:
+        parser.error("--output can only be used with a single input file")
+    for filename in args.filenames:
+        output = args.output or os.path.join(os.path.dirname(filename), 'index.csv')
+        binary_index.export_csv(filename, output)
+        print "wrote", output
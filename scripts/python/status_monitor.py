@@ -1,4 +1,5 @@
 import curses, curses.wrapper
+import os
 import time
 import Pyro4
 import Pyro4.errors
@@ -22,6 +23,23 @@ important_camera_parameters=[ "AcquisitionFrameCount", "AcquisitionFrameRateAbs"
                              "StreamAnnouncedBufferCount", "StreamBytesPerSecond",
                              "StreamHoldEnable", "StreamID", "StreamType", "TriggerMode", "TriggerSource"]
 
+class StatusTableReader(object):
+    """
+    Read the pipeline status directly from its shared memory status table, for use on the camera computer itself
+    """
+    def __init__(self, filename):
+        self.filename = filename
+
+    def get_status(self):
+        from pmc_turbo.camera.pipeline.basic_pipeline import read_status_table
+        from pmc_turbo.camera.pipeline.status_table import StatusTable
+        # Open the table each time, since it is replaced when the pipeline restarts
+        return read_status_table(StatusTable.open(self.filename))
+
+    def close(self):
+        pass
+
+
 def display_status(stdscr,proxy):
     # Set non-blocking input
     stdscr.nodelay(1)
@@ -42,7 +60,7 @@ def display_status(stdscr,proxy):
             status = proxy.get_status()
             new_data = True
         except (Pyro4.errors.ConnectionClosedError, Pyro4.errors.CommunicationError,
-                Pyro4.errors.TimeoutError):
+                Pyro4.errors.TimeoutError, IOError, ValueError):
             new_data=False
 
         camera_parameters = status.pop('all_camera_parameters',{})
@@ -105,12 +123,16 @@ def display_status(stdscr,proxy):
 if __name__ == "__main__":
     import sys
     import socket
-    try:
-        camera_id = int(sys.argv[1])
-        hostname = 'pmc-camera-%d' % camera_id
-    except Exception:
-        hostname = socket.gethostname()
-    proxy = Pyro4.Proxy('PYRO:pipeline@%s:50000' % hostname)
+    if len(sys.argv) > 1 and os.path.exists(sys.argv[1]):
+        # e.g. /dev/shm/pmc_turbo_pipeline_status
+        proxy = StatusTableReader(sys.argv[1])
+    else:
+        try:
+            camera_id = int(sys.argv[1])
+            hostname = 'pmc-camera-%d' % camera_id
+        except Exception:
+            hostname = socket.gethostname()
+        proxy = Pyro4.Proxy('PYRO:pipeline@%s:50000' % hostname)
     try:
         curses.wrapper(display_status,proxy)
     except KeyboardInterrupt: